@@ -0,0 +1,104 @@
+"""
+Compare the output of convert.merge_datasets on raw_datasets/ with the output of the original converter.
+
+conversion_reference.json keeps a fingerprint of every field of every converted document as the
+original converter wrote it, and the fields already known to differ. The run fails when a field
+differs that is not in the known differences, so a change in the conversion has to be reviewed and
+recorded with --record before it goes in.
+
+    python -m benchmarks.conversion_parity
+    python -m benchmarks.conversion_parity --record
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+
+from convert import merge_datasets
+from utils.util import NpEncoder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE = os.path.join(ROOT, 'benchmarks', 'conversion_reference.json')
+SPLITS = ['train', 'test']
+
+
+def fingerprint(value):
+    """
+    :return: hash of the value as it is written to the jsonl
+    """
+    encoded = json.dumps(value, cls=NpEncoder, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def fingerprint_documents(split):
+    """
+    Convert raw_datasets/<split>/annotations
+    :return: list with the text_id and the fingerprint of each field of the student and annotator documents
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        students, annotators = merge_datasets.convert_annotations(
+            os.path.join(ROOT, 'raw_datasets', split, 'annotations'))
+    return [{'text_id': student['text_id'],
+             'student': {field: fingerprint(value) for field, value in student.items()},
+             'annotators': {field: fingerprint(value) for field, value in annotator.items()}}
+            for student, annotator in zip(students, annotators)]
+
+
+def compare(expected, result):
+    """
+    :return: the fields that differ, as 'student.<field>' and 'annotators.<field>'
+    """
+    if expected['text_id'] != result['text_id']:
+        return ['text_id']
+    return sorted(f'{entity}.{field}' for entity in ('student', 'annotators')
+                  for field in set(expected[entity]) | set(result[entity])
+                  if expected[entity].get(field) != result[entity].get(field))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--record', action='store_true',
+                        help='Write the current differences as the known differences after reviewing them')
+    parser.add_argument('--show', type=int, default=10, help='Number of differences to print')
+    args = parser.parse_args()
+
+    with open(REFERENCE, encoding='utf-8') as file:
+        reference = json.load(file)
+
+    differences = {}
+    unexpected = 0
+    for split in SPLITS:
+        expected_documents = reference['documents'][split]
+        documents = fingerprint_documents(split)
+        if len(documents) != len(expected_documents):
+            print(f'{split}: {len(documents)} documents, the reference has {len(expected_documents)}')
+            sys.exit(1)
+        known = reference['differences'].get(split, {})
+        differences[split] = {}
+        for position, (expected, result) in enumerate(zip(expected_documents, documents)):
+            fields = compare(expected, result)
+            if fields:
+                differences[split][str(position)] = fields
+            new_fields = sorted(set(fields) - set(known.get(str(position), [])))
+            if new_fields:
+                unexpected += 1
+                if unexpected <= args.show:
+                    print(f'{split} position={position} text_id={result["text_id"]}: {", ".join(new_fields)}')
+        print(f'{split}: {len(documents)} documents, {len(differences[split])} differ from the original converter')
+
+    if args.record:
+        reference['differences'] = differences
+        with open(REFERENCE, 'w', encoding='utf-8') as file:
+            json.dump(reference, file, indent=1, sort_keys=True)
+            file.write('\n')
+        print(f'Recorded the differences in {os.path.relpath(REFERENCE, ROOT)}')
+        return
+    print(f'{unexpected} documents with differences that were not reviewed')
+    sys.exit(1 if unexpected else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Import-time budget of the package.
+
+Each module is imported in a fresh interpreter, so the numbers are cold starts. The run fails
+when the median import time goes over the budget or when a heavy dependency is loaded at import.
+
+    python -m benchmarks.import_time --repeat 5 --budget-ms 150
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['utils', 'utils.preprocess', 'utils.labels', 'convert.util', 'convert.merge_datasets',
+           'convert.make_dataset', 'convert.error_detection_dataset', 'statistics']
+# Only loaded on first use, importing any of these is a regression
+HEAVY_MODULES = ['spacy', 'nltk', 'pandas', 'matplotlib', 'seaborn']
+# Modules that need NumPy for their own work
+NUMPY_MODULES = {'utils.labels'}
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, repeat=5):
+    """
+    Import the module in `repeat` fresh interpreters
+    :return: import times in seconds and heavy modules loaded by the import
+    """
+    heavy = HEAVY_MODULES if module in NUMPY_MODULES else HEAVY_MODULES + ['numpy']
+    times = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=heavy)],
+                                cwd=ROOT, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        times.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return times, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=150, help='Maximum median import time of each module')
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = {}
+    failed = False
+    for module in args.modules:
+        times, loaded = measure(module, args.repeat)
+        # Median taken by hand, statistics.median can't be imported: the repository's statistics.py shadows it
+        median = sorted(times)[len(times) // 2] * 1000
+        ok = median <= args.budget_ms and not loaded
+        failed |= not ok
+        report[module] = {'median_ms': round(median, 2), 'max_ms': round(max(times) * 1000, 2), 'heavy_modules': loaded,
+                          'ok': ok}
+        print(f"{module:35} {median:8.1f} ms  {'ok' if ok else 'FAIL'}  {' '.join(loaded)}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'budget_ms': args.budget_ms, 'modules': report}, file, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
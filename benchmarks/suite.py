@@ -0,0 +1,384 @@
+"""
+Benchmarks of the hot paths of the conversion, compared against committed baselines.
+
+Every case runs over the annotation weeks (annotations/Semana*) and reports throughput in
+documents and characters per second, plus the peak memory of one run measured with tracemalloc.
+The scaling cases run over synthetic essays of growing length and report the exponent of
+time ~ length**k, which catches an accidental quadratic path long before the real data grows.
+
+    python -m benchmarks.suite                    # compare with benchmarks/baselines.json
+    python -m benchmarks.suite --update           # store the current numbers as the baselines
+    python -m benchmarks.suite preprocess_text    # only some cases
+
+The run fails when the throughput of a case drops more than --tolerance below its baseline,
+its memory peak grows more than --tolerance over it, or a scaling exponent grows more than
+--exponent-tolerance.
+"""
+import argparse
+import contextlib
+import copy
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from benchmarks.synthetic import generate_documents
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+PUNCTUATION_LABELS = ('Erro de Pontuação', 'Erro de vírgula')
+
+# prepare(documents) returns the input of run, built outside the timer, and the number of
+# documents and characters it covers
+Case = namedtuple('Case', ['name', 'prepare', 'run'])
+
+
+def _size(texts):
+    return len(texts), sum(map(len, texts))
+
+
+def _raw_texts(documents):
+    texts = [text for _, text, _ in documents]
+    return texts, *_size(texts)
+
+
+def _clean_lines(documents):
+    from utils.preprocess import preprocess_text
+
+    texts = ['\n'.join(preprocess_text(text)[1]) for _, text, _ in documents]
+    return texts, *_size(texts)
+
+
+def _memoized_texts(documents):
+    from utils.preprocess import preprocess_text
+
+    texts, docs, chars = _raw_texts(documents)
+    for text in texts:
+        preprocess_text(text)
+    return texts, docs, chars
+
+
+def _split_lines(documents):
+    from utils.preprocess import fix_date, join_split_words, normalize_punctuation, split_lines
+
+    lines = []
+    for _, text, _ in documents:
+        lines.extend(split_lines.__wrapped__(normalize_punctuation(join_split_words(fix_date(text))))[1])
+    return lines, len(documents), sum(map(len, lines))
+
+
+def _gold_spans(documents):
+    from utils import TokenAligner
+
+    work = []
+    for _, text, annotations in documents:
+        spans = [(span[0], span[1]) for _, labels in annotations for span in labels
+                 if span[2] in PUNCTUATION_LABELS and span[0] <= len(text)]
+        work.append((text, TokenAligner(text), spans))
+    return work, len(documents), sum(len(text) for _, text, _ in documents)
+
+
+def _annotation_spans(documents):
+    work = [[(span[0], span[1]) for _, labels in annotations for span in labels] for _, _, annotations in documents]
+    return work, len(documents), sum(len(text) for _, text, _ in documents)
+
+
+def _corrections(documents):
+    from utils.preprocess import preprocess_text
+
+    work = []
+    for _, text, annotations in documents:
+        title, lines = preprocess_text(text)
+        new_text = '\n'.join(lines)
+        spans = [(span[1], span[2]) for _, labels in annotations for span in labels if span[2] in PUNCTUATION_LABELS]
+        work.append((new_text, spans))
+    return work, len(documents), sum(len(text) for text, _ in work)
+
+
+def _documents(documents):
+    # The converters change the labels of the documents in place
+    return copy.deepcopy(documents), *_size([text for _, text, _ in documents])
+
+
+def run_preprocess_text(texts):
+    from utils.preprocess import preprocess_text
+
+    for text in texts:
+        preprocess_text(text)
+
+
+def run_clean_text(lines):
+    from utils.preprocess import clean_text
+
+    for line in lines:
+        clean_text(line)
+
+
+def run_get_gold_token(work):
+    from utils import get_gold_token
+
+    for text, aligner, spans in work:
+        for start_char, end_char in spans:
+            get_gold_token(text, start_char, end_char, aligner=aligner)
+
+
+def run_find_token_span(texts):
+    from utils import find_token_span
+
+    for text in texts:
+        find_token_span(text)
+
+
+def run_span_index(work):
+    from utils.intervals import SpanIndex
+
+    for spans in work:
+        index = SpanIndex()
+        for span in spans:
+            index.insert_if_disjoint(span)
+
+
+def run_fix_punctuation(work):
+    from convert.util import fix_punctuation
+    from utils.offsets import TextEditor
+
+    for text, spans in work:
+        editor = TextEditor(text)
+        for end_char, label in spans:
+            fix_punctuation(editor, end_char - 1, end_char, punct='.' if label == 'Erro de Pontuação' else ',')
+        editor.apply()
+
+
+def run_text2labels(texts):
+    from utils import text2labels
+
+    for text in texts:
+        try:
+            text2labels(text)
+        except ValueError:
+            pass
+
+
+def converter(module):
+    def run(documents):
+        convert_document = __import__(f'convert.{module}', fromlist=['convert_document']).convert_document
+        for document in documents:
+            convert_document(document)
+    return run
+
+
+CASES = [
+    Case('preprocess_text', _raw_texts, run_preprocess_text),
+    Case('preprocess_text_memo', _memoized_texts, run_preprocess_text),
+    Case('clean_text', _split_lines, run_clean_text),
+    Case('get_gold_token', _gold_spans, run_get_gold_token),
+    Case('find_token_span', _clean_lines, run_find_token_span),
+    Case('span_index', _annotation_spans, run_span_index),
+    Case('fix_punctuation', _corrections, run_fix_punctuation),
+    Case('text2labels', _clean_lines, run_text2labels),
+    Case('merge_datasets', _documents, converter('merge_datasets')),
+    Case('make_dataset', _documents, converter('make_dataset')),
+    Case('error_detection_dataset', _documents, converter('error_detection_dataset')),
+    Case('convert_to_spacy_ents', _documents, converter('convert_to_spacy_ents')),
+]
+SCALING_CASES = ['preprocess_text', 'find_token_span', 'text2labels', 'merge_datasets']
+SCALING_WORDS = [125, 250, 500, 1000, 2000]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Hide the debug prints of the functions under test"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def time_case(case, documents, repeat):
+    """
+    Best time of `repeat` runs of the case, the input is prepared again before each run
+    :return: seconds, documents and characters of the input
+    """
+    from utils import memo
+
+    best = math.inf
+    for _ in range(repeat):
+        # Every run starts with an empty memo, the cases that measure it fill it in prepare
+        memo.cache.clear()
+        work, docs, chars = case.prepare(documents)
+        with quiet():
+            start = time.perf_counter()
+            case.run(work)
+            best = min(best, time.perf_counter() - start)
+    return best, docs, chars
+
+
+def peak_memory(case, documents):
+    """Peak of memory allocated by one run of the case, in KiB"""
+    from utils import memo
+
+    memo.cache.clear()
+    work, _, _ = case.prepare(documents)
+    tracemalloc.start()
+    try:
+        with quiet():
+            case.run(work)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def time_read_data(path, repeat):
+    from convert.util import read_data
+
+    best = math.inf
+    for _ in range(repeat):
+        with quiet():
+            start = time.perf_counter()
+            data = read_data(path)
+            best = min(best, time.perf_counter() - start)
+    return best, len(data), int(data['text'].str.len().sum())
+
+
+def slope(xs, ys):
+    """Least squares slope of log(ys) over log(xs)"""
+    xs, ys = [math.log(x) for x in xs], [math.log(y) for y in ys]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+            / sum((x - mean_x) ** 2 for x in xs))
+
+
+def scaling(case, repeat, documents_per_size=8, punctuation_density=0.1):
+    """
+    Time the case over synthetic essays of each length in SCALING_WORDS
+    :return: characters per document, seconds per document and the exponent of the curve
+    """
+    chars, seconds = [], []
+    for words in SCALING_WORDS:
+        documents = generate_documents(documents_per_size, words=words, punctuation_density=punctuation_density)
+        elapsed, docs, size = time_case(case, documents, repeat)
+        chars.append(size / docs)
+        seconds.append(elapsed / docs)
+    return chars, seconds, slope(chars, seconds)
+
+
+def run(names, path, repeat, memory=True):
+    from convert.util import iter_data
+
+    documents = list(iter_data(path))
+    results = {}
+    for case in CASES:
+        if names and case.name not in names:
+            continue
+        elapsed, docs, chars = time_case(case, documents, repeat)
+        results[case.name] = {'seconds': elapsed, 'docs_per_s': docs / elapsed, 'chars_per_s': chars / elapsed}
+        if memory:
+            results[case.name]['peak_kib'] = peak_memory(case, documents)
+        if case.name in SCALING_CASES:
+            sizes, seconds, exponent = scaling(case, repeat)
+            results[case.name]['scaling'] = {'chars': sizes, 'seconds': seconds, 'exponent': exponent}
+        report_case(case.name, results[case.name])
+
+    if not names or 'read_data' in names:
+        elapsed, docs, chars = time_read_data(path, repeat)
+        results['read_data'] = {'seconds': elapsed, 'docs_per_s': docs / elapsed, 'chars_per_s': chars / elapsed}
+        report_case('read_data', results['read_data'])
+    return results
+
+
+def report_case(name, result):
+    line = f"{name:25} {result['seconds'] * 1000:9.1f} ms {result['docs_per_s']:10.0f} docs/s " \
+           f"{result['chars_per_s'] / 1e6:7.2f} Mchars/s"
+    if 'peak_kib' in result:
+        line += f" {result['peak_kib']:9.0f} KiB"
+    if 'scaling' in result:
+        line += f"  n^{result['scaling']['exponent']:.2f}"
+    print(line, flush=True)
+
+
+def compare(results, baselines, tolerance, exponent_tolerance):
+    """
+    Compare the results with the baselines
+    :return: list of messages describing the regressions
+    """
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        if result['chars_per_s'] < baseline['chars_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['chars_per_s'] / 1e6:.2f} Mchars/s, baseline "
+                               f"{baseline['chars_per_s'] / 1e6:.2f} Mchars/s")
+        if 'peak_kib' in result and 'peak_kib' in baseline and \
+                result['peak_kib'] > baseline['peak_kib'] * (1 + tolerance):
+            regressions.append(f"{name}: peak {result['peak_kib']:.0f} KiB, baseline {baseline['peak_kib']:.0f} KiB")
+        if 'scaling' in result and 'scaling' in baseline and \
+                result['scaling']['exponent'] > baseline['scaling']['exponent'] + exponent_tolerance:
+            regressions.append(f"{name}: scales as n^{result['scaling']['exponent']:.2f}, baseline "
+                               f"n^{baseline['scaling']['exponent']:.2f}")
+    return regressions
+
+
+def rounded(value):
+    """Round the floats of the results so the baselines file stays readable"""
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    if isinstance(value, float):
+        return float(f'{value:.4g}')
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cases', nargs='*', help='Only run these cases')
+    parser.add_argument('--annotations', default=os.path.join(ROOT, 'annotations'),
+                        help='Folder with the annotation weeks')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each case, the best one is kept')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc run of each case')
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--update', action='store_true', help='Store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed relative drop of throughput and growth of memory')
+    parser.add_argument('--exponent-tolerance', type=float, default=0.35,
+                        help='Allowed growth of the scaling exponents')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    known = {case.name for case in CASES} | {'read_data'}
+    unknown = set(args.cases) - known
+    if unknown:
+        parser.error(f"Unknown cases {', '.join(sorted(unknown))}, choose from {', '.join(sorted(known))}")
+
+    results = rounded(run(args.cases, args.annotations, args.repeat, memory=not args.no_memory))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.update:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as file:
+                baselines = json.load(file)
+        baselines.update(results)
+        with open(args.baselines, 'w') as file:
+            json.dump(baselines, file, indent=2)
+            file.write('\n')
+        return
+
+    if not os.path.exists(args.baselines):
+        print(f"No baselines at {args.baselines}, run with --update to create them")
+        return
+    with open(args.baselines) as file:
+        baselines = json.load(file)
+    regressions = compare(results, baselines, args.tolerance, args.exponent_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Synthetic Portuguese essays of controlled length and punctuation density, with annotations
+in the same format as the annotators' JSON lines files.
+"""
+import random
+
+WORDS = """
+a o as os um uma de do da dos das em no na nos nas por para com sem sobre entre até depois antes quando
+que se mas porque porém então também muito pouco mais menos sempre nunca ainda já hoje ontem amanhã
+eu ele ela nós eles elas você meu minha seu sua nosso nossa casa escola rua cidade bairro praça rio
+menino menina mãe pai avó amigo amiga professor professora cachorro gato pássaro árvore chuva sol
+dia noite tarde manhã semana ano vez coisa lugar caminho história livro caderno lápis janela porta
+foi era estava ficou chegou saiu voltou correu andou brincou falou disse pensou viu olhou achou
+encontrou levou trouxe comeu bebeu dormiu acordou gostou queria podia tinha fazia sabia conseguiu
+grande pequeno bonito feio feliz triste cansado assustado alegre novo velho forte rápido devagar
+""".split()
+TITLE_WORDS = ['O', 'A', 'Um', 'Uma', 'Dia', 'Noite', 'Passeio', 'Segredo', 'Amigo', 'Chuva', 'Casa', 'Tesouro']
+PERIODS = ['.', '.', '.', '!', '?']
+
+
+def generate_essay(words=300, punctuation_density=0.1, paragraph_words=60, title=True, seed=0):
+    """
+    Generate an essay
+    :param words: number of words of the body
+    :param punctuation_density: probability of a mark after each word
+    :param paragraph_words: mean number of words of a paragraph
+    :param title: start with a [T] title line, as the students' essays
+    :param seed: random seed, the same arguments always give the same essay
+    :return: text of the essay
+    """
+    rng = random.Random(seed)
+    pieces = []
+    if title:
+        pieces.append('[T] ' + ' '.join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 4))) + '\n')
+
+    capitalize = True
+    for i in range(words):
+        word = rng.choice(WORDS)
+        pieces.append(word.capitalize() if capitalize else word)
+        capitalize = False
+        if rng.random() < punctuation_density:
+            mark = ',' if rng.random() < 0.6 else rng.choice(PERIODS)
+            pieces.append(mark)
+            capitalize = mark != ','
+        if i < words - 1:
+            pieces.append('\n' if rng.random() < 1 / paragraph_words else ' ')
+    if pieces[-1] not in PERIODS:
+        pieces.append('.')
+    return ''.join(pieces)
+
+
+def generate_labels(text, error_rate=0.05, seed=0):
+    """
+    Annotate punctuation errors at random word ends of the text
+    :param error_rate: probability of annotating each word end
+    :return: list of [start, end, label] spans, as in the annotation files
+    """
+    rng = random.Random(seed)
+    labels = []
+    start = 0
+    for i, char in enumerate(text):
+        if char.isspace():
+            if i > start and rng.random() < error_rate:
+                label = 'Erro de vírgula' if rng.random() < 0.6 else 'Erro de Pontuação'
+                labels.append([start, i, label])
+            start = i + 1
+    return labels
+
+
+def generate_documents(count, words=300, punctuation_density=0.1, error_rate=0.05, seed=0):
+    """
+    Generate annotated documents as yielded by convert.util.iter_data
+    :return: list of (text_id, text, [(annotator_id, labels), ...]) with two annotators
+    """
+    documents = []
+    for text_id in range(count):
+        text = generate_essay(words, punctuation_density, seed=seed + text_id)
+        annotations = [(annotator_id, generate_labels(text, error_rate, seed=seed + text_id * 2 + annotator_id))
+                       for annotator_id in (1, 2)]
+        documents.append((text_id, text, annotations))
+    return documents
@@ -0,0 +1,85 @@
+"""
+Compare the regex tokenizer with spaCy's blank Portuguese pipeline on the corpus.
+
+Every text of annotations/ and raw_datasets/ is tokenized as it is, after preprocess_text and
+with the punctuation removed as in find_token_span, which covers the texts TokenAligner sees.
+The run fails when any token span differs, and reports the throughput of both backends.
+
+    python -m benchmarks.tokenizer_parity
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from utils.preprocess import preprocess_text
+from utils.tokenizer import RegexTokenizer, SpacyTokenizer
+from utils.util import punctuation_table
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Emoji and other astral characters are rare in the corpus, so they are checked on these texts too
+CASES = ['oi😀tudo bem', '🏠.', 'fim🙂', 'a😀😀b', '(🏠)', '😀, tudo bem?', 'legal👍🏽 e você👋🏿,beleza?',
+         'ok👍🏻.', '👨‍👩‍👧 família', '🇧🇷 Brasil!', 'texto 𝐧𝐞𝐠𝐫𝐢𝐭𝐨 aqui', '♥ amor', 'nota 𝄞 musical']
+
+
+def iter_texts(folders):
+    """
+    :return: generator of (path, id, variant, text), the CASES first
+    """
+    for i, text in enumerate(CASES):
+        yield 'CASES', i, 'raw', text
+    for folder in folders:
+        for path in sorted(glob.glob(os.path.join(ROOT, folder, '**', '*.jsonl'), recursive=True)):
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    document = json.loads(line)
+                    text = document['text']
+                    _, lines = preprocess_text(text)
+                    clean_text = '\n'.join(lines)
+                    variants = {'raw': text, 'preprocessed': clean_text,
+                                'raw_no_punctuation': text.translate(punctuation_table),
+                                'preprocessed_no_punctuation': clean_text.translate(punctuation_table)}
+                    for variant, variant_text in variants.items():
+                        yield os.path.relpath(path, ROOT), document.get('id'), variant, variant_text
+
+
+def first_difference(text, expected, result):
+    for expected_token, token in zip(zip(*expected), zip(*result)):
+        if expected_token != token:
+            return (f'spacy {text[expected_token[0]:expected_token[1]]!r} at {expected_token[0]}, '
+                    f'regex {text[token[0]:token[1]]!r} at {token[0]}')
+    return f'spacy has {len(expected.starts)} tokens, regex has {len(result.starts)}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folders', nargs='*', default=['annotations', 'raw_datasets'])
+    parser.add_argument('--show', type=int, default=10, help='Number of differences to print')
+    args = parser.parse_args()
+
+    texts = list(iter_texts(args.folders))
+    backends = {'spacy': SpacyTokenizer(), 'regex': RegexTokenizer()}
+    results = {}
+    for name, tokenizer in backends.items():
+        tokenizer(texts[0][3])
+        start = time.perf_counter()
+        results[name] = [tokenizer(text) for *_, text in texts]
+        elapsed = time.perf_counter() - start
+        characters = sum(len(text) for *_, text in texts)
+        print(f'{name:6} {elapsed:7.2f} s  {characters / elapsed / 1e6:6.2f} M chars/s')
+
+    differences = 0
+    for (path, text_id, variant, text), expected, result in zip(texts, results['spacy'], results['regex']):
+        if expected != result:
+            differences += 1
+            if differences <= args.show:
+                print(f'{path} id={text_id} {variant}: {first_difference(text, expected, result)}')
+    print(f'{len(texts)} texts, {differences} with different token spans')
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from functools import lru_cache
+
+from convert.parallel import iter_parallel
+from utils import instrument
+
+# Mudanças no código de convert/ e utils/ já invalidam o cache pelo hash das fontes. Aumente a versão quando a
+# conversão mudar por outro motivo, como uma nova versão do SpaCy
+PIPELINE_VERSION = 3
+SOURCE_PACKAGES = ['convert', 'utils']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@lru_cache(maxsize=None)
+def source_hash():
+    """Hash dos arquivos .py dos pacotes usados na conversão, para que qualquer mudança no código invalide o cache"""
+    digest = hashlib.blake2b(digest_size=20)
+    for package in SOURCE_PACKAGES:
+        for root, dirs, files in os.walk(os.path.join(ROOT, package)):
+            dirs.sort()
+            for filename in sorted(files):
+                if not filename.endswith('.py'):
+                    continue
+                path = os.path.join(root, filename)
+                digest.update(os.path.relpath(path, ROOT).replace(os.sep, '/').encode('utf-8'))
+                with open(path, 'rb') as file:
+                    digest.update(file.read())
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """Cache em disco dos documentos convertidos, endereçado pelo hash do texto, das anotações, da versão do pipeline e
+    do código da conversão"""
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024):
+        """
+        :param directory: pasta do cache
+        :param max_size: tamanho máximo em bytes, os arquivos usados há mais tempo são removidos primeiro
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.source_hash = source_hash()
+
+    def key(self, namespace, document, **kwargs):
+        """Hash do documento, dos argumentos da conversão, da versão do pipeline e do código da conversão"""
+        content = json.dumps([PIPELINE_VERSION, self.source_hash, namespace, document, kwargs],
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=20).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """
+        :return: resultado guardado ou None se não estiver no cache
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                result = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # Atualiza a data de acesso usada na remoção dos arquivos mais antigos
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escreve num arquivo temporário para que outro processo nunca leia um arquivo pela metade
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Remove os arquivos usados há mais tempo até o cache caber em max_size
+        :return: quantidade de arquivos removidos
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Invalida o cache inteiro"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class CachedConverter:
+    """Envolve a função de conversão de um documento, só convertendo o que não está no cache"""
+
+    def __init__(self, convert_document, cache):
+        self.convert_document = convert_document
+        self.cache = cache
+        self.namespace = f'{convert_document.__module__}.{convert_document.__qualname__}'
+
+    def __call__(self, document, **kwargs):
+        key = self.cache.key(self.namespace, document, **kwargs)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.convert_document(document, **kwargs)
+            self.cache.put(key, result)
+        return result
+
+
+def iter_converted(convert_document, documents, cache=None, jobs=1, **kwargs):
+    """Mesmo que iter_parallel, reaproveitando os documentos que já estão no cache
+    :param cache: ConversionCache ou None para converter tudo
+    """
+    if instrument.enabled():
+        documents = instrument.timed_iter('iter_data', documents)
+    if cache is None:
+        yield from iter_parallel(convert_document, documents, jobs=jobs, **kwargs)
+        return
+
+    yield from iter_parallel(CachedConverter(convert_document, cache), documents, jobs=jobs, **kwargs)
+    cache.evict()
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', default='../.cache/conversion',
+                        help='Pasta do cache de documentos convertidos')
+    parser.add_argument('--cache-size', type=int, default=512,
+                        help='Tamanho máximo do cache em MB')
+    parser.add_argument('--no-cache', action='store_true', help='Converte todos os documentos sem usar o cache')
+    parser.add_argument('--clear-cache', action='store_true', help='Apaga o cache antes de converter')
+    return parser
+
+
+def cache_from_args(args):
+    """Cria o cache a partir dos argumentos de add_cache_arguments"""
+    if args.no_cache:
+        return None
+    cache = ConversionCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+    if args.clear_cache:
+        cache.clear()
+    return cache
@@ -0,0 +1,266 @@
+"""Exporta os datasets num formato colunar (Arrow IPC ou Parquet) e os abre mapeados em memória.
+
+Cada registro vira uma linha com texto, título, text_id, offsets dos tokens, ids das labels e os
+spans (ents, error_labels, annotations) como colunas de listas. O arquivo Arrow é aberto com mmap,
+então as colunas são lidas direto das páginas do arquivo, sem cópia e compartilhadas entre processos.
+
+    python -m convert.columnar datasets/train/student.json datasets/train/student.arrow
+"""
+import argparse
+import json
+import sys
+from bisect import bisect_right
+
+from utils import instrument
+from utils.labels import LABELS, label2id, text2label_ids
+from utils.records import LabelSequence
+
+formats = ('arrow', 'parquet')
+# Campos com listas de spans [início, fim, label]
+span_fields = ('ents', 'error_labels', 'annotations')
+
+
+def schema_for(record):
+    """Schema Arrow dos registros com os mesmos campos que record"""
+    import pyarrow as pa
+
+    span_type = pa.list_(pa.struct([('start', pa.int32()), ('end', pa.int32()), ('label', pa.string())]))
+    fields = []
+    for name, value in record.items():
+        if name in span_fields:
+            fields.append(pa.field(name, span_type))
+        elif name == 'labels':
+            continue
+        elif isinstance(value, bool):
+            fields.append(pa.field(name, pa.bool_()))
+        elif isinstance(value, int):
+            fields.append(pa.field(name, pa.int64()))
+        elif isinstance(value, str):
+            fields.append(pa.field(name, pa.string()))
+        elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+            fields.append(pa.field(name, pa.list_(pa.string())))
+        else:
+            raise TypeError(f'Campo {name} do tipo {type(value).__name__} não tem coluna correspondente')
+    fields.append(pa.field('token_offsets', pa.list_(pa.list_(pa.int32(), 2))))
+    fields.append(pa.field('label_ids', pa.list_(pa.int8())))
+    return pa.schema(fields)
+
+
+def token_columns(record):
+    """Offsets dos tokens e ids das labels do texto do registro
+    :return: array (n, 2) de offsets e lista com o id da label de cada token, ambas vazias com um aviso
+        no stderr quando o texto não pode ser rotulado
+    """
+    try:
+        offsets, label_ids = text2label_ids(record['text'])
+    except ValueError as error:
+        print(f"Texto {record.get('text_id')} sem labels: {error}", file=sys.stderr)
+        return [], []
+    if 'labels' in record:
+        # As labels já salvas têm precedência, os offsets só precisam ter o mesmo número de tokens
+        if len(record['labels']) != len(label_ids):
+            raise ValueError(f"Texto {record.get('text_id')} tem {len(label_ids)} tokens e "
+                             f"{len(record['labels'])} labels")
+        labels = record['labels']
+        label_ids = labels.ids.tolist() if isinstance(labels, LabelSequence) else [label2id[label] for label in labels]
+    else:
+        label_ids = label_ids.tolist()
+    return offsets.tolist(), label_ids
+
+
+class ColumnarWriter:
+    """Escreve os registros em lotes num arquivo Arrow IPC ou Parquet, mesma interface do JsonlWriter"""
+
+    def __init__(self, path, file_format=None, batch_size=1024):
+        """
+        :param path: arquivo de saída
+        :param file_format: 'arrow' ou 'parquet', None usa a extensão do arquivo
+        :param batch_size: registros por lote (row group no Parquet)
+        """
+        self.path = path
+        self.format = file_format or ('parquet' if path.endswith('.parquet') else 'arrow')
+        if self.format not in formats:
+            raise ValueError(f"Formato {self.format} deve ser um de {', '.join(formats)}")
+        self.batch_size = batch_size
+        self.schema = None
+        self.writer = None
+        self.columns = None
+        self.count = 0
+
+    def _open(self, record):
+        import pyarrow as pa
+
+        self.schema = schema_for(record)
+        self.columns = {name: [] for name in self.schema.names}
+        if self.format == 'arrow':
+            self.writer = pa.ipc.new_file(self.path, self.schema)
+        else:
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+
+    def write(self, record):
+        if self.writer is None:
+            self._open(record)
+        with instrument.stage('write_columnar'):
+            token_offsets, label_ids = token_columns(record)
+            for name, column in self.columns.items():
+                if name == 'token_offsets':
+                    column.append(token_offsets)
+                elif name == 'label_ids':
+                    column.append(label_ids)
+                elif name in span_fields:
+                    column.append([{'start': span[0], 'end': span[1], 'label': span[2]}
+                                   for span in record.get(name) or []])
+                else:
+                    column.append(record.get(name))
+            if len(self.columns['label_ids']) >= self.batch_size:
+                self.flush()
+        self.count += 1
+
+    def flush(self):
+        import pyarrow as pa
+
+        if self.writer is None or not self.columns['label_ids']:
+            return
+        batch = pa.record_batch([pa.array(self.columns[name], type=field.type)
+                                 for name, field in zip(self.schema.names, self.schema)], schema=self.schema)
+        if self.format == 'arrow':
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        for column in self.columns.values():
+            column.clear()
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_columnar(path, records, file_format=None, batch_size=1024):
+    """Escreve os registros de um iterável num arquivo colunar
+    :return: quantidade de registros escritos
+    """
+    with ColumnarWriter(path, file_format, batch_size) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+class ColumnarDataset:
+    """Dataset colunar aberto sem cópia: o Arrow IPC é mapeado em memória e o Parquet é lido com mmap"""
+
+    def __init__(self, path):
+        import pyarrow as pa
+
+        self.path = path
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            self.table = pq.read_table(path, memory_map=True)
+        else:
+            self.source = pa.memory_map(path, 'r')
+            self.table = pa.ipc.open_file(self.source).read_all()
+        self._numpy = {}
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    def column(self, name):
+        """Coluna inteira como ChunkedArray do Arrow, sem cópia"""
+        return self.table.column(name)
+
+    def list_column(self, name):
+        """Coluna de listas de números como arrays do numpy sem cópia
+        :return: linha onde cada chunk começa e, para cada chunk, os valores de todas as linhas
+            concatenados e o offset onde cada linha começa (linhas + 1 posições)
+        """
+        # Cada lote do arquivo é um chunk da coluna, juntá-los copiaria os dados
+        if name not in self._numpy:
+            starts, chunks = [], []
+            row = 0
+            for chunk in self.table.column(name).chunks:
+                starts.append(row)
+                row += len(chunk)
+                values = chunk.flatten()
+                if name == 'token_offsets':
+                    values = values.flatten().to_numpy().reshape(-1, 2)
+                else:
+                    values = values.to_numpy()
+                offsets = chunk.offsets.to_numpy()
+                chunks.append((values, offsets - offsets[0]))
+            self._numpy[name] = starts, chunks
+        return self._numpy[name]
+
+    def _row(self, name, i):
+        starts, chunks = self.list_column(name)
+        chunk = bisect_right(starts, i) - 1
+        values, offsets = chunks[chunk]
+        i -= starts[chunk]
+        return values[offsets[i]:offsets[i + 1]]
+
+    def token_offsets(self, i):
+        """Array (n, 2) com início e fim dos tokens do registro i"""
+        return self._row('token_offsets', i)
+
+    def label_ids(self, i):
+        return self._row('label_ids', i)
+
+    def __getitem__(self, i):
+        """Registro i, com os offsets dos tokens e os ids das labels como arrays do numpy sem cópia"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f'Registro {i} fora do dataset com {len(self)} registros')
+        record = {}
+        for name in self.columns:
+            if name == 'token_offsets':
+                record[name] = self.token_offsets(i)
+            elif name == 'label_ids':
+                record[name] = self.label_ids(i)
+            elif name in span_fields:
+                record[name] = [(span['start'], span['end'], span['label'])
+                                for span in self.table.column(name)[i].as_py()]
+            else:
+                record[name] = self.table.column(name)[i].as_py()
+        return record
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def labels(self, i):
+        """Labels dos tokens do registro i, como no campo labels dos jsons"""
+        return [LABELS[label_id] for label_id in self.label_ids(i)]
+
+
+def read_records(path):
+    """Lê um dataset em json (lista de registros) ou jsonl"""
+    with open(path, encoding='utf-8') as file:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in file if line.strip()]
+        return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Dataset em json ou jsonl')
+    parser.add_argument('target', help='Arquivo .arrow ou .parquet')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    count = write_columnar(args.target, read_records(args.source), batch_size=args.batch_size)
+    print(f'{count} registros escritos em {args.target}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,89 +3,89 @@ import pathlib
 from collections import defaultdict
 from typing import Literal
 
-import srsly
+from convert.join import join_annotations
+from utils import find_token_span, get_gold_token, NpEncoder, TokenAligner
+from utils.intervals import SpanIndex
+from utils.records import Document
 
-from legacy_code.convert_text import nlp, get_gold_token
-from utils import find_token_span, check_mergebility
 
+ERROR_TYPES = ['Esqueceu pontuação final [?!.]', 'Trocou pontuação final por vírgula', 'Esqueceu a vírgula',
+               'Trocou a vírgula por ponto final.']
 
-def convert_annotations(
-        path: str = 'data',
-        token_alignment: Literal['contract', 'expand'] = 'expand'
-):
-    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
-    result = [p for p in pathlib.Path(path).glob('./**/Anotações')]
-    result.sort()
-    error_map = {
-        'Esqueceu pontuação final [?!.]': 0,
-        'Trocou pontuação final por vírgula': 0,
-        'Esqueceu a vírgula': 0,
-        'Trocou a vírgula por ponto final.': 0
-    }
 
-    annotator_entities = []
-    student_entities = []
-    print(result)
-    for week_path in result:
-        print(week_path)
-        overlaps = 0
-        # paths -> json generators -> list[json]
-        jsonls = list(week_path.glob('anot*'))
-        jsonls.sort()
+def convert_document(document, token_alignment='expand', error_map=None):
+    """Converte as anotações de um texto
+    :param document: (text_id, texto, [(annotator_id, labels), ...])
+    :param error_map: dict que recebe a contagem de cada tipo de erro
+    :return: entidades do aluno e dict annotator_id -> entidades do anotador
+    """
+    if error_map is None:
+        error_map = dict.fromkeys(ERROR_TYPES, 0)
+    text_id, text, annotations = document
 
-        annotated_jsonl = [tuple(srsly.read_jsonl(path)) for path in jsonls]
-        annotated_pairs = tuple(zip(*annotated_jsonl))
+    student_entity = Document(text=text, text_id=text_id, ents=[])
 
-        for i, zipped_anot_data in enumerate(annotated_pairs, start=1):
+    annotator_entity = defaultdict(lambda: Document(text=text, text_id=text_id, ents=[]))
+    aligner = TokenAligner(text)
+    # Procura pela pontuação do aluno no texto
 
-            text = zipped_anot_data[0]['text']
-            text_id = zipped_anot_data[0]['id']
-            student_entity = {'text': text, 'text_id': text_id, 'ents': []}
+    student_entity["ents"] = find_token_span(text, token_alignment=token_alignment)
 
-            annotator_entity = defaultdict(lambda: {'text': text, 'text_id': text_id, 'ents': []})
-            doc = nlp.make_doc(zipped_anot_data[0]['text'])
-            # Procura pela pontuação do aluno no texto
+    for annotator_id, labels in annotations:
+        ann_index = SpanIndex()
 
-            student_entity["ents"] = find_token_span(text, token_alignment=token_alignment)
-            student_entities.append(student_entity)
+        for s in labels:
 
-            for annotator_id, annotation in enumerate(zipped_anot_data, start=1):
+            if s[2] == 'Erro de Pontuação':
+                start_char, end_char = get_gold_token(text, s[0], s[1], aligner=aligner)
+                if text[s[0]:s[1]] != '.':
+                    ent_span = (start_char, end_char, "PERIOD")
 
-                for s in annotation['label']:
+                    if ann_index.insert_if_disjoint(ent_span):
+                        annotator_entity[annotator_id]["ents"].append(ent_span)
 
-                    if s[2] == 'Erro de Pontuação':
-                        start_char, end_char = get_gold_token(text, s[0], s[1])
-                        if text[s[0]:s[1]] != '.':
-                            ent_span = (start_char, end_char, "PERIOD")
-                            ann_ents = annotator_entity[annotator_id]["ents"]
+                    if text[s[0]:s[1]] == ',':
+                        error_map['Trocou pontuação final por vírgula'] += 1
+                    else:
+                        error_map['Esqueceu pontuação final [?!.]'] += 1
 
-                            if check_mergebility(ent_span, ann_ents):
-                                annotator_entity[annotator_id]["ents"].append(ent_span)
+            elif s[2] == 'Erro de vírgula':
+                start_char, end_char = get_gold_token(text, s[0], s[1], aligner=aligner)
+                ent_span = (start_char, end_char, "COMMA")
 
-                            if text[s[0]:s[1]] == ',':
-                                error_map['Trocou pontuação final por vírgula'] += 1
-                            else:
-                                error_map['Esqueceu pontuação final [?!.]'] += 1
+                if ann_index.insert_if_disjoint(ent_span):
+                    annotator_entity[annotator_id]["ents"].append(ent_span)
+                    if text[s[0]:s[1]] == '.':
+                        error_map['Trocou a vírgula por ponto final.'] += 1
+                    else:
+                        error_map['Esqueceu a vírgula'] += 1
 
-                    elif s[2] == 'Erro de vírgula':
-                        start_char, end_char = get_gold_token(text, s[0], s[1])
-                        ent_span = (start_char, end_char, "COMMA")
-                        ann_ents = annotator_entity[annotator_id]["ents"]
+        for sts_ents in student_entity["ents"]:
 
-                        if check_mergebility(ent_span, ann_ents):
-                            annotator_entity[annotator_id]["ents"].append(ent_span)
-                            if text[s[0]:s[1]] == '.':
-                                error_map['Trocou a vírgula por ponto final.'] += 1
-                            else:
-                                error_map['Esqueceu a vírgula'] += 1
+            if ann_index.insert_if_disjoint(sts_ents):
+                annotator_entity[annotator_id]["ents"].append(sts_ents)
 
-                ann_ents = annotator_entity[annotator_id]["ents"]
+    return student_entity, annotator_entity
 
-                for sts_ents in student_entity["ents"]:
 
-                    if check_mergebility(sts_ents, ann_ents):
-                        annotator_entity[annotator_id]["ents"].append(sts_ents)
+def convert_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand'
+):
+    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
+    result = [p for p in pathlib.Path(path).glob('./**/Anotações')]
+    result.sort()
+    error_map = dict.fromkeys(ERROR_TYPES, 0)
 
+    annotator_entities = []
+    student_entities = []
+    print(result)
+    for week_path in result:
+        print(week_path)
+        # Os arquivos dos anotadores são juntados pelo text_id, não pela ordem das linhas
+        for document in join_annotations(str(week_path.parent)):
+            student_entity, annotator_entity = convert_document(document, token_alignment, error_map)
+            student_entities.append(student_entity)
             annotator_entities.append(annotator_entity)
     return student_entities, annotator_entities
 
@@ -95,6 +95,6 @@ if __name__ == '__main__':
     annotator1 = list(map(lambda dict_annot: dict_annot[1], annot_entities))
     annotator2 = list(map(lambda dict_annot: dict_annot[2], annot_entities))
 
-    json.dump(obj=sts_entities, fp=open('../annotations/student_entities.json', 'w'), indent=4)
-    json.dump(obj=annotator1, fp=open('../annotations/annotator1_entities.json', 'w'), indent=4)
-    json.dump(obj=annotator2, fp=open('../annotations/annotator2_entities.json', 'w'), indent=4)
+    json.dump(obj=sts_entities, fp=open('../annotations/student_entities.json', 'w'), indent=4, cls=NpEncoder)
+    json.dump(obj=annotator1, fp=open('../annotations/annotator1_entities.json', 'w'), indent=4, cls=NpEncoder)
+    json.dump(obj=annotator2, fp=open('../annotations/annotator2_entities.json', 'w'), indent=4, cls=NpEncoder)
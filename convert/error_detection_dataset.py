@@ -1,59 +1,79 @@
+import argparse
 import json
 import os
 import pathlib
 from collections import defaultdict
 from typing import Literal
 
-import srsly
-
-from convert.util import fix_punctuation, read_data
-from utils import text2labels, find_token_span, get_gold_token, NpEncoder
+from convert.cache import ConversionCache, iter_converted, add_cache_arguments, cache_from_args
+from convert.parallel import add_jobs_argument
+from convert.util import fix_punctuation, iter_data
+from convert.writer import add_format_argument, open_writer
+from utils import instrument, text2labels, find_token_span, get_gold_token, NpEncoder, TokenAligner
 from utils.preprocess import preprocess_text, fix_break_lines
-import pandas as pd
+from utils.records import Document
 
 
-def convert_annotations(
-        path: str = 'data',
-        token_alignment: Literal['contract', 'expand'] = 'expand'
-):
-    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
-    annotator_entities = []
-    student_entities = []
-    annotated_pairs = read_data(path)
-
-    for i, group_annottion in annotated_pairs.groupby('text_id'):
-
-        text = group_annottion['text'].values[0]
-        text_id = group_annottion['text_id'].values[0]
+def convert_document(document, token_alignment='expand'):
+    """Converte as anotações de um texto
+    :param document: (text_id, texto, [(annotator_id, labels), ...])
+    :return: entidade com o texto pré-processado e as anotações
+    """
+    text_id, text, annotations = document
 
+    with instrument.stage('preprocess_text'):
         title, new_sts_text = preprocess_text(text)
         new_text = '\n'.join(new_sts_text)
 
-        entity = {'text': new_sts_text, "title": title, 'text_id': text_id}
+    entity = Document(text=new_sts_text, title=title, text_id=text_id)
 
-        annots = []
-        for annotation in group_annottion['label'].values:
+    annots = []
+    with instrument.stage('get_gold_token'):
+        aligner = TokenAligner(text)
+        for annotator_id, annotation in annotations:
 
             for k, ann_span in enumerate(annotation):
                 start_char, end_char = ann_span[1], ann_span[1] + 2
                 # Descobrir o porquê há multiplas pontuações no texto do aluno e corrigir isso 'esta podre.?,
-                start_char, end_char = get_gold_token(text, start_char, end_char)
+                start_char, end_char = get_gold_token(text, start_char, end_char, aligner=aligner)
                 ann_span[0] = start_char
                 ann_span[1] = end_char
                 annotation[k] = ann_span
                 annots.append(ann_span)
 
-        entity['raw_text'] = text
-        entity['raw_text_id'] = text_id
-        entity['text'] = new_text
-        entity['annotations'] = annots
+    entity['raw_text'] = text
+    entity['raw_text_id'] = text_id
+    entity['text'] = new_text
+    entity['annotations'] = annots
 
-        annotator_entities.append(entity)
+    return entity
 
-    return annotator_entities
 
+def iter_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand',
+        jobs: int = 1,
+        cache: ConversionCache = None
+):
+    """Converte os textos um a um, entregando cada entidade assim que fica pronta"""
+    return iter_converted(convert_document, iter_data(path), cache=cache, jobs=jobs, token_alignment=token_alignment)
 
-if __name__ == '__main__':
-    annot_entities = convert_annotations('../annotations/')
 
-    json.dump(obj=annot_entities, fp=open('../datasets/annotator.json', 'w'), indent=4, cls=NpEncoder)
+def convert_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand',
+        jobs: int = 1
+):
+    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
+    return list(iter_annotations(path, token_alignment=token_alignment, jobs=jobs))
+
+
+if __name__ == '__main__':
+    parser = add_format_argument(add_cache_arguments(add_jobs_argument(argparse.ArgumentParser(description=__doc__))))
+    args = instrument.add_profile_arguments(parser).parse_args()
+    cache = cache_from_args(args)
+    instrument.profile_from_args(args)
+
+    with open_writer('../datasets/annotator.jsonl', args.format) as writer:
+        for entity in iter_annotations('../annotations/', jobs=args.jobs, cache=cache):
+            writer.write(entity)
@@ -0,0 +1,122 @@
+"""Junta as anotações de N anotadores por text_id, relatando o que não casa em vez de desalinhar os textos.
+
+Cada arquivo de anotação é indexado pelo text_id (só o byte onde cada linha começa), então a junção
+é O(total de linhas) e não depende da ordem nem do tamanho dos arquivos.
+
+    python -m convert.join ../annotations/ --dedup
+"""
+import argparse
+import json
+import sys
+
+from convert.util import find_annotation_files, index_jsonl
+from utils.memo import text_key
+
+
+class JoinReport:
+    """Problemas encontrados ao juntar os arquivos dos anotadores"""
+
+    def __init__(self, annotators=()):
+        self.annotators = sorted(annotators)
+        self.documents = 0
+        # text_id -> anotadores que não anotaram o texto
+        self.missing = {}
+        # text_id -> anotadores cujo texto é diferente do texto do primeiro anotador
+        self.mismatched = {}
+        # text_id -> anotadores com mais de uma linha para o texto, só a primeira é usada
+        self.repeated = {}
+        # text_id -> text_id anterior com exatamente o mesmo texto
+        self.duplicates = {}
+
+    def __bool__(self):
+        return bool(self.missing or self.mismatched or self.repeated or self.duplicates)
+
+    def summary(self):
+        return {'documents': self.documents, 'annotators': self.annotators, 'missing': len(self.missing),
+                'mismatched': len(self.mismatched), 'repeated': len(self.repeated),
+                'duplicates': len(self.duplicates)}
+
+    def to_dict(self):
+        return {**self.summary(),
+                'details': {name: {str(text_id): value for text_id, value in getattr(self, name).items()}
+                            for name in ('missing', 'mismatched', 'repeated', 'duplicates')}}
+
+
+def join_annotations(path, report=None, dedup=False, complete=False):
+    """Junta as anotações das pastas Anotações de path por text_id
+    :param path: pasta com as semanas de anotação
+    :param report: JoinReport que recebe os problemas encontrados, sem ele um resumo dos problemas
+        é escrito no stderr ao final
+    :param dedup: descarta os textos idênticos a um texto de text_id menor, comparando o hash do conteúdo
+    :param complete: descarta os textos que algum anotador não anotou
+    :return: gerador de (text_id, texto, [(annotator_id, labels), ...]) ordenado por text_id.
+        Anotações com texto diferente do primeiro anotador são descartadas
+    """
+    warn = report is None
+    if warn:
+        report = JoinReport()
+    files = find_annotation_files(path)
+    indexes = [index_jsonl(filename) for filename, _ in files]
+    annotators = sorted({annotator_id for _, annotator_id in files})
+    report.annotators = annotators
+    text_ids = sorted(set().union(*indexes))
+    seen = {}
+
+    handles = [open(filename, 'rb') for filename, _ in files]
+    try:
+        for text_id in text_ids:
+            text = None
+            annotations = []
+            found = set()
+            for (_, annotator_id), index, handle in zip(files, indexes, handles):
+                for offset in index.get(text_id, ()):
+                    handle.seek(offset)
+                    annotation = json.loads(handle.readline())
+                    if text is None:
+                        text = annotation['text']
+                    elif annotation['text'] != text:
+                        report.mismatched.setdefault(text_id, []).append(annotator_id)
+                        continue
+                    if annotator_id in found:
+                        report.repeated.setdefault(text_id, []).append(annotator_id)
+                        continue
+                    found.add(annotator_id)
+                    annotations.append((annotator_id, annotation['label']))
+
+            missing = [annotator_id for annotator_id in annotators if annotator_id not in found]
+            if missing:
+                report.missing[text_id] = missing
+                if complete:
+                    continue
+            if dedup:
+                key = text_key(text)
+                if key in seen:
+                    report.duplicates[text_id] = seen[key]
+                    continue
+                seen[key] = text_id
+            report.documents += 1
+            yield text_id, text, annotations
+    finally:
+        for handle in handles:
+            handle.close()
+    if warn and report:
+        print(f'Problemas ao juntar as anotações de {path}: {report.summary()}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Pasta com as semanas de anotação')
+    parser.add_argument('--dedup', action='store_true', help='Procura textos idênticos com text_id diferentes')
+    parser.add_argument('--details', action='store_true', help='Lista os text_id de cada problema')
+    args = parser.parse_args()
+
+    report = JoinReport()
+    for _ in join_annotations(args.path, report=report, dedup=args.dedup):
+        pass
+    json.dump(report.to_dict() if args.details else report.summary(), sys.stdout, indent=2)
+    print()
+    sys.exit(1 if report else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,96 @@
+import argparse
 import json
 import os
 import pathlib
 from collections import defaultdict
 from typing import Literal
 
-import srsly
+from convert.cache import ConversionCache, iter_converted, add_cache_arguments, cache_from_args
+from convert.parallel import add_jobs_argument
+from convert.util import iter_data, apply_corrections
+from convert.writer import add_format_argument, open_writer
+from utils import instrument, text2labels, find_token_span
+from utils.preprocess import preprocess_text
+from utils.records import Document
 
-from convert.util import fix_punctuation, read_data
-from utils import text2labels, find_token_span
-from utils.preprocess import preprocess_text, fix_break_lines
 
+def convert_document(document, token_alignment='expand'):
+    """Converte as anotações de um texto
+    :param document: (text_id, texto, [(annotator_id, labels), ...])
+    :return: entidade do aluno e dicionário com a entidade de cada anotador
+    """
+    text_id, text, annotations = document
 
-def convert_annotations(
-        path: str = 'data',
-        token_alignment: Literal['contract', 'expand'] = 'expand'
-):
-    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
-    annotator_entities = []
-    student_entities = []
-    annotated_pairs = read_data(path)
-
-    for i, zipped_anot_data in enumerate(annotated_pairs, start=1):
-
-        text = zipped_anot_data[0]['text']
-        text_id = zipped_anot_data[0]['id']
-
+    with instrument.stage('preprocess_text'):
         title, new_sts_text = preprocess_text(text)
         new_sts_text = '\n'.join(new_sts_text)
 
-        student_entity = {'text': new_sts_text, "title": title, 'text_id': text_id, 'ents': []}
-
-        annotator_entity = defaultdict(lambda: {'text': text, "title": title, 'text_id': text_id, 'ents': []})
+    student_entity = Document(text=new_sts_text, title=title, text_id=text_id, ents=[])
 
+    annotator_entity = {}
 
+    with instrument.stage('find_token_span'):
         student_entity["ents"] = find_token_span(new_sts_text, token_alignment=token_alignment)
+    with instrument.stage('text2labels'):
         student_entity["labels"] = text2labels(student_entity["text"])
 
-        for annotator_id, annotation in enumerate(zipped_anot_data, start=1):
-            global_shift = 0
-            text = annotation['text']
-            len_b = len(list(text))
-            text = fix_break_lines(text)
+    for annotator_id, annotation in annotations:
+        with instrument.stage('apply_corrections'):
+            new_ann_raw_text, _ = apply_corrections(text, [annotation])
+        with instrument.stage('preprocess_text'):
+            _, new_ann_text = preprocess_text(new_ann_raw_text)
+            new_ann_text = '\n'.join(new_ann_text)
+        with instrument.stage('text2labels'):
+            after_labels = text2labels(new_ann_text)
+
+        annotator_entity[annotator_id] = Document(text=new_ann_text, title=title, text_id=text_id)
+        with instrument.stage('find_token_span'):
+            annotator_entity[annotator_id]["ents"] = find_token_span(new_ann_text, token_alignment=token_alignment)
+        annotator_entity[annotator_id]["labels"] = after_labels
 
-            ann_text_list = list(text)
-            len_a = len(ann_text_list)
-            if len_a != len_b:
-                global_shift = len_a - len_b
+    return student_entity, annotator_entity
 
-            for ann_span in annotation['label']:
 
-                start_char, end_char, label = ann_span[1] - 1 + global_shift, ann_span[1] + global_shift, ann_span[
-                    2]
-                # Descobrir o porquê há multiplas pontuações no texto do aluno e corrigir isso 'esta podre.?,
-                if label not in ['Erro de Pontuação', 'Erro de vírgula']:
-                    continue
+def iter_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand',
+        jobs: int = 1,
+        cache: ConversionCache = None,
+        complete: bool = False
+):
+    """Converte os textos um a um, entregando as entidades do aluno e dos anotadores assim que ficam prontas
+    :param complete: descarta os textos que algum anotador não anotou
+    """
+    return iter_converted(convert_document, iter_data(path, complete=complete), cache=cache, jobs=jobs,
+                          token_alignment=token_alignment)
 
-                symbol = '.' if label == 'Erro de Pontuação' else ','
-                ann_text_list, local_shift = fix_punctuation(ann_text_list, start_char, end_char, punct=symbol)
-                global_shift += local_shift
 
-            atitle, new_ann_textp = preprocess_text(''.join(ann_text_list))
-            new_ann_text = '\n'.join(new_ann_textp)
-            after_labels = text2labels(new_ann_text)
+def convert_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand',
+        jobs: int = 1
+):
+    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
+    results = list(iter_annotations(path, token_alignment=token_alignment, jobs=jobs))
 
-            annotator_entity[annotator_id]["text"] = new_ann_text
-            annotator_entity[annotator_id]["title"] = title
-            annotator_entity[annotator_id]["ents"] = find_token_span(new_ann_text, token_alignment=token_alignment)
-            annotator_entity[annotator_id]["labels"] = after_labels
-            student_entities.append(student_entity)
-        annotator_entities.append(annotator_entity)
+    student_entities = [student_entity for student_entity, _ in results]
+    annotator_entities = [annotator_entity for _, annotator_entity in results]
 
     return student_entities, annotator_entities
 
 
 if __name__ == '__main__':
-    sts_entities, annot_entities = convert_annotations('../annotations/')
-    annotator1 = list(map(lambda dict_annot: dict_annot[1], annot_entities))
-    annotator2 = list(map(lambda dict_annot: dict_annot[2], annot_entities))
-
-    json.dump(obj=sts_entities, fp=open('../datasets/test/student.json', 'w'), indent=4)
-    json.dump(obj=annotator1, fp=open('../datasets/test/annotator1.json', 'w'), indent=4)
-    json.dump(obj=annotator2, fp=open('../datasets/test/annotator2.json', 'w'), indent=4)
+    parser = add_format_argument(add_cache_arguments(add_jobs_argument(argparse.ArgumentParser(description=__doc__))))
+    args = instrument.add_profile_arguments(parser).parse_args()
+    cache = cache_from_args(args)
+    instrument.profile_from_args(args)
+
+    with open_writer('../datasets/test/student.jsonl', args.format) as students, \
+            open_writer('../datasets/test/annotator1.jsonl', args.format) as annotator1, \
+            open_writer('../datasets/test/annotator2.jsonl', args.format) as annotator2:
+        # Só os textos dos dois anotadores, para que as linhas dos três arquivos continuem alinhadas
+        for student_entity, annotator_entity in iter_annotations('../annotations/', jobs=args.jobs, cache=cache,
+                                                                 complete=True):
+            students.write(student_entity)
+            annotator1.write(annotator_entity[1])
+            annotator2.write(annotator_entity[2])
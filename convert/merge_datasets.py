@@ -1,20 +1,23 @@
+import argparse
 import json
 from typing import Literal
-import numpy as np
-from convert.util import fix_punctuation, read_data
-from utils import text2labels, find_token_span, get_gold_token, remove_punctuation
-from utils.preprocess import preprocess_text, fix_break_lines
-import spacy
 
-nlp = spacy.blank("pt")
+from convert.cache import ConversionCache, iter_converted, add_cache_arguments, cache_from_args
+from convert.parallel import add_jobs_argument
+from convert.util import iter_data, apply_corrections
+from convert.writer import add_format_argument, open_writer
+from utils import instrument, text2labels, find_token_span, get_gold_token, remove_punctuation, TokenAligner
+from utils.preprocess import preprocess_text
+from utils.records import Document
 
 
-def get_error_labels(text, labels, token_alignment='expand'):
+def get_error_labels(text, labels, token_alignment='expand', aligner=None):
     """Retorna as labels de erro de pontuação e vírgula"""
 
-    new_span = get_gold_token(text, labels[0], labels[1])
-    doc = nlp.make_doc(text)
-    new_span = doc.char_span(*new_span, alignment_mode=token_alignment)
+    if aligner is None:
+        aligner = TokenAligner(text)
+    new_span = get_gold_token(text, labels[0], labels[1], aligner=aligner)
+    new_span = aligner.span(*new_span, alignment_mode=token_alignment)
 
     return new_span
 
@@ -22,83 +25,87 @@ def get_error_labels(text, labels, token_alignment='expand'):
 
 
 
-def convert_annotations(
-        path: str = 'data',
-        token_alignment: Literal['contract', 'expand'] = 'expand'
-):
-    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
-
-    annotator_entities = []
-    student_entities = []
-
-    annotated_pairs = read_data(path)
-
-    for i, group_annottion in annotated_pairs.groupby('text_id'):
-        text = group_annottion['text'].values[0]
-        text_id = group_annottion['text_id'].values[0]
+def convert_document(document, token_alignment='expand'):
+    """Converte as anotações de um texto
+    :param document: (text_id, texto, [(annotator_id, labels), ...])
+    :return: entidades do aluno e dos anotadores
+    """
+    text_id, text, annotations = document
 
+    with instrument.stage('preprocess_text'):
         title, new_sts_text = preprocess_text(text)
         new_sts_text = '\n'.join(new_sts_text)
 
-        student_entity = {'text': new_sts_text, "title": title, 'text_id': text_id, 'ents': []}
+    student_entity = Document(text=new_sts_text, title=title, text_id=text_id, ents=[])
 
-        annotator_entity = {'text': text, "title": title, 'text_id': text_id, 'ents': []}
+    annotator_entity = Document(text=text, title=title, text_id=text_id, ents=[])
 
-        # Procura pela pontuação do aluno no texto
+    # Procura pela pontuação do aluno no texto
 
+    with instrument.stage('find_token_span'):
         student_entity["ents"] = find_token_span(new_sts_text, token_alignment=token_alignment)
+    with instrument.stage('text2labels'):
         student_entity["labels"] = text2labels(student_entity["text"])
 
-        text = fix_break_lines(text)
-
-        len_b = len(list(text))
-        global_shift = 0
-        ann_text_list = list(text)
-        len_a = len(ann_text_list)
-        if len_a != len_b:
-            global_shift = len_a - len_b
-
-        erros_labels = []
+    # As correções são feitas no texto bruto, então raw_text e error_labels se referem ao texto bruto corrigido
+    labels = [label for annotator_id, label in annotations]
+    with instrument.stage('apply_corrections'):
+        new_ann_raw_text, erros_labels = apply_corrections(text, labels)
+    with instrument.stage('preprocess_text'):
+        _, new_ann_text = preprocess_text(new_ann_raw_text)
+        new_ann_text = '\n'.join(new_ann_text)
+    with instrument.stage('text2labels'):
+        after_labels = text2labels(new_ann_text)
 
-        for annotation in group_annottion['label'].values:
+    e_labels = []
+    with instrument.stage('get_gold_token'):
+        aligner = TokenAligner(new_ann_raw_text)
+        for start_char, end_char, label in erros_labels:
+            start_char, end_char = get_gold_token(new_ann_raw_text, start_char, end_char, aligner=aligner)
+            e_labels.append((start_char, end_char, label))
 
-            for ann_span in annotation:
+    annotator_entity["raw_text"] = new_ann_raw_text
+    annotator_entity["text"] = new_ann_text
+    annotator_entity["title"] = title
+    annotator_entity["labels"] = after_labels
+    annotator_entity["error_labels"] = e_labels
 
-                start_char, end_char, label = ann_span[1] - 1 + global_shift, ann_span[1] + global_shift, ann_span[
-                    2]
-                # Descobrir o porquê há multiplas pontuações no texto do aluno e corrigir isso 'esta podre.?,
-                if label not in ['Erro de Pontuação', 'Erro de vírgula']:
-                    continue
+    return student_entity, annotator_entity
 
-                symbol = '.' if label == 'Erro de Pontuação' else ','
-                ann_text_list, local_shift = fix_punctuation(ann_text_list, start_char, end_char, punct=symbol)
-                global_shift += local_shift
 
-                erros_labels.append((ann_span[0] - 1 + global_shift, ann_span[1] + global_shift, label))
+def iter_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand',
+        jobs: int = 1,
+        cache: ConversionCache = None
+):
+    """Converte os textos um a um, entregando as entidades do aluno e dos anotadores assim que ficam prontas"""
+    return iter_converted(convert_document, iter_data(path), cache=cache, jobs=jobs, token_alignment=token_alignment)
 
-        atitle, new_ann_textp = preprocess_text(''.join(ann_text_list))
-        new_ann_text = '\n'.join(new_ann_textp)
-        after_labels = text2labels(new_ann_text)
 
-        e_labels = []
-        for start_char, end_char, label in erros_labels:
-            start_char, end_char = get_gold_token(''.join(ann_text_list), start_char, end_char)
-            e_labels.append((start_char, end_char, label))
+def convert_annotations(
+        path: str = 'data',
+        token_alignment: Literal['contract', 'expand'] = 'expand',
+        jobs: int = 1
+):
+    """Converte jsonl do doccano para o estilo de anotação do SpaCy e retorna um docbin com todos dos docs"""
 
-        annotator_entity["raw_text"] = ''.join(ann_text_list)
-        annotator_entity["text"] = new_ann_text
-        annotator_entity["title"] = title
-        annotator_entity["labels"] = after_labels
-        annotator_entity["error_labels"] = e_labels
+    results = list(iter_annotations(path, token_alignment=token_alignment, jobs=jobs))
 
-        student_entities.append(student_entity)
-        annotator_entities.append(annotator_entity)
+    student_entities = [student_entity for student_entity, _ in results]
+    annotator_entities = [annotator_entity for _, annotator_entity in results]
 
     return student_entities, annotator_entities
 
 
 if __name__ == '__main__':
-    sts_entities, annot_entities = convert_annotations('../annotations/')
-
-    json.dump(obj=sts_entities, fp=open('../datasets/full/student.json', 'w'), indent=4, cls=NpEncoder)
-    json.dump(obj=annot_entities, fp=open('../datasets/full/both_anotators.json', 'w'), indent=4, cls=NpEncoder)
+    parser = add_format_argument(add_cache_arguments(add_jobs_argument(argparse.ArgumentParser(description=__doc__))))
+    args = instrument.add_profile_arguments(parser).parse_args()
+    cache = cache_from_args(args)
+    instrument.profile_from_args(args)
+
+    with open_writer('../datasets/full/student.jsonl', args.format) as students, \
+            open_writer('../datasets/full/both_anotators.jsonl', args.format) as annotators:
+        for student_entity, annotator_entity in iter_annotations('../annotations/', jobs=args.jobs, cache=cache):
+            students.write(student_entity)
+            annotators.write(annotator_entity)
@@ -0,0 +1,84 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from utils import instrument
+
+
+def load_pipeline():
+    """Carrega o pipeline em branco do spaCy uma única vez em cada processo"""
+    from utils.alignment import get_nlp
+    return get_nlp()
+
+
+def group_documents(annotated_pairs):
+    """Agrupa as anotações por text_id
+    :param annotated_pairs: DataFrame retornado por read_data
+    :return: lista de (text_id, texto, [(annotator_id, labels), ...]) ordenada por text_id
+    """
+    documents = []
+    for text_id, group_annottion in annotated_pairs.groupby('text_id'):
+        annotations = list(zip(group_annottion['annotator_id'].values.tolist(), group_annottion['label'].values))
+        # item() converte os escalares do numpy para tipos nativos, que o json serializa direto
+        documents.append((group_annottion['text_id'].values[0].item(), group_annottion['text'].values[0], annotations))
+    return documents
+
+
+def resolve_jobs(jobs):
+    """
+    :param jobs: número de processos, 0 usa todos os núcleos
+    :return: número de processos a usar
+    """
+    if jobs < 0:
+        raise ValueError(f'O número de processos deve ser 0 ou mais, recebeu {jobs}')
+    return jobs or os.cpu_count()
+
+
+def iter_parallel(convert_document, documents, jobs=1, chunksize=8, **kwargs):
+    """Converte os documentos em paralelo, um processo por núcleo, entregando cada resultado assim que fica pronto
+    :param convert_document: função que converte um documento, precisa estar no nível do módulo
+    :param documents: iterável com os documentos retornados por iter_data ou group_documents
+    :param jobs: número de processos, 1 converte no processo atual e 0 usa todos os núcleos
+    :param chunksize: quantidade de documentos enviada de cada vez para um processo
+    :param kwargs: argumentos repassados para convert_document
+    :return: gerador com os resultados na mesma ordem dos documentos
+    """
+    convert = partial(convert_document, **kwargs)
+    if instrument.enabled():
+        convert = instrument.Staged('convert_document', convert)
+    jobs = resolve_jobs(jobs)
+    if jobs == 1:
+        for document in documents:
+            yield convert(document)
+        return
+
+    # Só uma janela de documentos fica em memória por vez
+    window = jobs * chunksize * 4
+    documents = iter(documents)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=load_pipeline) as executor:
+        while True:
+            batch = list(islice(documents, window))
+            if not batch:
+                break
+            if not instrument.enabled():
+                yield from executor.map(convert, batch, chunksize=chunksize)
+                continue
+            # Os estágios e contadores de cada processo voltam junto com o resultado
+            for result, stats in executor.map(instrument.Collected(convert), batch, chunksize=chunksize):
+                instrument.merge(stats)
+                yield result
+
+
+def jobs_argument(value):
+    jobs = int(value)
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f'deve ser 0 ou mais, recebeu {jobs}')
+    return jobs
+
+
+def add_jobs_argument(parser):
+    parser.add_argument('--jobs', type=jobs_argument, default=1,
+                        help='Número de processos usados na conversão (0 usa todos os núcleos)')
+    return parser
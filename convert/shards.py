@@ -0,0 +1,369 @@
+"""Constrói o dataset em shards de tamanho fixo, com divisão treino/teste determinística pelo text_id.
+
+Cada documento vai para o treino ou para o teste pelo hash do text_id com a semente, então a divisão
+não depende da ordem nem das semanas lidas. Com --stratify os documentos são agrupados pelo tipo de erro
+predominante e os round(test_ratio * n) de menor hash de cada grupo vão para o teste, e o manifest conta
+os documentos de cada estrato. Os documentos já escritos nunca mudam de split. Cada shard
+tem um arquivo por fonte (student, annotator1, ...) e pode ser lido sozinho. O manifest.json lista os
+shards prontos: rodar de novo retoma de onde parou e uma semana nova de anotações só escreve shards novos.
+
+    python -m convert.shards ../annotations/ ../datasets/shards --shard-size 64 --test-ratio 0.2 --jobs 4
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from convert.cache import CachedConverter, add_cache_arguments, cache_from_args
+from convert.join import join_annotations
+from convert.parallel import add_jobs_argument, load_pipeline, resolve_jobs
+from convert.writer import add_format_argument, open_writer
+from utils.agreement import ERROR_TYPES, span_error_type
+
+MANIFEST_VERSION = 3
+splits = ('train', 'test')
+no_error = 'Sem erro'
+
+
+def student_and_annotators(result):
+    student_entity, annotator_entity = result
+    return {'student': student_entity, **{f'annotator{annotator_id}': entity
+                                          for annotator_id, entity in annotator_entity.items()}}
+
+
+def student_and_both(result):
+    student_entity, annotator_entity = result
+    return {'student': student_entity, 'both_anotators': annotator_entity}
+
+
+def single_entity(result):
+    return {'annotator': result}
+
+
+# Conversor -> função que separa o resultado de convert_document nos registros de cada fonte
+converters = {
+    'make_dataset': student_and_annotators,
+    'merge_datasets': student_and_both,
+    'error_detection_dataset': single_entity,
+}
+
+
+def load_converter(name):
+    """convert_document do conversor e a função que separa o resultado por fonte"""
+    module = importlib.import_module(f'convert.{name}')
+    return module.convert_document, converters[name]
+
+
+def split_fraction(text_id, seed=0):
+    """Número em [0, 1) sorteado pelo hash do text_id, o mesmo em qualquer máquina e execução"""
+    digest = hashlib.blake2b(f'{seed}:{text_id}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+
+def document_stratum(document):
+    """Tipo de erro mais anotado no documento, somando os anotadores, ou no_error"""
+    _, text, annotations = document
+    counts = Counter()
+    for _, labels in annotations:
+        for start_char, end_char, label in labels:
+            error_type = span_error_type(text, start_char, end_char, label)
+            if error_type is not None:
+                counts[error_type] += 1
+    if not counts:
+        return no_error
+    # Empates ficam com o primeiro tipo de ERROR_TYPES
+    return max(ERROR_TYPES, key=lambda error_type: counts[error_type])
+
+
+class Splitter:
+    """Escolhe o split de cada documento pelo hash do text_id, então o mesmo documento cai no mesmo
+    split em qualquer ordem de leitura e execução
+    :param test_ratio: fração dos documentos no teste
+    :param seed: semente do hash
+    :param stratify: ordena os documentos de cada tipo de erro pela fração sorteada e manda os
+        round(test_ratio * n) primeiros para o teste, o que exige chamar fit com todos os documentos antes
+    """
+
+    def __init__(self, test_ratio=0.2, seed=0, stratify=False):
+        self.test_ratio = test_ratio
+        self.seed = seed
+        self.stratify = stratify
+        self.test_ids = None
+
+    def fit(self, strata, done=(), written=None):
+        """Escolhe os documentos do teste de cada estrato
+        :param strata: dict text_id -> estrato de todos os documentos, inclusive os já escritos
+        :param done: text_ids já escritos, que continuam no split em que estão
+        :param written: dict estrato -> documentos já escritos no teste, descontados do teste de cada estrato
+        :return: o próprio Splitter
+        """
+        written = written or {}
+        text_ids_by_stratum = defaultdict(list)
+        for text_id, stratum in strata.items():
+            text_ids_by_stratum[stratum].append(text_id)
+
+        self.test_ids = set()
+        for stratum, text_ids in text_ids_by_stratum.items():
+            missing = round(self.test_ratio * len(text_ids)) - written.get(stratum, 0)
+            # O text_id desempata frações iguais, então a escolha não depende da ordem de leitura
+            new_ids = sorted((text_id for text_id in text_ids if text_id not in done),
+                             key=lambda text_id: (split_fraction(text_id, self.seed), str(text_id)))
+            self.test_ids.update(new_ids[:max(missing, 0)])
+        return self
+
+    def split(self, text_id):
+        if self.stratify:
+            if self.test_ids is None:
+                raise ValueError('Chame fit com os estratos de todos os documentos antes de dividir com stratify')
+            return 'test' if text_id in self.test_ids else 'train'
+        return 'test' if split_fraction(text_id, self.seed) < self.test_ratio else 'train'
+
+    def __call__(self, document):
+        """
+        :return: split e estrato do documento (None sem stratify)
+        """
+        stratum = document_stratum(document) if self.stratify else None
+        return self.split(document[0]), stratum
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(directory, manifest):
+    manifest['shards'].sort(key=lambda shard: (shard['split'], shard['index']))
+    path = os.path.join(directory, 'manifest.json')
+    # Escreve num arquivo temporário para que uma interrupção nunca deixe o manifest pela metade
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def new_manifest(settings):
+    return {'version': MANIFEST_VERSION, **settings, 'shards': []}
+
+
+def check_settings(manifest, settings):
+    """Os shards já escritos só podem ser completados com as mesmas configurações"""
+    changed = [name for name, value in settings.items() if manifest.get(name) != value]
+    if manifest.get('version') != MANIFEST_VERSION or changed:
+        raise ValueError(f"Os shards existentes foram escritos com outras configurações ({', '.join(changed)}), "
+                         f"use --rebuild para escrever tudo de novo")
+
+
+def plan_shards(documents, splitter, shard_size, done=(), next_index=None):
+    """Agrupa os documentos que ainda não estão em nenhum shard em shards de cada split
+    :param documents: iterável de (text_id, texto, [(annotator_id, labels), ...])
+    :param done: text_ids já escritos
+    :param next_index: índice do próximo shard de cada split
+    :return: gerador de (split, índice, documentos, estratos), no máximo shard_size documentos por split em memória
+    """
+    next_index = dict(next_index or dict.fromkeys(splits, 0))
+    buffers = {split: [] for split in splits}
+    strata = {split: Counter() for split in splits}
+    for document in documents:
+        if document[0] in done:
+            continue
+        split, stratum = splitter(document)
+        buffers[split].append(document)
+        if stratum is not None:
+            strata[split][stratum] += 1
+        if len(buffers[split]) == shard_size:
+            yield split, next_index[split], buffers[split], dict(strata[split])
+            next_index[split] += 1
+            buffers[split], strata[split] = [], Counter()
+    for split in splits:
+        if buffers[split]:
+            yield split, next_index[split], buffers[split], dict(strata[split])
+
+
+def write_shard(directory, split, index, documents, converter='make_dataset', file_format='jsonl',
+                token_alignment='expand', cache=None):
+    """Converte os documentos de um shard e escreve um arquivo por fonte
+    :return: entrada do shard no manifest
+    """
+    convert_document, records_of = load_converter(converter)
+    if cache is not None:
+        convert_document = CachedConverter(convert_document, cache)
+    os.makedirs(os.path.join(directory, split), exist_ok=True)
+
+    writers = {}
+    try:
+        for document in documents:
+            for source, record in records_of(convert_document(document, token_alignment=token_alignment)).items():
+                if source not in writers:
+                    path = os.path.join(directory, split, f'{source}-{index:05d}.partial.jsonl')
+                    writers[source] = open_writer(path, file_format)
+                writers[source].write(record)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Os arquivos só recebem o nome final quando o shard está completo
+    files = {}
+    for source, writer in sorted(writers.items()):
+        path = writer.path.replace('.partial.', '.')
+        os.replace(writer.path, path)
+        files[source] = os.path.relpath(path, directory)
+    return {'split': split, 'index': index, 'documents': len(documents),
+            'text_ids': [document[0] for document in documents], 'files': files}
+
+
+def remove_partial_files(directory):
+    """Remove os arquivos de shards interrompidos antes de terminar"""
+    for split in splits:
+        folder = os.path.join(directory, split)
+        if os.path.isdir(folder):
+            for filename in os.listdir(folder):
+                if '.partial.' in filename:
+                    os.remove(os.path.join(folder, filename))
+
+
+def build_shards(path, directory, shard_size=64, test_ratio=0.2, seed=0, stratify=False, converter='make_dataset',
+                 file_format='jsonl', token_alignment='expand', jobs=1, cache=None, rebuild=False, report=None):
+    """Escreve os shards que faltam para as anotações de path
+    :param path: pasta com as semanas de anotação
+    :param directory: pasta dos shards e do manifest.json
+    :param jobs: processos escrevendo shards ao mesmo tempo, 0 usa todos os núcleos
+    :param cache: ConversionCache ou None
+    :param rebuild: apaga o manifest e escreve todos os shards de novo
+    :param report: JoinReport que recebe os problemas da junção das anotações
+    :return: manifest atualizado
+    """
+    if converter not in converters:
+        raise ValueError(f"Conversor {converter} deve ser um de {', '.join(converters)}")
+    settings = {'shard_size': shard_size, 'test_ratio': test_ratio, 'seed': seed, 'stratify': stratify,
+                'converter': converter, 'format': file_format, 'token_alignment': token_alignment}
+    os.makedirs(directory, exist_ok=True)
+    manifest = None if rebuild else read_manifest(directory)
+    if manifest is None:
+        if rebuild:
+            import shutil
+            for split in splits:
+                shutil.rmtree(os.path.join(directory, split), ignore_errors=True)
+        manifest = new_manifest(settings)
+    else:
+        check_settings(manifest, settings)
+    remove_partial_files(directory)
+
+    done = {text_id for shard in manifest['shards'] for text_id in shard['text_ids']}
+    next_index = {split: max((shard['index'] + 1 for shard in manifest['shards'] if shard['split'] == split),
+                             default=0) for split in splits}
+    splitter = Splitter(test_ratio, seed, stratify)
+    if stratify:
+        # O teste de cada estrato depende de todos os documentos, então as anotações são lidas duas vezes
+        strata = {document[0]: document_stratum(document) for document in join_annotations(path)}
+        written = Counter()
+        for shard in manifest['shards']:
+            if shard['split'] == 'test':
+                written.update(shard.get('strata', {}))
+        splitter.fit(strata, done, written)
+    plan = plan_shards(join_annotations(path, report=report), splitter, shard_size, done, next_index)
+    options = {'converter': converter, 'file_format': file_format, 'token_alignment': token_alignment,
+               'cache': cache}
+
+    def finish(shard, strata):
+        if stratify:
+            shard['strata'] = strata
+        manifest['shards'].append(shard)
+        # O manifest é salvo a cada shard, então uma interrupção perde no máximo os shards em andamento
+        write_manifest(directory, manifest)
+
+    jobs = resolve_jobs(jobs)
+    if jobs == 1:
+        for split, index, documents, strata in plan:
+            finish(write_shard(directory, split, index, documents, **options), strata)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=load_pipeline) as executor:
+            running = {}
+            for split, index, documents, strata in plan:
+                running[executor.submit(write_shard, directory, split, index, documents, **options)] = strata
+                # Só alguns shards por processo ficam em memória por vez
+                if len(running) >= jobs * 2:
+                    completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        finish(future.result(), running.pop(future))
+            for future in list(running):
+                finish(future.result(), running.pop(future))
+
+    write_manifest(directory, manifest)
+    if cache is not None:
+        cache.evict()
+    return manifest
+
+
+class ShardedDataset:
+    """Registros de uma fonte num split, lidos shard a shard
+    :param directory: pasta com o manifest.json
+    :param rank: com world_size, lê só os shards rank, rank + world_size, ... para leitores concorrentes
+    """
+
+    def __init__(self, directory, split='train', source='student', rank=0, world_size=1):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError(f'{directory} não tem manifest.json')
+        self.directory = directory
+        self.split = split
+        self.source = source
+        self.format = manifest['format']
+        shards = [shard for shard in manifest['shards'] if shard['split'] == split and source in shard['files']]
+        self.shards = sorted(shards, key=lambda shard: shard['index'])[rank::world_size]
+
+    def __len__(self):
+        return sum(shard['documents'] for shard in self.shards)
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, shard['files'][self.source])
+
+    def load_shard(self, shard):
+        """Registros de um shard: lista de dicts no jsonl ou ColumnarDataset mapeado em memória"""
+        path = self.shard_path(shard)
+        if self.format == 'jsonl':
+            with open(path, encoding='utf-8') as file:
+                return [json.loads(line) for line in file if line.strip()]
+        from convert.columnar import ColumnarDataset
+
+        return ColumnarDataset(path)
+
+    def iter_records(self, start_shard=0):
+        """Registros de todos os shards a partir de start_shard, para retomar uma leitura interrompida"""
+        for shard in self.shards[start_shard:]:
+            yield from self.load_shard(shard)
+
+    def __iter__(self):
+        return self.iter_records()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Pasta com as semanas de anotação')
+    parser.add_argument('directory', help='Pasta dos shards e do manifest.json')
+    parser.add_argument('--shard-size', type=int, default=64, help='Documentos por shard')
+    parser.add_argument('--test-ratio', type=float, default=0.2, help='Fração dos documentos no teste')
+    parser.add_argument('--seed', type=int, default=0, help='Semente do hash que escolhe o split')
+    parser.add_argument('--stratify', action='store_true',
+                        help='Sorteia o teste dentro de cada tipo de erro predominante, com round(test-ratio * n) '
+                             'documentos de cada tipo no teste')
+    parser.add_argument('--converter', choices=sorted(converters), default='make_dataset')
+    parser.add_argument('--token-alignment', choices=('contract', 'expand'), default='expand')
+    parser.add_argument('--rebuild', action='store_true', help='Apaga os shards existentes e escreve tudo de novo')
+    args = add_format_argument(add_cache_arguments(add_jobs_argument(parser))).parse_args()
+
+    manifest = build_shards(args.path, args.directory, shard_size=args.shard_size, test_ratio=args.test_ratio,
+                            seed=args.seed, stratify=args.stratify, converter=args.converter,
+                            file_format=args.format, token_alignment=args.token_alignment, jobs=args.jobs,
+                            cache=cache_from_args(args), rebuild=args.rebuild)
+    for split in splits:
+        shards = [shard for shard in manifest['shards'] if shard['split'] == split]
+        print(f"{split}: {len(shards)} shards, {sum(shard['documents'] for shard in shards)} documentos")
+
+
+if __name__ == '__main__':
+    main()
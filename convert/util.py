@@ -1,125 +1,247 @@
+import json
 import os
 import re
+import unicodedata
 
-import pandas as pd
-import srsly
+from utils import instrument
+from utils.offsets import OffsetMap, TextEditor
+from utils.preprocess import fix_break_lines
 
 
-def remove_repeated_punctuation(text_list, start_char, ref_punct):
-    """Remove pontuação repetida"""
-    shift = 0
-    for j in range(start_char, len(text_list)):
-        if text_list[j] != ref_punct:
-            text_list.pop(j)
-            shift -= 1
-        if text_list[j] in [' ', '\n', '\t']:
-            break
+whitespaces = [' ', '\n', '\t']
+punctuations = ['.', ',', ';', ':', '!', '?']
+
 
-    return text_list, shift
+def remove_repeated_punctuation(editor, start_char, ref_punct):
+    """Remove os caracteres diferentes de ref_punct até o próximo espaço
+    :param editor: TextEditor do texto
+    :param start_char: índice do caracter a partir do qual a busca será feita
+    :param ref_punct: pontuação que deve ser mantida
+    """
+    for j in range(start_char, len(editor)):
+        if editor[j] in whitespaces:
+            break
+        if editor[j] != ref_punct:
+            editor.delete(j, j + 1)
 
 
-def remove_extra_punctuation(ann_text_list, start_char):
+def remove_extra_punctuation(editor, start_char):
     """Remove pontuação extra
-    :param ann_text_list: lista de caracteres do texto
+    :param editor: TextEditor do texto
     :param start_char: índice do caracter a partir do qual a busca será feita
-    :return: lista de caracteres do texto
+    :return: índice do primeiro caracter mantido
     """
-    shift = 0
     i = start_char
-    char = ann_text_list[start_char]
+    while i < len(editor) and editor[i] in whitespaces + punctuations:
+        i += 1
+    if i > start_char:
+        editor.delete(start_char, i)
 
-    while char in [' ', '\n', '\t', '.', ',', ';', ':', '!', '?']:
-        ann_text_list.pop(i)
-        shift -= 1
+    return i
 
-        char = ann_text_list[i]
 
-    return ann_text_list, shift
-
-
-def define_char_case(punct, text_list, i):
+def define_char_case(punct, editor, i):
     """Define se o caracter é maiúsculo ou minúsculo"""
 
+    if i >= len(editor):
+        return
     if punct == '.':
-        text_list[i + 2] = text_list[i + 2].upper()
+        char = editor[i].upper()
         # Coloca aprimeira letra em maiúsculo
     elif punct == ',':
-        text_list[i + 2] = text_list[i + 2].lower()
+        char = editor[i].lower()
         # Coloca a primeira letra em minúsculo
-    return text_list
+    else:
+        return
+    if char != editor[i]:
+        editor.replace(i, i + 1, char)
 
 
 def read_data(path):
     """Lê os dados do arquivo"""
+    import pandas as pd
+
     data = []
-    print(path)
-    for root, dirs, files in os.walk(path, topdown=True):
+    if instrument.debug_hook is not None:
+        instrument.debug_hook('read_data', path)
+    with instrument.stage('read_data'):
+        for root, dirs, files in os.walk(path, topdown=True):
 
-        for dir_name in dirs:
+            for dir_name in dirs:
 
-            if dir_name == 'Anotações':
-                print(root, dirs, files)
+                if dir_name == 'Anotações':
+                    if instrument.debug_hook is not None:
+                        instrument.debug_hook('read_data', root, dirs, files)
+                    for filename in os.listdir(os.path.join(root, dir_name)):
+                        df = pd.read_json(os.path.join(root, dir_name, filename), lines=True)
+                        df['annotator_id'] = int(re.findall(r'\d', filename)[0])
+                        data.append(df)
+
+        return pd.concat(data).rename(columns={'id': 'text_id'})
+
+
+annotation_dir = unicodedata.normalize('NFC', 'Anotações')
+id_pattern = re.compile(rb'^\{"id":\s*(\d+)')
+
+
+def find_annotation_files(path):
+    """Lista os arquivos de anotação das pastas Anotações
+    :return: lista ordenada de (caminho do arquivo, id do anotador)
+    """
+    files = []
+    for root, dirs, _ in os.walk(path):
+        for dir_name in dirs:
+            # O nome da pasta aparece tanto em NFC quanto em NFD dependendo de onde foi criada
+            if unicodedata.normalize('NFC', dir_name) == annotation_dir:
                 for filename in os.listdir(os.path.join(root, dir_name)):
-                    df = pd.read_json(os.path.join(root, dir_name, filename), lines=True)
-                    df['annotator_id'] = int(re.findall(r'\d', filename)[0])
-                    data.append(df)
+                    files.append((os.path.join(root, dir_name, filename), int(re.findall(r'\d', filename)[0])))
+    return sorted(files)
+
+
+def index_jsonl(path):
+    """Indexa as linhas de um jsonl pelo id, guardando só o byte onde cada linha começa
+    :return: dicionário de id para a lista de offsets das linhas com esse id
+    """
+    index = {}
+    offset = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                match = id_pattern.match(line)
+                text_id = int(match.group(1)) if match else json.loads(line)['id']
+                index.setdefault(text_id, []).append(offset)
+            offset += len(line)
+    return index
+
+
+def iter_data(path, report=None, complete=False):
+    """Lê as anotações sob demanda, agrupadas por text_id como em read_data(path).groupby('text_id')
+    :param path: pasta com as semanas de anotação
+    :param report: JoinReport que recebe os textos faltando ou diferentes entre os anotadores
+    :param complete: descarta os textos que algum anotador não anotou
+    :return: gerador de (text_id, texto, [(annotator_id, labels), ...]) ordenado por text_id
+    """
+    from convert.join import join_annotations
 
-    return pd.concat(data).rename(columns={'id': 'text_id'})
+    return join_annotations(path, report=report, complete=complete)
 
 
-def fix_punctuation(ann_text_list, start_char, end_char, punct):
-    other_punctuations = ['.', ',', ';', ':', '!', '?']
+def punctuation_anchor(editor, char, span_start=None):
+    """Onde começa a busca pelo lugar da pontuação, ancorada nas palavras em vez de uma janela fixa, para
+    que a pontuação nunca caia antes de uma palavra curta
+    :param char: último caracter do span
+    :param span_start: início do span anotado
+    :return: início da busca e fim da palavra de char. A busca começa no início da palavra de char, ou
+        logo depois da palavra anterior quando char não está numa palavra ou quando o span só pega o
+        começo da palavra seguinte, como em 'casa d' de 'casa depois'
+    """
+    # Os índices são os do texto original, então a busca lê o texto direto, sem passar pelo editor
+    text = editor.text
+    word_start = word_end = char
+    if text[char].isalnum():
+        while word_start > 0 and text[word_start - 1].isalnum():
+            word_start -= 1
+        while word_end < len(text) and text[word_end].isalnum():
+            word_end += 1
+        if span_start is None or span_start >= word_start or word_end == char + 1:
+            return word_start, word_end
+    while word_start > 0 and not text[word_start - 1].isalnum():
+        word_start -= 1
+    return word_start, char
+
+
+def fix_punctuation(editor, start_char, end_char, punct, span_start=None):
+    """Enfileira no editor a correção de pontuação do span anotado
+    :param editor: TextEditor com o texto original, os índices são sempre os do texto original
+    :param start_char: início do span
+    :param end_char: fim do span
+    :param punct: pontuação correta
+    :param span_start: início do span anotado inteiro, quando start_char é só o seu último caracter
+    :return: id da correção no editor, None se o texto é vazio
+    """
+    other_punctuations = punctuations.copy()
     other_punctuations.remove(punct)
-    shift = 0
-    try:
-        text_span = ann_text_list[start_char:end_char][0]
-    except IndexError:
+    if len(editor) == 0:
+        return None
+    # As edições desta correção entram todas juntas ou nenhuma, sem se misturar com as de outro anotador
+    correction = editor.begin_correction()
+
+    if start_char >= len(editor) or start_char >= end_char:
         # Não há matches com o caracter do texto e então significa que o aluno esqueceu ponto final.
-        if ann_text_list[-1] not in other_punctuations + ['.']:
-            ann_text_list.append('.')
-            shift += 1
-        elif ann_text_list[-1] in other_punctuations:
-            ann_text_list[-1] = '.'
-        return ann_text_list, shift
+        if editor[-1] not in punctuations:
+            editor.insert(len(editor), '.')
+        elif editor[-1] in other_punctuations:
+            editor.replace(len(editor) - 1, len(editor), '.')
+        return correction
+
+    text_span = editor[start_char]
     other_symbols = ['-']
     if text_span != punct and text_span not in other_symbols:
 
-        try:
-            for i in range(start_char - 3, end_char + 3):
-                old_char = ann_text_list[i]
-                if old_char in other_punctuations:
-                    ann_text_list[i] = punct
-                    ann_text_list = define_char_case(punct, ann_text_list, i)
-                    break
-                if old_char in [' ', '\n', '\t']:
-                    ann_text_list[i] = punct
-
-                    ann_text_list.insert(i + 1, old_char)
-                    shift += 1
-                    ann_text_list, shift_removed = remove_extra_punctuation(ann_text_list, i + 2)
-                    shift += shift_removed
-                    ann_text_list = define_char_case(punct, ann_text_list, i)
-                    break
-        except IndexError:
-            ann_text_list.append(punct)
-            shift += 1
+        search_start, word_end = punctuation_anchor(editor, start_char, span_start)
+        for i in range(search_start, max(word_end, end_char) + 3):
+            if i >= len(editor):
+                editor.insert(len(editor), punct)
+                break
+            old_char = editor[i]
+            if old_char in other_punctuations:
+                editor.replace(i, i + 1, punct)
+                define_char_case(punct, editor, i + 2)
+                break
+            if old_char in whitespaces:
+                # A pontuação entra antes do espaço e o que sobrar de espaço ou pontuação depois dele é removido
+                editor.insert(i, punct)
+                next_char = remove_extra_punctuation(editor, i + 1)
+                define_char_case(punct, editor, next_char)
+                break
 
     else:
 
-        for i in range(start_char - 1, end_char + 1):
-            if ann_text_list[i] in other_symbols + [punct]:
-                ann_text_list.pop(i)  # Remove pontuação extra
-
+        for i in range(max(start_char - 1, 0), min(end_char + 1, len(editor))):
+            if editor[i] in other_symbols + [punct]:
                 # Adiciona espaço após a pontuação se necessário
-                if end_char + 1 >= len(ann_text_list):
-                    ann_text_list.append('.')  # Adiciona ponto final
-                    break
-                if ann_text_list[i] in [' ', '\n', '\t']:
-                    shift -= 1
+                if end_char + 1 >= len(editor) - 1:
+                    editor.delete(i, i + 1)  # Remove pontuação extra
+                    editor.insert(len(editor), '.')  # Adiciona ponto final
+                elif editor[i + 1] in whitespaces:
+                    editor.delete(i, i + 1)
                 else:
-                    ann_text_list.insert(i, ' ')
-
-                    shift += 1
+                    editor.replace(i, i + 1, ' ')
                 break
+    return correction
+
+
+def apply_corrections(text, annotations):
+    """Aplica as correções de pontuação dos anotadores no texto bruto, como o texto do anotador é o do aluno
+    :param text: texto bruto do aluno
+    :param annotations: lista com os spans [início, fim, label] de cada anotador, no texto bruto
+    :return: texto bruto corrigido e spans (início, fim, label) dos erros no texto bruto corrigido. Quando
+        dois anotadores corrigem a mesma posição vale a última correção, e o erro das descartadas não é marcado
+    """
+    offsets = OffsetMap(len(text))
+    text = fix_break_lines(text, offsets)
+    editor = TextEditor(text)
+    erros_labels = []
+
+    for annotation in annotations:
+        for ann_span in annotation:
+            label = ann_span[2]
+            if label not in ['Erro de Pontuação', 'Erro de vírgula']:
+                continue
+
+            start_char, end_char = offsets.project_span(ann_span[0], ann_span[1])
+            if start_char >= end_char:
+                # O span era só uma quebra de linha escrita como /n
+                continue
+
+            symbol = '.' if label == 'Erro de Pontuação' else ','
+            correction = fix_punctuation(editor, end_char - 1, end_char, punct=symbol, span_start=start_char)
+
+            erros_labels.append((max(start_char - 1, 0), end_char, label, correction))
+
+    accepted = editor.accepted_corrections()
+    new_text, corrections = editor.apply(accepted)
+    erros_labels = [(*corrections.project_span(start_char, end_char), label)
+                    for start_char, end_char, label, correction in erros_labels if correction in accepted]
 
-    return ann_text_list, shift
+    return new_text, erros_labels
@@ -0,0 +1,69 @@
+import json
+import os
+
+from utils import instrument
+
+
+def encode_numpy(obj):
+    """Converte escalares e arrays do numpy e os registros de utils.records para tipos nativos sem precisar
+    importar o numpy"""
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+
+# Sem indent o json usa o encoder em C, e o default só é chamado para valores que ele não conhece
+encoder = json.JSONEncoder(default=encode_numpy)
+
+
+class JsonlWriter:
+    """Escreve um registro por linha assim que ele é convertido, sem manter o dataset em memória"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, record):
+        with instrument.stage('write_jsonl'):
+            self.file.write(encoder.encode(record))
+            self.file.write('\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_writer(path, file_format='jsonl'):
+    """Abre o escritor do formato, trocando a extensão .jsonl do caminho pela do formato colunar
+    :param file_format: 'jsonl', 'arrow' ou 'parquet'
+    """
+    if file_format == 'jsonl':
+        return JsonlWriter(path)
+    from convert.columnar import ColumnarWriter
+
+    return ColumnarWriter(os.path.splitext(path)[0] + '.' + file_format, file_format)
+
+
+def add_format_argument(parser):
+    parser.add_argument('--format', choices=('jsonl', 'arrow', 'parquet'), default='jsonl',
+                        help='Formato dos arquivos de saída, arrow e parquet precisam do pyarrow')
+    return parser
+
+
+def write_jsonl(path, records):
+    """Escreve os registros de um iterável num arquivo jsonl
+    :return: quantidade de registros escritos
+    """
+    with JsonlWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
@@ -0,0 +1,92 @@
+"""
+Local client of the preprocessing service, runs it end to end without external dependencies.
+
+Starts `python -m service.server` as a subprocess, sends the texts of the given JSON lines files
+(the annotations by default) while reading the answers, checks that every request was answered and
+prints the client side latencies together with the counters of the server.
+
+    python -m service.client annotations --limit 500 --max-batch-size 32 --max-latency-ms 10
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_texts(paths, limit=None):
+    texts = []
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '**', '*.jsonl'), recursive=True))
+        for filename in files:
+            with open(filename, encoding='utf-8') as file:
+                texts.extend(json.loads(line)['text'] for line in file)
+    return texts[:limit]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(ROOT, 'annotations')])
+    parser.add_argument('--limit', type=int, help='Maximum number of texts to send')
+    parser.add_argument('--max-batch-size', default='32')
+    parser.add_argument('--max-latency-ms', default='10')
+    parser.add_argument('--max-queue', default='1024')
+    args = parser.parse_args()
+
+    texts = load_texts(args.paths, args.limit)
+    server = subprocess.Popen([sys.executable, '-m', 'service.server', '--max-batch-size', args.max_batch_size,
+                               '--max-latency-ms', args.max_latency_ms, '--max-queue', args.max_queue],
+                              cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding='utf-8')
+    sent = {}
+
+    def send():
+        for i, text in enumerate(texts):
+            sent[i] = time.perf_counter()
+            server.stdin.write(json.dumps({'id': i, 'text': text}, ensure_ascii=False) + '\n')
+            server.stdin.flush()
+
+    start = time.perf_counter()
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+
+    latencies = []
+    errors = 0
+    answered = set()
+    while len(answered) < len(texts):
+        line = server.stdout.readline()
+        if not line:
+            break
+        response = json.loads(line)
+        answered.add(response['id'])
+        latencies.append(time.perf_counter() - sent[response['id']])
+        errors += 'error' in response
+    elapsed = time.perf_counter() - start
+    sender.join()
+
+    server.stdin.write(json.dumps({'command': 'stats'}) + '\n')
+    server.stdin.close()
+    server_stats = json.loads(server.stdout.readline())['stats']
+    server.wait()
+
+    missing = len(texts) - len(answered)
+    print(f'{len(texts)} requests in {elapsed:.2f} s ({len(texts) / elapsed:.1f} req/s), '
+          f'{errors} errors, {missing} unanswered')
+    print(f'client p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms')
+    print('server', json.dumps(server_stats))
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""
+Batch inference of the punctuation model over a stream of student essays.
+
+The essays are preprocessed and cut into windows (utils.windows), the windows of a buffer of
+essays are sorted by length into buckets and the model is called on full batches of similar
+lengths, so little of each batch is padding. The predictions are stitched back by word position
+into labels aligned with text2labels. Any callable works as the model: it gets a list of windows,
+each a list of lowercase words, and returns the label of every word, as an id of LABELS or as a
+name (the simpletransformers names O, COMMA, PERIOD and QUESTION are accepted).
+
+    python -m service.inference annotations --batch-size 32 --max-tokens 128 --output predictions.jsonl
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import zlib
+from itertools import islice
+
+import numpy as np
+
+from utils import instrument
+from utils.labels import LABELS, label2id
+from utils.windows import WhitespaceTokenizer, WindowedText
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Labels of the models trained on the TED talks punctuation datasets, questions count as periods
+model_labels = {**label2id, 'COMMA': label2id['I-COMMA'], 'PERIOD': label2id['I-PERIOD'],
+                'QUESTION': label2id['I-PERIOD']}
+
+
+def label_ids(prediction):
+    """Label ids of the prediction of one window, given as ids or as label names"""
+    if isinstance(prediction, np.ndarray) and prediction.dtype.kind in 'iu':
+        return prediction
+    return np.fromiter((label if isinstance(label, (int, np.integer)) else model_labels[label]
+                        for label in prediction), dtype=np.int8, count=len(prediction))
+
+
+def window_label_ids(prediction, words):
+    """
+    Label ids of the prediction of one window, checked against the window
+    :param words: number of words of the window
+    :raise ValueError: for an unknown label, a label id out of LABELS or a wrong number of labels
+    """
+    try:
+        ids = label_ids(prediction)
+    except KeyError as error:
+        raise ValueError(f'Unknown label {error.args[0]!r} in the prediction of the model') from None
+    if len(ids) != words:
+        raise ValueError(f'The model predicted {len(ids)} labels for a window of {words} words')
+    if len(ids) and (ids.min() < 0 or ids.max() >= len(LABELS)):
+        raise ValueError(f'Label id out of the {len(LABELS)} labels in the prediction of the model')
+    return ids
+
+
+class DummyModel:
+    """
+    CPU stand-in for the model: labels each word from a hash of it and ends every window with a
+    period. With cost_per_token it also waits that long for every token of the padded batch,
+    like a model whose cost grows with the padded length.
+    """
+
+    def __init__(self, comma_rate=0.05, period_rate=0.05, cost_per_token=0.0):
+        self.comma_rate = comma_rate
+        self.period_rate = period_rate
+        self.cost_per_token = cost_per_token
+
+    def __call__(self, batch):
+        if self.cost_per_token:
+            time.sleep(self.cost_per_token * len(batch) * max(map(len, batch), default=0))
+        predictions = []
+        for words in batch:
+            scores = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint32,
+                                 count=len(words)) / 2 ** 32
+            labels = np.zeros(len(words), dtype=np.int8)
+            labels[scores < self.comma_rate] = label2id['I-COMMA']
+            labels[scores > 1 - self.period_rate] = label2id['I-PERIOD']
+            if len(words):
+                labels[-1] = label2id['I-PERIOD']
+            predictions.append(labels)
+        return predictions
+
+
+class InferenceStats:
+    """Throughput and padding counters of the batches run"""
+
+    def __init__(self):
+        self.documents = self.errors = self.windows = self.batches = 0
+        self.words = self.tokens = self.padded_tokens = 0
+        self.model_seconds = 0.0
+        self.started = time.perf_counter()
+
+    def add_batch(self, lengths, padded_length, seconds):
+        self.batches += 1
+        self.windows += len(lengths)
+        self.tokens += sum(lengths)
+        self.padded_tokens += padded_length * len(lengths)
+        self.model_seconds += seconds
+
+    def report(self):
+        seconds = time.perf_counter() - self.started
+        return {'documents': self.documents, 'errors': self.errors, 'windows': self.windows,
+                'batches': self.batches,
+                'mean_batch_size': round(self.windows / self.batches, 2) if self.batches else 0,
+                'words': self.words, 'tokens': self.tokens, 'padded_tokens': self.padded_tokens,
+                'padding_ratio': round(1 - self.tokens / self.padded_tokens, 4) if self.padded_tokens else None,
+                'seconds': round(seconds, 3), 'model_seconds': round(self.model_seconds, 3),
+                'documents_per_s': round(self.documents / seconds, 1) if seconds else None,
+                'tokens_per_s': round(self.tokens / seconds, 1) if seconds else None}
+
+
+class BatchInference:
+    """
+    Runs a model over essays in length-bucketed batches of windows
+    """
+
+    def __init__(self, model, tokenizer=None, batch_size=32, max_tokens=510, overlap=20, special_tokens=2,
+                 padding='longest', buffer_size=1024, sort=True):
+        """
+        :param model: callable from a list of windows (lists of words) to the labels of their words
+        :param tokenizer: token counts of the words, see utils.windows, WhitespaceTokenizer by default
+        :param max_tokens: tokens per window, without the special_tokens the model adds to each one
+        :param padding: 'longest' pads each batch to its longest window, 'max_length' to max_tokens,
+            only used for the padding counters
+        :param buffer_size: essays whose windows are sorted together, bounds the memory used
+        :param sort: sort the windows by length before batching them
+        """
+        if padding not in ('longest', 'max_length'):
+            raise ValueError(f"Padding {padding} must be 'longest' or 'max_length'")
+        self.model = model
+        self.tokenizer = tokenizer or WhitespaceTokenizer()
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.special_tokens = special_tokens
+        self.padding = padding
+        self.buffer_size = buffer_size
+        self.sort = sort
+        self.stats = InferenceStats()
+
+    def prepare(self, text):
+        with instrument.stage('preprocess_text'):
+            return WindowedText.from_raw(text, tokenizer=self.tokenizer, max_tokens=self.max_tokens,
+                                         overlap=self.overlap)
+
+    def predict_windows(self, windows):
+        """
+        :param windows: list of (document, window) pairs
+        :return: list with the label ids of the words of each window, in the same order, or the
+            exception raised by the model or by the check of its prediction, so that one bad
+            window only fails its essay
+        """
+        lengths = [document.window_tokens(window) + self.special_tokens for document, window in windows]
+        order = sorted(range(len(windows)), key=lengths.__getitem__) if self.sort else list(range(len(windows)))
+        predictions = [None] * len(windows)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            words = [windows[i][0].window_words(windows[i][1]) for i in batch]
+            began = time.perf_counter()
+            try:
+                with instrument.stage('model'):
+                    outputs = list(self.model(words))
+                if len(outputs) != len(batch):
+                    raise ValueError(f'The model returned {len(outputs)} predictions for {len(batch)} windows')
+            except Exception as error:
+                outputs = [error] * len(batch)
+            batch_lengths = [lengths[i] for i in batch]
+            padded_length = max(batch_lengths) if self.padding == 'longest' else self.max_tokens + self.special_tokens
+            self.stats.add_batch(batch_lengths, padded_length, time.perf_counter() - began)
+            for i, window_words, output in zip(batch, words, outputs):
+                if isinstance(output, Exception):
+                    predictions[i] = output
+                    continue
+                try:
+                    predictions[i] = window_label_ids(output, len(window_words))
+                except ValueError as error:
+                    predictions[i] = error
+        return predictions
+
+    def run_buffer(self, essays):
+        """
+        :param essays: list of (essay id, raw text)
+        :return: list with the result of each essay
+        """
+        documents = []
+        for essay_id, text in essays:
+            try:
+                documents.append(self.prepare(text))
+            except Exception as error:
+                documents.append(error)
+
+        windows = [(document, window) for document in documents if not isinstance(document, Exception)
+                   for window in document.windows]
+        predictions = iter(self.predict_windows(windows))
+
+        results = []
+        for (essay_id, _), document in zip(essays, documents):
+            self.stats.documents += 1
+            if not isinstance(document, Exception):
+                document_predictions = [next(predictions) for _ in document.windows]
+                # The first window that failed fails the essay
+                document = next((prediction for prediction in document_predictions
+                                 if isinstance(prediction, Exception)), document)
+            if isinstance(document, Exception):
+                self.stats.errors += 1
+                results.append({'id': essay_id, 'error': f'{type(document).__name__}: {document}'})
+                continue
+            with instrument.stage('stitch'):
+                labels = document.stitch(document_predictions)
+            self.stats.words += len(document)
+            results.append({'id': essay_id, 'text': document.text, 'token_offsets': document.offsets.tolist(),
+                            'labels': [LABELS[i] for i in labels]})
+        return results
+
+    def run(self, essays):
+        """
+        Predict the labels of a stream of essays
+        :param essays: iterable of (essay id, raw text)
+        :return: generator with a dict for each essay, in the same order: id, preprocessed text,
+            token_offsets and labels as text2labels, or id and error
+        """
+        essays = iter(essays)
+        while buffer := list(islice(essays, self.buffer_size)):
+            yield from self.run_buffer(buffer)
+
+
+def iter_essays(paths):
+    """
+    (id, text) of the essays of .jsonl annotation files, .json datasets or folders with them. An
+    essay is given once even if several files have it, as the files of each annotator do
+    """
+    seen = set()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '**', '*.jsonl'), recursive=True))
+        for filename in files:
+            with open(filename, encoding='utf-8') as file:
+                if filename.endswith('.json'):
+                    records = json.load(file)
+                else:
+                    records = (json.loads(line) for line in file if line.strip())
+                for i, record in enumerate(records):
+                    essay_id = record.get('text_id', record.get('id'))
+                    if essay_id in seen:
+                        continue
+                    if essay_id is not None:
+                        seen.add(essay_id)
+                    yield i if essay_id is None else essay_id, record['text']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(ROOT, 'annotations')])
+    parser.add_argument('--limit', type=int, help='Maximum number of essays')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-tokens', type=int, default=510)
+    parser.add_argument('--overlap', type=int, default=20)
+    parser.add_argument('--padding', choices=('longest', 'max_length'), default='longest')
+    parser.add_argument('--buffer-size', type=int, default=1024, help='Essays whose windows are sorted together')
+    parser.add_argument('--no-sort', action='store_true', help='Batch the windows in the order of the essays')
+    parser.add_argument('--cost-per-token-us', type=float, default=0.0,
+                        help='Time the dummy model takes for each padded token, in microseconds')
+    parser.add_argument('--output', help='Write the predictions as JSON lines to this file')
+    args = instrument.add_profile_arguments(parser).parse_args()
+    instrument.profile_from_args(args)
+
+    inference = BatchInference(DummyModel(cost_per_token=args.cost_per_token_us / 1e6), batch_size=args.batch_size,
+                               max_tokens=args.max_tokens, overlap=args.overlap, padding=args.padding,
+                               buffer_size=args.buffer_size, sort=not args.no_sort)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for result in inference.run(islice(iter_essays(args.paths), args.limit)):
+            if output is not None:
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+    finally:
+        if output is not None:
+            output.close()
+    print(json.dumps(inference.stats.report(), indent=2))
+    sys.exit(1 if inference.stats.errors else 0)
+
+
+if __name__ == '__main__':
+    main()
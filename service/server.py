@@ -0,0 +1,215 @@
+"""
+Preprocessing service for inference time, reading JSON lines from stdin and writing JSON lines to stdout.
+
+Each request is {"id": ..., "text": ...} and is answered with {"id": ..., "title": ..., "lines": [...],
+"token_offsets": [[start, end], ...], "labels": [...]}, where the offsets refer to the lines joined
+with '\\n', or with {"id": ..., "error": ...}. {"command": "stats"} answers with the latency counters.
+Requests are grouped into micro-batches and the answers are written as each batch finishes.
+
+    python -m service.server --max-batch-size 32 --max-latency-ms 10 --max-queue 1024
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+
+from utils.labels import LABELS, batch_text2label_ids, text2label_ids
+from utils.preprocess import preprocess_text
+
+
+class LatencyStats:
+    """Counters of the service, with the latency percentiles over the last `window` requests"""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+
+    def add_batch(self, latencies, errors):
+        self.latencies.extend(latencies)
+        self.requests += len(latencies)
+        self.errors += errors
+        self.batches += 1
+
+    def percentile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def report(self):
+        def milliseconds(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {'requests': self.requests, 'errors': self.errors, 'batches': self.batches,
+                'mean_batch_size': round(self.requests / self.batches, 2) if self.batches else 0,
+                'p50_ms': milliseconds(self.percentile(50)), 'p99_ms': milliseconds(self.percentile(99))}
+
+
+def process_batch(texts):
+    """
+    Preprocess and label a batch of texts
+    :return: list with a response dict, without the id, for each text
+    """
+    # A text that fails only answers its own request with the error
+    preprocessed = []
+    for text in texts:
+        try:
+            preprocessed.append(preprocess_text(text))
+        except Exception as error:
+            preprocessed.append(error)
+    clean_texts = ['\n'.join(result[1]) for result in preprocessed if not isinstance(result, Exception)]
+    try:
+        offsets, labels, row_splits = batch_text2label_ids(clean_texts, padding=False)
+        labeled = [(offsets[start:end], labels[start:end]) for start, end in zip(row_splits[:-1], row_splits[1:])]
+    except Exception:
+        # One of the texts can't be labeled, label them one by one to answer the others
+        labeled = []
+        for clean_text in clean_texts:
+            try:
+                labeled.append(text2label_ids(clean_text))
+            except Exception as error:
+                labeled.append(error)
+
+    labeled = iter(labeled)
+    responses = []
+    for preprocessed_text in preprocessed:
+        result = preprocessed_text if isinstance(preprocessed_text, Exception) else next(labeled)
+        if isinstance(result, Exception):
+            responses.append({'error': str(result) if isinstance(result, ValueError)
+                              else f'{type(result).__name__}: {result}'})
+            continue
+        title, lines = preprocessed_text
+        text_offsets, text_labels = result
+        responses.append({'title': title, 'lines': lines, 'token_offsets': text_offsets.tolist(),
+                          'labels': [LABELS[i] for i in text_labels]})
+    return responses
+
+
+class MicroBatcher:
+    """
+    Groups the submitted texts into batches of at most max_batch_size, waiting at most max_latency
+    seconds after the first text of a batch. The queue is bounded, so submit waits when it is full.
+    """
+
+    def __init__(self, handler=process_batch, max_batch_size=32, max_latency=0.01, max_queue=1024):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.stats = LatencyStats()
+
+    async def submit(self, text):
+        """
+        Queue the text, waiting while the queue is full
+        :return: future with the response of the text, set once its batch is processed
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not isinstance(text, str):
+            # Answered right away, so it never reaches a batch with other requests
+            future.set_result({'error': f'text must be a string, not {type(text).__name__}'})
+            return future
+        await self.queue.put((text, future, time.perf_counter()))
+        return future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        """Process batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for text, _, _ in batch]
+            try:
+                # The batch runs in a thread so that reading requests goes on meanwhile
+                responses = await loop.run_in_executor(None, self.handler, texts)
+            except Exception as error:
+                responses = [{'error': f'{type(error).__name__}: {error}'}] * len(batch)
+
+            now = time.perf_counter()
+            self.stats.add_batch([now - submitted for _, _, submitted in batch],
+                                 sum('error' in response for response in responses))
+            for (_, future, _), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+
+async def serve(reader, write, batcher):
+    """
+    Answer the requests read from reader until EOF
+    :param reader: asyncio.StreamReader with the JSON lines requests
+    :param write: function that writes one response line
+    :param batcher: MicroBatcher
+    """
+    async def answer(request_id, future):
+        write({'id': request_id, **await future})
+
+    worker = asyncio.create_task(batcher.run())
+    pending = set()
+    while line := await reader.readline():
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            write({'id': None, 'error': f'Invalid JSON: {error}'})
+            continue
+        if not isinstance(request, dict):
+            write({'id': None, 'error': f'Request must be a JSON object, not {type(request).__name__}'})
+            continue
+        if request.get('command') == 'stats':
+            write({'id': request.get('id'), 'stats': batcher.stats.report()})
+            continue
+        # Reading stops here while the queue is full
+        future = await batcher.submit(request.get('text', ''))
+        task = asyncio.create_task(answer(request.get('id'), future))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.wait(pending)
+    worker.cancel()
+    return batcher.stats.report()
+
+
+async def main_async(args):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2 ** 24)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    def write(response):
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+    # Warm up the preprocessing patterns and the labeler before the first request
+    process_batch(['Texto de aquecimento, com pontuação.'])
+    batcher = MicroBatcher(max_batch_size=args.max_batch_size, max_latency=args.max_latency_ms / 1000,
+                           max_queue=args.max_queue)
+    report = await serve(reader, write, batcher)
+    print(json.dumps(report), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-latency-ms', type=float, default=10,
+                        help='Maximum time a request waits for its batch to fill')
+    parser.add_argument('--max-queue', type=int, default=1024,
+                        help='Maximum number of queued requests before reading stops')
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
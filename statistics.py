@@ -3,15 +3,14 @@ import os
 import re
 from collections import defaultdict
 
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-import pandas as pd
-
 ANNOTATOR_ID = 1
 
 
 def main():
+    # Bibliotecas de gráficos só são carregadas quando o relatório é gerado
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
     reports = {
         1: defaultdict(float),
         2: defaultdict(float)
@@ -1 +1,2 @@
 from .util import *
+from .util import __getattr__
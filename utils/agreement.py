@@ -0,0 +1,339 @@
+"""
+Label agreement and statistics of the datasets, computed with NumPy over batches of documents.
+
+The sources (for example annotator1, annotator2 and student) are joined by text_id while they
+are read, so a single pass over the files builds the label distributions, the confusion matrix
+and Cohen's kappa of every pair of sources, pooled over the corpus and per document. A text_id
+that repeats in a file is joined with the same occurrence of it in the other files.
+
+    python -m utils.agreement datasets/train --sources annotator1 annotator2 student --annotations annotations
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from itertools import combinations
+
+import numpy as np
+
+from .labels import LABELS, label2id, text2label_ids
+
+ERROR_TYPES = ['Esqueceu pontuação final [?!.]', 'Trocou pontuação final por vírgula', 'Esqueceu a vírgula',
+               'Trocou a vírgula por ponto final.']
+# The converters write .jsonl, the older datasets are .json lists
+DATASET_EXTENSIONS = ['.jsonl', '.json', '.arrow', '.parquet']
+# Student label and annotator label of each error type, as in the error_map of convert_to_spacy_ents
+ERROR_CELLS = {
+    ERROR_TYPES[0]: (label2id['O'], label2id['I-PERIOD']),
+    ERROR_TYPES[1]: (label2id['I-COMMA'], label2id['I-PERIOD']),
+    ERROR_TYPES[2]: (label2id['O'], label2id['I-COMMA']),
+    ERROR_TYPES[3]: (label2id['I-PERIOD'], label2id['I-COMMA']),
+}
+
+
+def label_array(labels):
+    """
+    Label ids of a list of label names, without a Python loop over the tokens
+    """
+    names = np.asarray(labels, dtype=object)
+    ids = np.zeros(len(names), dtype=np.int8)
+    for label_id, label in enumerate(LABELS[1:], start=1):
+        ids[names == label] = label_id
+    return ids
+
+
+def iter_label_sequences(path):
+    """
+    Label ids of each record of a dataset
+    :param path: .json list of records, .jsonl or columnar file written by convert.columnar
+    :return: generator of (text_id, label ids), records without labels are labeled from their text
+    """
+    if path.endswith('.arrow') or path.endswith('.parquet'):
+        from convert.columnar import ColumnarDataset
+
+        dataset = ColumnarDataset(path)
+        text_ids = dataset.column('text_id').to_pylist()
+        for i, text_id in enumerate(text_ids):
+            yield text_id, dataset.label_ids(i)
+        return
+
+    with open(path, encoding='utf-8') as file:
+        records = (json.loads(line) for line in file if line.strip()) if path.endswith('.jsonl') else json.load(file)
+        for record in records:
+            if 'labels' in record:
+                yield record.get('text_id', record.get('id')), label_array(record['labels'])
+            else:
+                yield record.get('text_id', record.get('id')), text2label_ids(record['text'])[1]
+
+
+def join_sources(sources, missing=None):
+    """
+    Join the label sequences of several sources by text_id and occurrence while they are read: the
+    n-th record of a text_id in a source is joined with the n-th record of it in the others. Only
+    the records not yet seen in every source are kept, so sources in the same order use constant memory.
+    :param sources: dict of source name to an iterable of (text_id, label ids)
+    :param missing: list that receives the text_ids missing from some source, once per occurrence,
+        once all are read
+    :return: generator of (text_id, {source: label ids})
+    """
+    names = list(sources)
+    iterators = {name: iter(sequences) for name, sequences in sources.items()}
+    occurrences = {name: Counter() for name in names}
+    pending = {}
+    active = list(names)
+    while active:
+        for name in list(active):
+            item = next(iterators[name], None)
+            if item is None:
+                active.remove(name)
+                continue
+            text_id, labels = item
+            occurrences[name][text_id] += 1
+            key = text_id, occurrences[name][text_id]
+            row = pending.setdefault(key, {})
+            row[name] = labels
+            if len(row) == len(names):
+                del pending[key]
+                yield text_id, {source: row[source] for source in names}
+    if missing is not None:
+        missing.extend(text_id for text_id, _ in sorted(pending, key=lambda key: (str(key[0]), key[1])))
+
+
+def confusions(first, second, counts, n_labels=len(LABELS)):
+    """
+    Confusion matrix of each document of a batch in a single bincount
+    :param first: labels of the first source, concatenated over the documents
+    :param second: labels of the second source, concatenated over the documents
+    :param counts: number of tokens of each document
+    :return: array (documents, n_labels, n_labels), rows are the labels of the first source
+    """
+    rows = np.repeat(np.arange(len(counts)), counts)
+    cells = (rows * n_labels + first.astype(np.int64)) * n_labels + second
+    return np.bincount(cells, minlength=len(counts) * n_labels * n_labels).reshape(len(counts), n_labels, n_labels)
+
+
+def cohen_kappa(confusion):
+    """
+    Cohen's kappa of one or many confusion matrices
+    :param confusion: array (..., n_labels, n_labels)
+    :return: kappa of each matrix, nan when both sources use a single and the same label
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    total = confusion.sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = np.trace(confusion, axis1=-2, axis2=-1) / total
+        expected = (confusion.sum(axis=-1) * confusion.sum(axis=-2)).sum(axis=-1) / total ** 2
+        return (observed - expected) / (1 - expected)
+
+
+def per_class(confusion):
+    """
+    Agreement of each label, taking the first source as reference
+    :return: dict of label to precision, recall and f1 of the second source
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    true_positives = np.diag(confusion)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = true_positives / confusion.sum(axis=0)
+        recall = true_positives / confusion.sum(axis=1)
+        f1 = 2 * precision * recall / (precision + recall)
+    return {label: {'precision': _number(precision[i]), 'recall': _number(recall[i]), 'f1': _number(f1[i])}
+            for i, label in enumerate(LABELS)}
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+class AgreementStatistics:
+    """
+    Streaming statistics of the label sequences of several sources. Documents are buffered and
+    processed in batches with NumPy, so memory only depends on the batch size.
+    """
+
+    def __init__(self, sources, batch_size=1024):
+        """
+        :param sources: names of the sources, every pair of them is compared
+        :param batch_size: documents processed at once
+        """
+        self.sources = list(sources)
+        self.pairs = list(combinations(self.sources, 2))
+        self.batch_size = batch_size
+        self.documents = 0
+        self.length_mismatches = []
+        self.distribution = {source: np.zeros(len(LABELS), dtype=np.int64) for source in self.sources}
+        self.confusion = {pair: np.zeros((len(LABELS), len(LABELS)), dtype=np.int64) for pair in self.pairs}
+        self.document_kappas = {pair: [] for pair in self.pairs}
+        self.batch = []
+
+    def update(self, text_id, labels):
+        """
+        :param labels: dict of source name to the label ids of the document
+        """
+        lengths = {len(labels[source]) for source in self.sources}
+        if len(lengths) > 1:
+            # Sources that tokenized the text differently can't be compared token by token
+            self.length_mismatches.append(text_id)
+            return
+        self.batch.append(labels)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        counts = np.fromiter((len(labels[self.sources[0]]) for labels in self.batch), dtype=np.int64,
+                             count=len(self.batch))
+        concatenated = {source: np.concatenate([np.asarray(labels[source], dtype=np.int8) for labels in self.batch])
+                        for source in self.sources}
+        for source, labels in concatenated.items():
+            self.distribution[source] += np.bincount(labels, minlength=len(LABELS))
+        for pair in self.pairs:
+            matrices = confusions(concatenated[pair[0]], concatenated[pair[1]], counts)
+            self.confusion[pair] += matrices.sum(axis=0)
+            self.document_kappas[pair].append(cohen_kappa(matrices))
+        self.documents += len(self.batch)
+        self.batch = []
+
+    def report(self):
+        """
+        Summary of everything seen so far
+        :return: dict with the label distribution of each source and, for each pair, the pooled
+            kappa, the distribution of the kappa per document, the confusion matrix and per class scores
+        """
+        self.flush()
+        report = {'documents': self.documents, 'length_mismatches': self.length_mismatches, 'labels': LABELS,
+                  'distribution': {}, 'pairs': {}}
+        for source, counts in self.distribution.items():
+            total = int(counts.sum())
+            report['distribution'][source] = {
+                'tokens': total,
+                'counts': dict(zip(LABELS, counts.tolist())),
+                'ratios': {label: round(count / total, 6) if total else None for label, count in zip(LABELS, counts)},
+            }
+        for pair in self.pairs:
+            kappas = np.concatenate(self.document_kappas[pair]) if self.document_kappas[pair] else np.array([])
+            defined = kappas[~np.isnan(kappas)]
+            report['pairs']['/'.join(pair)] = {
+                'kappa': _number(cohen_kappa(self.confusion[pair])),
+                'document_kappa': {
+                    'mean': _number(defined.mean()) if defined.size else None,
+                    'median': _number(np.median(defined)) if defined.size else None,
+                    'undefined': int(kappas.size - defined.size),
+                },
+                'confusion': self.confusion[pair].tolist(),
+                'per_class': per_class(self.confusion[pair]),
+            }
+        return report
+
+
+def error_type_counts(confusion):
+    """
+    Errors of the student according to an annotator, as in the error_map of convert_to_spacy_ents
+    :param confusion: confusion matrix with the student labels as rows and the annotator labels as columns
+    """
+    return {error_type: int(confusion[row, column]) for error_type, (row, column) in ERROR_CELLS.items()}
+
+
+def span_error_type(text, start_char, end_char, label):
+    """
+    Error type of an annotated span, as in the error_map of convert_to_spacy_ents
+    :return: one of ERROR_TYPES, None for spans that are not punctuation errors
+    """
+    marked = text[start_char:end_char]
+    if label == 'Erro de Pontuação' and marked != '.':
+        return ERROR_TYPES[1] if marked == ',' else ERROR_TYPES[0]
+    if label == 'Erro de vírgula':
+        return ERROR_TYPES[3] if marked == '.' else ERROR_TYPES[2]
+    return None
+
+
+def weekly_error_types(path):
+    """
+    Error types annotated in each week, from the spans of the annotation files
+    :param path: folder with the annotation weeks
+    :return: dict of week to annotator to the counts of ERROR_TYPES
+    """
+    from convert.util import find_annotation_files
+
+    weeks = {}
+    for filename, annotator_id in find_annotation_files(path):
+        week = os.path.basename(os.path.dirname(os.path.dirname(filename)))
+        counts = weeks.setdefault(week, {}).setdefault(annotator_id, dict.fromkeys(ERROR_TYPES, 0))
+        with open(filename, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                annotation = json.loads(line)
+                for start_char, end_char, label in annotation['label']:
+                    error_type = span_error_type(annotation['text'], start_char, end_char, label)
+                    if error_type is not None:
+                        counts[error_type] += 1
+    return dict(sorted(weeks.items()))
+
+
+def dataset_statistics(paths, batch_size=1024, annotations=None, student='student'):
+    """
+    Statistics of the datasets in one pass
+    :param paths: dict of source name to dataset file
+    :param annotations: folder with the annotation weeks, adds the error types of each week
+    :param student: name of the student source, adds the error types of each annotator against it
+    :return: report dict
+    """
+    stats = AgreementStatistics(paths, batch_size=batch_size)
+    missing = []
+    sources = {name: iter_label_sequences(path) for name, path in paths.items()}
+    for text_id, labels in join_sources(sources, missing):
+        stats.update(text_id, labels)
+    report = stats.report()
+    report['missing'] = missing
+
+    if student in paths:
+        report['error_types'] = {}
+        for first, second in stats.pairs:
+            if second == student:
+                report['error_types'][first] = error_type_counts(stats.confusion[first, second].T)
+            elif first == student:
+                report['error_types'][second] = error_type_counts(stats.confusion[first, second])
+    if annotations is not None:
+        report['weekly_error_types'] = weekly_error_types(annotations)
+    return report
+
+
+def dataset_path(directory, source, extension=None):
+    """
+    Dataset file of a source
+    :param extension: extension of the file, by default the first of DATASET_EXTENSIONS that exists
+    """
+    if extension is not None:
+        return os.path.join(directory, source + extension)
+    for extension in DATASET_EXTENSIONS:
+        path = os.path.join(directory, source + extension)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"{directory} has no {source} dataset with any of {', '.join(DATASET_EXTENSIONS)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='Folder with one dataset file per source')
+    parser.add_argument('--sources', nargs='+', default=['annotator1', 'annotator2', 'student'])
+    parser.add_argument('--extension', help='Extension of the dataset files, found from the files by default')
+    parser.add_argument('--annotations', help='Folder with the annotation weeks, for the error types of each week')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--output', help='Write the report to this file instead of stdout')
+    args = parser.parse_args()
+
+    paths = {source: dataset_path(args.directory, source, args.extension) for source in args.sources}
+    report = dataset_statistics(paths, batch_size=args.batch_size, annotations=args.annotations)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+
+if __name__ == '__main__':
+    main()
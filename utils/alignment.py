@@ -0,0 +1,118 @@
+from bisect import bisect_right
+
+from .tokenizer import get_tokenizer
+
+_nlp = None
+alignment_modes = ('strict', 'contract', 'expand')
+
+
+def get_nlp():
+    """
+    Blank Portuguese pipeline shared by the whole package, spaCy is only imported on the first call
+    """
+    global _nlp
+    if _nlp is None:
+        import spacy
+        _nlp = spacy.blank('pt')
+    return _nlp
+
+
+def __getattr__(name):
+    # Keeps `from utils.alignment import nlp` working without loading spaCy at import time
+    if name == 'nlp':
+        return get_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class TokenAligner:
+    """
+    Tokenize a document once and answer character span alignment queries
+    with binary search over the token offsets, mirroring spaCy's `Doc.char_span`.
+    """
+
+    def __init__(self, text, tokenizer=None):
+        """
+        :param text: text to be tokenized
+        :param tokenizer: name of the tokenizer backend or a callable returning TokenOffsets,
+            None uses the default backend
+        """
+        self.text = text
+        if not callable(tokenizer):
+            tokenizer = get_tokenizer(tokenizer)
+        # A token also owns its trailing whitespace (limits) when looking up a character
+        self.starts, self.ends, self.limits = tokenizer(text)
+        self._doc = None
+
+    @property
+    def doc(self):
+        """spaCy doc of the text, only built when a Span is needed"""
+        if self._doc is None:
+            self._doc = get_nlp().make_doc(self.text)
+        return self._doc
+
+    def __len__(self):
+        return len(self.starts)
+
+    def token_by_char(self, char_idx):
+        """
+        Find the token that contains the character
+        :param char_idx: index of the character
+        :return: index of the token or -1 if no token contains the character
+        """
+        i = bisect_right(self.starts, char_idx) - 1
+        if i >= 0 and char_idx < self.limits[i]:
+            return i
+        return -1
+
+    def char_span(self, start_char, end_char, alignment_mode='expand'):
+        """
+        Align a character span to the token boundaries
+        :param start_char: start character of the span
+        :param end_char: end character of the span
+        :param alignment_mode: one of 'strict', 'contract' or 'expand'
+        :return: start and end character of the aligned span or None if it can't be aligned
+        """
+        if alignment_mode not in alignment_modes:
+            raise ValueError(f"Alignment mode {alignment_mode} must be one of {', '.join(alignment_modes)}")
+        start = self.token_by_char(start_char)
+        if start < 0 or (alignment_mode == 'strict' and start_char != self.starts[start]):
+            return None
+        end = self.token_by_char(end_char - 1)
+        if end < 0 or (alignment_mode == 'strict' and end_char != self.ends[end]):
+            return None
+        if alignment_mode == 'contract':
+            if self.starts[start] < start_char:
+                start += 1
+            if end_char < self.ends[end]:
+                end -= 1
+            if end < start:
+                return None
+        elif alignment_mode == 'expand':
+            if start_char == self.ends[start]:
+                start += 1
+        end += 1
+        if not 0 <= start <= end <= len(self):
+            raise IndexError(f"Invalid token span {start}:{end} for a document with {len(self)} tokens")
+
+        new_start = self.starts[start] if start < len(self) else len(self.text)
+        new_end = new_start if start == end else self.ends[end - 1]
+        return new_start, new_end
+
+    def backtrack(self, start_char, tokens_delimiters):
+        """
+        Walk back from the character until the previous token delimiter
+        :param start_char: character to start from
+        :param tokens_delimiters: delimiters of the tokens
+        :return: first character after the delimiter
+        """
+        if start_char <= 0:
+            return start_char
+        limit = start_char - 1
+        return max((self.text.rfind(delimiter, 0, limit) for delimiter in tokens_delimiters
+                    if len(delimiter) == 1), default=-1) + 1
+
+    def span(self, start_char, end_char, alignment_mode='expand'):
+        """
+        Build the spaCy span for the characters using the cached doc
+        """
+        return self.doc.char_span(start_char, end_char, alignment_mode=alignment_mode)
@@ -0,0 +1,250 @@
+"""
+Evaluation of predicted labels against the annotators, with a sweep over the agreement of the annotators.
+
+The label sequences are read as integer arrays and joined by text_id and occurrence. For each document the token
+confusion matrix and the counts of matched spans are computed with NumPy, then the documents are
+sorted by the Cohen's kappa between the annotators, so the metrics of every kappa threshold are
+prefix sums of the same counts: the whole sweep costs one pass. Spans are runs of tokens with the
+same label, as seqeval reads the I- labels. Several prediction files are evaluated in a process pool,
+and everything is written as one tidy CSV table. The run fails when more than --max-dropped of the
+records can't be evaluated, because a source misses them or tokenized them differently.
+
+    python -m utils.evaluation datasets/train/student.json --gold datasets/train/annotator1.json \\
+        datasets/train/annotator2.json --output reports.csv
+"""
+import argparse
+import csv
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .agreement import cohen_kappa, confusions, iter_label_sequences, join_sources
+from .labels import LABELS
+
+THRESHOLDS = [round(0.1 * i, 1) for i in range(10)]
+# Largest fraction of the records that may be left out of the evaluation
+MAX_DROPPED = 0.05
+COLUMNS = ['model', 'gold', 'threshold', 'documents', 'level', 'label', 'precision', 'recall', 'f1', 'support']
+
+
+def spans(labels, rows):
+    """
+    Spans of the label sequences of many documents, concatenated
+    :param labels: label ids of every token
+    :param rows: document of every token
+    :return: arrays with the first token, last token and label of each span, in the concatenation
+    """
+    labeled = labels != 0
+    changed = np.ones(len(labels), dtype=bool)
+    changed[1:] = (labels[1:] != labels[:-1]) | (rows[1:] != rows[:-1])
+    starts = np.flatnonzero(labeled & changed)
+    ends_at = np.ones(len(labels), dtype=bool)
+    ends_at[:-1] = changed[1:]
+    ends = np.flatnonzero(labeled & ends_at)
+    return starts, ends, labels[starts]
+
+
+def span_counts(gold, predicted, rows, documents, n_labels=len(LABELS)):
+    """
+    Spans of the gold and predicted labels and the matched spans, per document and label
+    :return: three arrays (documents, n_labels) with the true positive, predicted and gold span counts
+    """
+    def keys(labels):
+        starts, ends, span_labels = spans(labels, rows)
+        return (starts.astype(np.int64) * len(labels) + ends) * n_labels + span_labels, rows[starts], span_labels
+
+    gold_keys, gold_rows, gold_labels = keys(gold)
+    predicted_keys, predicted_rows, predicted_labels = keys(predicted)
+    matched = np.isin(predicted_keys, gold_keys, assume_unique=True)
+
+    def count(document_rows, span_labels):
+        cells = document_rows.astype(np.int64) * n_labels + span_labels
+        return np.bincount(cells, minlength=documents * n_labels).reshape(documents, n_labels)
+
+    return (count(predicted_rows[matched], predicted_labels[matched]), count(predicted_rows, predicted_labels),
+            count(gold_rows, gold_labels))
+
+
+def scores(true_positives, predicted, gold):
+    """
+    Precision, recall and f1 of each label and their micro and macro averages, without the O label
+    :param true_positives: counts per label, the last axis is the label
+    :return: dict of label to arrays with precision, recall, f1 and support over the leading axes
+    """
+    true_positives, predicted, gold = (np.asarray(array, dtype=np.float64)[..., 1:]
+                                       for array in (true_positives, predicted, gold))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # As seqeval, a label never predicted or never in the gold scores 0 instead of nan
+        precision = np.nan_to_num(true_positives / predicted)
+        recall = np.nan_to_num(true_positives / gold)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+        micro_precision = np.nan_to_num(true_positives.sum(-1) / predicted.sum(-1))
+        micro_recall = np.nan_to_num(true_positives.sum(-1) / gold.sum(-1))
+        micro_f1 = np.nan_to_num(2 * micro_precision * micro_recall / (micro_precision + micro_recall))
+
+    result = {label: (precision[..., i], recall[..., i], f1[..., i], gold[..., i])
+              for i, label in enumerate(LABELS[1:])}
+    result['micro avg'] = micro_precision, micro_recall, micro_f1, gold.sum(-1)
+    result['macro avg'] = precision.mean(-1), recall.mean(-1), f1.mean(-1), gold.sum(-1)
+    return result
+
+
+def _counted(records, name, sequences):
+    for item in sequences:
+        records[name] += 1
+        yield item
+
+
+def load(prediction_path, gold_paths):
+    """
+    Label ids of the predictions and of each gold source, joined by text_id and occurrence
+    :return: dict of source to the concatenated label ids, token counts of each document, the
+        text_ids whose sequences have different lengths and the number of records of each source
+    """
+    records = Counter()
+    sources = {'model': iter_label_sequences(prediction_path)}
+    sources.update((name, iter_label_sequences(path)) for name, path in gold_paths.items())
+    sources = {name: _counted(records, name, sequences) for name, sequences in sources.items()}
+    sequences = {name: [] for name in sources}
+    counts = []
+    mismatches = []
+    for text_id, labels in join_sources(sources):
+        if len({len(labels[name]) for name in sources}) > 1:
+            mismatches.append(text_id)
+            continue
+        counts.append(len(labels['model']))
+        for name in sources:
+            sequences[name].append(np.asarray(labels[name], dtype=np.int8))
+    concatenated = {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int8)
+                    for name, arrays in sequences.items()}
+    return concatenated, np.asarray(counts, dtype=np.int64), mismatches, dict(records)
+
+
+def document_kappas(sequences, counts, gold_names):
+    """Kappa between the first two gold sources in each document, all ones with a single gold source"""
+    if len(gold_names) < 2:
+        return np.ones(len(counts))
+    return cohen_kappa(confusions(sequences[gold_names[0]], sequences[gold_names[1]], counts))
+
+
+def sweep(prediction_path, gold_paths, thresholds=THRESHOLDS, max_dropped=MAX_DROPPED, model=None):
+    """
+    Metrics of the predictions against every gold source, for the documents whose kappa between the
+    gold sources is at least each threshold. Documents with an undefined kappa only count in the
+    rows without threshold.
+    :param gold_paths: dict of gold source name to dataset file
+    :param max_dropped: largest fraction of the records of a source that may be left out, because
+        another source misses them or has a different number of tokens
+    :return: list of rows with the COLUMNS
+    """
+    model = model or os.path.splitext(os.path.basename(prediction_path))[0]
+    gold_names = list(gold_paths)
+    sequences, counts, mismatches, records = load(prediction_path, gold_paths)
+    documents = len(counts)
+    total = max(records.values(), default=0)
+    if total > documents:
+        message = (f'{prediction_path}: {total - documents} of {total} documents left out, '
+                   f'{len(mismatches)} of them with a different number of tokens')
+        if total - documents > max_dropped * total:
+            raise ValueError(f'{message}, more than the {max_dropped:.0%} allowed')
+        print(message, file=sys.stderr)
+    rows = np.repeat(np.arange(documents), counts)
+
+    kappas = document_kappas(sequences, counts, gold_names)
+    # Most agreed documents first, so each threshold keeps a prefix of them
+    order = np.argsort(-np.nan_to_num(kappas, nan=-np.inf), kind='stable')
+    sorted_kappas = kappas[order]
+    defined = np.count_nonzero(~np.isnan(kappas))
+    kept = [int(np.count_nonzero(sorted_kappas[:defined] >= threshold)) for threshold in thresholds]
+    prefixes = [(None, documents)] + list(zip(thresholds, kept))
+
+    table = []
+    for gold_name in gold_names:
+        gold, predicted = sequences[gold_name], sequences['model']
+        matrices = confusions(gold, predicted, counts)
+        levels = {
+            'token': (np.diagonal(matrices, axis1=1, axis2=2), matrices.sum(axis=1), matrices.sum(axis=2)),
+            'span': span_counts(gold, predicted, rows, documents),
+        }
+        for level, per_document in levels.items():
+            # Cumulative counts over the sorted documents, row i holds the first i documents
+            cumulative = [np.concatenate((np.zeros((1, len(LABELS))), np.cumsum(array[order], axis=0)))
+                          for array in per_document]
+            indexes = np.array([size for _, size in prefixes])
+            level_scores = scores(*(array[indexes] for array in cumulative))
+            for i, (threshold, size) in enumerate(prefixes):
+                for label, (precision, recall, f1, support) in level_scores.items():
+                    table.append({'model': model, 'gold': gold_name, 'threshold': threshold, 'documents': size,
+                                  'level': level, 'label': label, 'precision': round(float(precision[i]), 6),
+                                  'recall': round(float(recall[i]), 6), 'f1': round(float(f1[i]), 6),
+                                  'support': int(support[i])})
+    return table
+
+
+def _sweep(arguments):
+    return sweep(*arguments)
+
+
+def evaluate(prediction_paths, gold_paths, thresholds=THRESHOLDS, max_dropped=MAX_DROPPED, jobs=1):
+    """
+    Sweep of each prediction file, in a process pool when jobs is not 1
+    :param jobs: number of processes, 0 uses every core
+    :return: rows of every prediction file, in order
+    """
+    if jobs < 0:
+        raise ValueError(f'jobs must be 0 or more, got {jobs}')
+    tasks = [(path, gold_paths, thresholds, max_dropped) for path in prediction_paths]
+    if jobs == 0:
+        jobs = os.cpu_count()
+    if jobs == 1 or len(tasks) == 1:
+        results = map(_sweep, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            results = list(executor.map(_sweep, tasks))
+    return [row for rows in results for row in rows]
+
+
+def _jobs(value):
+    jobs = int(value)
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f'must be 0 or more, got {jobs}')
+    return jobs
+
+
+def write_table(rows, file):
+    writer = csv.DictWriter(file, fieldnames=COLUMNS, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('predictions', nargs='+', help='Datasets with the predicted labels, one per model')
+    parser.add_argument('--gold', nargs='+', required=True,
+                        help='Datasets of the annotators, the kappa is computed between the first two')
+    parser.add_argument('--thresholds', nargs='+', type=float, default=THRESHOLDS)
+    parser.add_argument('--max-dropped', type=float, default=MAX_DROPPED,
+                        help='Fail when a larger fraction of the documents is left out of the evaluation')
+    parser.add_argument('--jobs', type=_jobs, default=1,
+                        help='Processes evaluating the prediction files, 0 uses every core')
+    parser.add_argument('--output', help='CSV file of the table, stdout by default')
+    args = parser.parse_args()
+
+    gold_paths = {os.path.splitext(os.path.basename(path))[0]: path for path in args.gold}
+    try:
+        rows = evaluate(args.predictions, gold_paths, thresholds=args.thresholds, max_dropped=args.max_dropped,
+                        jobs=args.jobs)
+    except ValueError as error:
+        sys.exit(str(error))
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            write_table(rows, file)
+    else:
+        write_table(rows, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
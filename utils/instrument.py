@@ -0,0 +1,301 @@
+"""
+Stage timers, counters and debug hooks of the conversion pipeline.
+
+Everything is off by default and costs a function call at most. It is turned on with
+`configure`, the --profile flag of the converters or the PUNCTUATION_PROFILE environment
+variable, a comma separated list of modes:
+
+    time         wall time and calls of each stage, and the counters
+    cprofile     cProfile of each outermost stage, only in the main process
+    tracemalloc  peak of memory allocated inside each stage, over what was in use when it started
+
+    PUNCTUATION_PROFILE=time,tracemalloc PUNCTUATION_PROFILE_OUTPUT=profile.json python merge_datasets.py
+
+PUNCTUATION_DEBUG=1 prints the debug events (spans looked up, files read) to stderr.
+"""
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+
+MODES = ('time', 'cprofile', 'tracemalloc')
+
+modes = frozenset()
+stages = {}
+counters = {}
+profiles = {}
+started = None
+_stack = []
+_no_stage = contextlib.nullcontext()
+_report_path = False
+
+# Called as debug_hook(event, *args) when set. The callers check it is not None before building
+# the arguments, so the hook costs nothing when unset
+debug_hook = None
+
+
+def print_debug(event, *args):
+    """Debug hook that prints the events to stderr"""
+    print(event, *args, file=sys.stderr)
+
+
+def set_debug_hook(hook):
+    """
+    :param hook: callable receiving (event, *args), None disables the debug events
+    """
+    global debug_hook
+    debug_hook = hook
+
+
+def configure(new_modes):
+    """
+    Turn the instrumentation on or off, clearing what was recorded
+    :param new_modes: iterable or comma separated string of MODES, empty turns it off.
+        Any mode also records the stage times and the counters
+    """
+    global modes, started, count
+    if isinstance(new_modes, str):
+        new_modes = [mode.strip() for mode in new_modes.split(',') if mode.strip()]
+    new_modes = frozenset(new_modes)
+    unknown = new_modes - set(MODES) - {'1'}
+    if unknown:
+        raise ValueError(f"Profile modes {', '.join(sorted(unknown))} must be among {', '.join(MODES)}")
+    modes = new_modes - {'1'} | ({'time'} if new_modes else set())
+    count = _count if modes else _no_count
+    reset()
+    started = time.perf_counter() if modes else None
+
+
+def enabled():
+    return bool(modes)
+
+
+def reset():
+    """Clear the stages, counters and profiles recorded so far"""
+    stages.clear()
+    counters.clear()
+    profiles.clear()
+
+
+def _no_count(name, value=1):
+    pass
+
+
+def _count(name, value=1):
+    counters[name] = counters.get(name, 0) + value
+
+
+# count(name, value=1) adds to a counter, it is swapped by configure so the disabled one does nothing.
+# Call it as instrument.count, a name imported from this module would keep the old function
+count = _no_count
+
+
+def stage(name):
+    """
+    Context manager that records a stage of the pipeline, nested stages are recorded on their own
+    and are also part of the enclosing stage
+    :param name: name of the stage in the report
+    """
+    if not modes:
+        return _no_stage
+    return _Stage(name)
+
+
+class _Stage:
+    __slots__ = ('name', 'start', 'profile', 'base', 'children_peak')
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+        self.children_peak = 0
+
+    def __enter__(self):
+        if 'tracemalloc' in modes:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if _stack:
+                # The peak is reset for this stage, the enclosing one keeps what it had seen so far
+                _stack[-1].children_peak = max(_stack[-1].children_peak, peak)
+            tracemalloc.reset_peak()
+            self.base = current
+        if 'cprofile' in modes and not any(entry.profile for entry in _stack):
+            # Only one profiler can be active, so nested stages are part of the outermost profile
+            import cProfile
+
+            self.profile = profiles.setdefault(self.name, cProfile.Profile())
+            self.profile.enable()
+        _stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        _stack.pop()
+        if self.profile is not None:
+            self.profile.disable()
+        record = stages.get(self.name)
+        if record is None:
+            record = stages[self.name] = {'calls': 0, 'seconds': 0.0}
+        record['calls'] += 1
+        record['seconds'] += elapsed
+        if 'tracemalloc' in modes:
+            import tracemalloc
+
+            peak = max(tracemalloc.get_traced_memory()[1], self.children_peak)
+            # Only what was allocated over the memory in use when the stage started
+            record['peak_bytes'] = max(record.get('peak_bytes', 0), peak - self.base)
+            if _stack:
+                _stack[-1].children_peak = max(_stack[-1].children_peak, peak)
+        return False
+
+
+def timed_iter(name, iterable):
+    """
+    Record the time spent producing each item of an iterable as a stage, for readers that are generators
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class Staged:
+    """
+    Wraps a function so each call is recorded as a stage, can be sent to worker processes
+    """
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        with stage(self.name):
+            return self.function(*args, **kwargs)
+
+
+def snapshot():
+    """
+    Stages and counters recorded so far, as plain data that can be sent between processes
+    """
+    return {'stages': {name: dict(record) for name, record in stages.items()}, 'counters': dict(counters)}
+
+
+def merge(data):
+    """
+    Add a snapshot taken in another process to the records of this one
+    """
+    for name, other in data['stages'].items():
+        record = stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        record['calls'] += other['calls']
+        record['seconds'] += other['seconds']
+        if 'peak_bytes' in other:
+            record['peak_bytes'] = max(record.get('peak_bytes', 0), other['peak_bytes'])
+    for name, value in data['counters'].items():
+        counters[name] = counters.get(name, 0) + value
+
+
+class Collected:
+    """
+    Wraps the conversion of a document run in a worker process, returning the result with the
+    stages and counters it recorded so the main process can merge them
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.modes = modes - {'cprofile'}
+
+    def __call__(self, *args, **kwargs):
+        if modes != self.modes:
+            configure(self.modes)
+        reset()
+        result = self.function(*args, **kwargs)
+        return result, snapshot()
+
+
+def profile_stats(profile, limit=20):
+    """
+    Functions with the highest cumulative time of a cProfile
+    :return: list of dicts with the function, calls, own and cumulative seconds
+    """
+    import pstats
+
+    stats = pstats.Stats(profile)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{'function': f'{filename}:{line}({name})', 'calls': calls, 'tottime': round(tottime, 6),
+             'cumtime': round(cumtime, 6)}
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in functions]
+
+
+def report():
+    """
+    Machine readable report of what was recorded
+    :return: dict with the modes, the wall time since configure, the stages sorted by time,
+        the counters and the top functions of each profiled stage
+    """
+    wall = time.perf_counter() - started if started is not None else 0.0
+    stage_report = {}
+    for name, record in sorted(stages.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        entry = {'calls': record['calls'], 'seconds': round(record['seconds'], 6),
+                 'mean_ms': round(record['seconds'] / record['calls'] * 1000, 4),
+                 'share': round(record['seconds'] / wall, 4) if wall else None}
+        if 'peak_bytes' in record:
+            entry['peak_kib'] = round(record['peak_bytes'] / 1024, 1)
+        stage_report[name] = entry
+    return {'modes': sorted(modes), 'wall_seconds': round(wall, 6), 'stages': stage_report,
+            'counters': dict(sorted(counters.items())),
+            'profiles': {name: profile_stats(profile) for name, profile in profiles.items()}}
+
+
+def write_report(path=None):
+    """
+    Write the report as JSON
+    :param path: file to write, None or '-' writes to stderr
+    """
+    content = json.dumps(report(), indent=2)
+    if path is None or path == '-':
+        print(content, file=sys.stderr)
+    else:
+        with open(path, 'w') as file:
+            file.write(content + '\n')
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', default=os.environ.get('PUNCTUATION_PROFILE', ''),
+                        help=f"Comma separated profile modes among {', '.join(MODES)}")
+    parser.add_argument('--profile-output', default=os.environ.get('PUNCTUATION_PROFILE_OUTPUT'),
+                        help='Write the profile report as JSON to this file instead of stderr')
+    return parser
+
+
+def report_at_exit(path=None):
+    """
+    Write the report when the interpreter exits, calling it again only changes the file
+    :param path: file to write, None or '-' writes to stderr
+    """
+    global _report_path
+    if _report_path is False:
+        atexit.register(lambda: modes and write_report(_report_path))
+    _report_path = path
+
+
+def profile_from_args(args):
+    """Turn the instrumentation on from the arguments of add_profile_arguments, reporting at exit"""
+    configure(args.profile)
+    if modes:
+        report_at_exit(args.profile_output)
+
+
+if os.environ.get('PUNCTUATION_DEBUG'):
+    debug_hook = print_debug
+if os.environ.get('PUNCTUATION_PROFILE'):
+    configure(os.environ['PUNCTUATION_PROFILE'])
+    report_at_exit(os.environ.get('PUNCTUATION_PROFILE_OUTPUT'))
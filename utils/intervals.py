@@ -0,0 +1,54 @@
+from bisect import bisect_right
+
+from . import instrument
+
+
+class SpanIndex:
+    """
+    Sorted index of pairwise disjoint (start, end, ...) spans. Answers the same question as
+    `check_mergebility` with a binary search instead of a scan over every entity.
+    """
+
+    def __init__(self, spans=()):
+        """
+        :param spans: spans to insert, the ones overlapping an earlier span are dropped
+        """
+        self.starts = []
+        self.spans = []
+        # An empty span never passes check_mergebility, so once one is stored nothing else is merged
+        self.blocked = False
+        for span in spans:
+            self.insert_if_disjoint(span)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def overlaps(self, span):
+        """
+        Check if the span touches or overlaps a span of the index
+        :param span: span to be checked
+        :return: True if the span can't be merged with the index, False otherwise
+        """
+        # Spans only merge with a gap of at least one character, as in check_mergebility
+        if self.blocked:
+            return True
+        i = bisect_right(self.starts, span[1]) - 1
+        return i >= 0 and self.spans[i][1] >= span[0]
+
+    def insert_if_disjoint(self, span):
+        """
+        Insert the span if it doesn't overlap the spans of the index
+        :param span: span to be inserted
+        :return: True if the span was inserted, False otherwise
+        """
+        if self.overlaps(span):
+            instrument.count('overlapping_spans_dropped')
+            return False
+        self.blocked = span[0] >= span[1]
+        i = bisect_right(self.starts, span[0])
+        self.starts.insert(i, span[0])
+        self.spans.insert(i, span)
+        return True
@@ -0,0 +1,130 @@
+import re
+import string
+from itertools import repeat
+
+import numpy as np
+
+from .records import LABELS, label2id
+
+# Same expression as nltk.wordpunct_tokenize
+token_pattern = re.compile(r'\w+|[^\w\s]+')
+# Also captures the whitespace before each token, so the offsets come from the lengths alone
+gap_token_pattern = re.compile(r'(\s*)(\w+|[^\w\s]+)')
+
+WORD, COMMA, PERIOD, SKIP = 0, 1, 2, 3
+# text2labels checks `token not in string.punctuation`, which is a substring test, so tokens
+# like ',-.' are skipped while '...' or '—' are labeled as words
+token_kinds = {string.punctuation[i:j]: SKIP
+               for i in range(len(string.punctuation)) for j in range(i + 1, len(string.punctuation) + 1)}
+token_kinds.update({'.': PERIOD, '?': PERIOD, '!': PERIOD, ';': PERIOD, ',': COMMA})
+
+
+def _scan(text):
+    """
+    Tokenize the text in a single regex scan. The text is not lowercased first, since that can change
+    its length ('İ' becomes two characters) and move the offsets, and the kinds of the tokens don't
+    depend on the case
+    :return: arrays with the kind, start and end character of each token in the text
+    """
+    pairs = gap_token_pattern.findall(text)
+    gaps, tokens = zip(*pairs) if pairs else ((), ())
+    kinds = np.fromiter(map(token_kinds.get, tokens, repeat(WORD)), dtype=np.int8, count=len(tokens))
+    lengths = np.fromiter(map(len, tokens), dtype=np.int32, count=len(tokens))
+    ends = np.cumsum(np.fromiter(map(len, gaps), dtype=np.int32, count=len(gaps)) + lengths, dtype=np.int32)
+    return kinds, ends - lengths, ends
+
+
+def _label_tokens(texts, kinds, starts, ends, counts):
+    """
+    Label the scanned tokens of a batch of texts at once
+    :param texts: texts of the batch, only used in the error message
+    :param kinds: kind of every token of the batch, concatenated
+    :param starts: start character of every token of the batch, concatenated
+    :param ends: end character of every token of the batch, concatenated
+    :param counts: number of tokens of each text
+    :return: offsets and label ids of the words of the batch, concatenated, and the number of words of each text
+    """
+    spans = np.stack((starts, ends), axis=1)
+    rows = np.repeat(np.arange(len(counts)), counts)
+
+    is_word = kinds == WORD
+    words = np.cumsum(is_word)
+    word_counts = np.bincount(rows[is_word], minlength=len(counts))
+    first_word = np.concatenate(([0], np.cumsum(word_counts)[:-1]))
+
+    # Each mark labels the last word before it, and the last mark after a word wins
+    marks = np.flatnonzero((kinds == COMMA) | (kinds == PERIOD))
+    owner = words[marks] - 1
+    orphan = np.flatnonzero(owner < first_word[rows[marks]])
+    if orphan.size:
+        mark = marks[orphan[0]]
+        start, end = spans[mark]
+        raise ValueError(f"Sentence can't start with punctuation {texts[rows[mark]][start:end]}")
+
+    labels = np.zeros(int(words[-1]) if words.size else 0, dtype=np.int8)
+    last = np.ones(owner.size, dtype=bool)
+    last[:-1] = owner[1:] != owner[:-1]
+    labels[owner[last]] = kinds[marks[last]]
+
+    return spans[is_word], labels, word_counts
+
+
+def text2label_ids(text):
+    """
+    Label the tokens of the text as text2labels does, without building the token strings
+    :param text: text to be labeled
+    :return: (n, 2) array with the start and end character of each labeled token and
+        array with the label id of each token, see LABELS
+    """
+    kinds, starts, ends = _scan(text)
+    offsets, labels, _ = _label_tokens([text], kinds, starts, ends, [len(kinds)])
+    return offsets, labels
+
+
+def word_offsets(text):
+    """
+    Start and end character of the tokens text2label_ids labels, without labeling them, so texts
+    starting with punctuation or without any punctuation are accepted
+    :return: (n, 2) array
+    """
+    kinds, starts, ends = _scan(text)
+    is_word = kinds == WORD
+    return np.stack((starts[is_word], ends[is_word]), axis=1)
+
+
+def batch_text2label_ids(texts, padding=True, pad_id=-100, max_length=None):
+    """
+    Label a batch of texts, the labels of the whole batch are computed in one pass
+    :param texts: iterable of texts
+    :param padding: True returns padded arrays, False returns ragged arrays
+    :param pad_id: label id of the padding, -100 is ignored by the token classification loss
+    :param max_length: truncate the sequences to this length
+    :return: padded: offsets (batch, length, 2), labels (batch, length) and lengths (batch,)
+        ragged: offsets (tokens, 2), labels (tokens,) and row_splits (batch + 1,) where the
+        tokens of the text i are row_splits[i]:row_splits[i + 1]
+    """
+    texts = list(texts)
+    scans = [_scan(text) for text in texts]
+    kinds, starts, ends = (np.concatenate([scan[i] for scan in scans]) if scans else np.zeros(0, dtype=np.int32)
+                           for i in range(3))
+    counts = [len(scan[0]) for scan in scans]
+    offsets, labels, lengths = _label_tokens(texts, kinds, starts, ends, counts)
+    row_splits = np.concatenate(([0], np.cumsum(lengths)))
+
+    if max_length is not None and len(lengths) and lengths.max() > max_length:
+        keep = np.arange(len(labels)) - np.repeat(row_splits[:-1], lengths) < max_length
+        offsets, labels = offsets[keep], labels[keep]
+        lengths = np.minimum(lengths, max_length)
+        row_splits = np.concatenate(([0], np.cumsum(lengths)))
+
+    if not padding:
+        return offsets, labels, row_splits
+
+    length = int(lengths.max()) if len(lengths) else 0
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    columns = np.arange(len(labels)) - row_splits[rows]
+    padded_offsets = np.zeros((len(lengths), length, 2), dtype=np.int32)
+    padded_labels = np.full((len(lengths), length), pad_id, dtype=np.int64)
+    padded_offsets[rows, columns] = offsets
+    padded_labels[rows, columns] = labels
+    return padded_offsets, padded_labels, lengths
@@ -0,0 +1,185 @@
+"""
+Memoization of the preprocessing functions, keyed by a hash of the text.
+
+Results are kept in a size bounded LRU in memory and, when a directory is given, in pickle
+files on disk shared by every process and run. The edits recorded into an OffsetMap are
+cached with the result, so callers that pass a fresh OffsetMap get it filled in as well.
+
+    PUNCTUATION_MEMO_SIZE=0 disables the memory tier, PUNCTUATION_MEMO_DIR enables the disk tier
+"""
+import hashlib
+import os
+import pickle
+import threading
+from array import array
+from collections import OrderedDict
+from functools import wraps
+
+from . import instrument
+
+# Bump whenever the preprocessing rules change, so the results stored on disk are not reused
+VERSION = 1
+
+
+def text_key(text):
+    """Fast 128 bit hash of the text"""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def _is_fresh(offsets, length):
+    """Whether the OffsetMap is still the identity over a text of the given length"""
+    return (offsets.source_length == offsets.target_length == length and len(offsets) == (1 if length else 0)
+            and (not length or (offsets.sources[0] == offsets.targets[0] == 0 and offsets.lengths[0] == length)))
+
+
+class MemoCache:
+    """
+    LRU of function results keyed by (function name, hash of the text), with an optional disk tier
+    """
+
+    def __init__(self, max_size=4096, directory=None):
+        """
+        :param max_size: results kept in memory, 0 disables the memory tier
+        :param directory: folder of the disk tier, None disables it
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.bypasses = self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 or self.directory is not None
+
+    def path(self, namespace, key):
+        digest = key.hex()
+        return os.path.join(self.directory, f'v{VERSION}', namespace, digest[:2], digest + '.pkl')
+
+    def _load(self, namespace, key):
+        try:
+            with open(self.path(namespace, key), 'rb') as file:
+                return pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _dump(self, namespace, key, entry):
+        path = self.path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file first so another process never reads half a file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _store(self, key, entry):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup(self, namespace, key):
+        """
+        :return: entry stored for the key, from memory or disk, or None
+        """
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry is not None:
+                self.entries.move_to_end((namespace, key))
+                self.hits += 1
+                instrument.count('memo_hits')
+                return entry
+        if self.directory is not None:
+            entry = self._load(namespace, key)
+            if entry is not None:
+                self.disk_hits += 1
+                instrument.count('memo_disk_hits')
+                self._store((namespace, key), entry)
+                return entry
+        return None
+
+    def call(self, namespace, function, text, offsets=None):
+        """
+        Result of function(text, offsets), computed only once for each text
+        :param offsets: None or a fresh OffsetMap(len(text)) that receives the edits, any other
+            OffsetMap bypasses the cache
+        :return: title and list of lines, as the preprocessing functions
+        """
+        if offsets is not None and not _is_fresh(offsets, len(text)):
+            self.bypasses += 1
+            return function(text, offsets)
+
+        key = text_key(text)
+        entry = self.lookup(namespace, key)
+        if entry is None or (offsets is not None and entry[2] is None):
+            if entry is None:
+                self.misses += 1
+                instrument.count('memo_misses')
+            # The edits are only recorded when a caller asks for them
+            title, lines = function(text, offsets)
+            state = None if offsets is None else (array('l', offsets.sources), array('l', offsets.targets),
+                                                  array('l', offsets.lengths), offsets.target_length)
+            entry = title, tuple(lines), state
+            self._store((namespace, key), entry)
+            if self.directory is not None:
+                self._dump(namespace, key, entry)
+            return title, list(lines)
+
+        title, lines, state = entry
+        if offsets is not None:
+            sources, targets, lengths, offsets.target_length = state
+            offsets.sources, offsets.targets, offsets.lengths = array('l', sources), array('l', targets), \
+                array('l', lengths)
+        return title, list(lines)
+
+    def stats(self):
+        """Hit and miss counters of the cache"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'bypasses': self.bypasses, 'evictions': self.evictions,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else None}
+
+    def clear(self, disk=False):
+        """
+        Empty the memory tier and reset the counters
+        :param disk: also remove the files of the disk tier
+        """
+        with self.lock:
+            self.entries.clear()
+        self.hits = self.disk_hits = self.misses = self.bypasses = self.evictions = 0
+        if disk and self.directory is not None:
+            import shutil
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+cache = MemoCache(int(os.environ.get('PUNCTUATION_MEMO_SIZE', 4096)), os.environ.get('PUNCTUATION_MEMO_DIR') or None)
+
+
+def configure(max_size=4096, directory=None):
+    """
+    Replace the shared cache used by the memoized functions
+    :param max_size: results kept in memory, 0 disables the memory tier
+    :param directory: folder of the disk tier, None disables it
+    """
+    global cache
+    cache = MemoCache(max_size, directory)
+    return cache
+
+
+def memoize(function):
+    """
+    Memoize a function of (text, offsets=None) returning (title, lines) in the shared cache.
+    The undecorated function stays available as `__wrapped__`.
+    """
+    namespace = function.__name__
+
+    @wraps(function)
+    def wrapper(text, offsets=None):
+        if not cache.enabled:
+            return function(text, offsets)
+        return cache.call(namespace, function, text, offsets)
+    return wrapper
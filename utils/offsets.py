@@ -0,0 +1,252 @@
+from array import array
+from bisect import bisect_right, insort
+
+from . import instrument
+
+
+class OffsetMap:
+    """
+    Map character offsets of a source text onto the text obtained after a series of edits.
+    The map keeps only the segments copied unchanged from the source, as three arrays
+    (source start, target start and length), so a position is projected with one binary search.
+    """
+
+    def __init__(self, length):
+        """
+        :param length: length of the source text, the map starts as the identity
+        """
+        self.source_length = length
+        self.target_length = length
+        self.sources = array('l', [0] if length else [])
+        self.targets = array('l', [0] if length else [])
+        self.lengths = array('l', [length] if length else [])
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def apply(self, edits, length):
+        """
+        Compose the map with the edits of one more rule
+        :param edits: sorted, non-overlapping (start, end, replacement length) tuples in the current text
+        :param length: length of the current text, before the edits
+        """
+        # Segments of the current text that the rule copied unchanged and where they land
+        copied = []
+        position = shift = 0
+        for start, end, size in edits:
+            if start > position:
+                copied.append((position, position + shift, start - position))
+            shift += size - (end - start)
+            position = end
+        if length > position:
+            copied.append((position, position + shift, length - position))
+
+        sources, targets, lengths = array('l'), array('l'), array('l')
+        j = 0
+        for source, target, size in zip(self.sources, self.targets, self.lengths):
+            target_end = target + size
+            while j < len(copied) and copied[j][0] + copied[j][2] <= target:
+                j += 1
+            k = j
+            while k < len(copied) and copied[k][0] < target_end:
+                start, new_start, copied_size = copied[k]
+                lo, hi = max(start, target), min(start + copied_size, target_end)
+                sources.append(source + lo - target)
+                targets.append(new_start + lo - start)
+                lengths.append(hi - lo)
+                k += 1
+
+        self.sources, self.targets, self.lengths = sources, targets, lengths
+        self.target_length = length + shift
+        instrument.count('shifts_applied', len(edits))
+
+    def project(self, position, side='left'):
+        """
+        Project a source offset onto the edited text
+        :param position: offset in the source text
+        :param side: 'left' maps an offset inside an edited region to the start of its replacement
+            (use for span starts), 'right' maps it to the end of the replacement (use for span ends)
+        :return: offset in the edited text
+        """
+        i = bisect_right(self.sources, position) - 1
+        if i >= 0 and position < self.sources[i] + self.lengths[i]:
+            return self.targets[i] + position - self.sources[i]
+        if side == 'left':
+            return self.targets[i] + self.lengths[i] if i >= 0 else 0
+        return self.targets[i + 1] if i + 1 < len(self) else self.target_length
+
+    def project_span(self, start_char, end_char):
+        """
+        Project a source span onto the edited text
+        :return: start and end character of the span in the edited text
+        """
+        return self.project(start_char, 'left'), self.project(end_char, 'right')
+
+
+def journaled_sub(pattern, repl, text, offsets=None):
+    """
+    Same as pattern.sub(repl, text), recording the edits into the offset map when given.
+    Only the characters that actually changed in each match are recorded.
+    :param pattern: compiled regex
+    :param repl: replacement string or function
+    :param text: text to be edited
+    :param offsets: OffsetMap to record the edits
+    :return: edited text
+    """
+    if offsets is None:
+        return pattern.sub(repl, text)
+
+    pieces = []
+    edits = []
+    position = 0
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        new = repl(match) if callable(repl) else match.expand(repl)
+        old = text[start:end]
+        pieces.append(text[position:start])
+        pieces.append(new)
+        position = end
+        if new == old:
+            continue
+        # Skip the common prefix and suffix so only the changed characters are recorded
+        prefix = 0
+        limit = min(len(old), len(new))
+        while prefix < limit and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+            suffix += 1
+        edits.append((start + prefix, end - suffix, len(new) - prefix - suffix))
+    pieces.append(text[position:])
+
+    offsets.apply(edits, len(text))
+    return ''.join(pieces)
+
+
+def journaled_strip(text, offsets=None):
+    """
+    Same as text.strip(), recording the removed characters into the offset map when given.
+    """
+    new_text = text.strip()
+    if offsets is not None and len(new_text) != len(text):
+        start = len(text) - len(text.lstrip())
+        edits = [(0, start, 0)] if start else []
+        end = start + len(new_text)
+        if end < len(text):
+            edits.append((end, len(text), 0))
+        offsets.apply(edits, len(text))
+    return new_text
+
+
+def _conflict(first, second):
+    """Whether two (start, end) edits overlap. An insertion also conflicts with an edit it touches"""
+    (start, end), (other_start, other_end) = first, second
+    if start == end or other_start == other_end:
+        return other_start <= end and start <= other_end
+    return other_start < end and start < other_end
+
+
+class TextEditor:
+    """
+    Queue of edits made against the offsets of the original text. The edits are applied
+    in a single sweep by `apply`, which also returns the OffsetMap from the original text
+    to the edited one, so the callers never have to keep track of shifts.
+    """
+
+    def __init__(self, text):
+        """
+        :param text: original text
+        """
+        self.text = text
+        self.edits = []
+        self.correction = 0
+
+    def begin_correction(self):
+        """
+        Group the edits queued from now on into a new correction, which is applied whole or not at all
+        :return: id of the correction
+        """
+        self.correction += 1
+        return self.correction
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, index):
+        return self.text[index]
+
+    def replace(self, start_char, end_char, new):
+        """
+        Replace the original characters between start_char and end_char
+        """
+        self.edits.append((start_char, end_char, new, self.correction))
+
+    def insert(self, position, new):
+        self.replace(position, position, new)
+
+    def delete(self, start_char, end_char):
+        self.replace(start_char, end_char, '')
+
+    def accepted_corrections(self):
+        """
+        Corrections whose edits conflict with none of the corrections queued after them, so the last
+        correction made to a region wins, as when the corrections were applied one after the other.
+        The accepted edits are kept sorted and each edit is only checked against its neighbours.
+        """
+        corrections = {}
+        for start_char, end_char, _, correction in self.edits:
+            corrections.setdefault(correction, []).append((start_char, end_char))
+        accepted = set()
+        # Edits of different accepted corrections never overlap, so their ends are sorted as their starts
+        accepted_edits = []
+        for correction in reversed(corrections):
+            edits = corrections[correction]
+            if any(self._conflicts(edit, accepted_edits) for edit in edits):
+                instrument.count('conflicting_corrections_dropped')
+                continue
+            accepted.add(correction)
+            for edit in edits:
+                insort(accepted_edits, edit)
+        return accepted
+
+    @staticmethod
+    def _conflicts(edit, accepted_edits):
+        start_char, end_char = edit
+        i = bisect_right(accepted_edits, (end_char, float('inf')))
+        # Only the edits starting before the end of this one can conflict, the closest first
+        while i > 0 and accepted_edits[i - 1][1] >= start_char:
+            if _conflict(edit, accepted_edits[i - 1]):
+                return True
+            i -= 1
+        return False
+
+    def apply(self, accepted=None):
+        """
+        Apply the queued edits in order of position. A correction that conflicts with one queued
+        after it is dropped whole, so the last correction made to a region wins and two corrections
+        of the same position never interleave. Within a correction, an edit that overlaps one
+        already applied is dropped.
+        :param accepted: ids of the corrections to apply, accepted_corrections() by default
+        :return: edited text and the OffsetMap from the original text to the edited one
+        """
+        if accepted is None:
+            accepted = self.accepted_corrections()
+        pieces = []
+        edits = []
+        position = 0
+        # sorted is stable, so insertions at the same position keep the order they were queued
+        for start_char, end_char, new, correction in sorted(self.edits, key=lambda edit: (edit[0], edit[1])):
+            if correction not in accepted:
+                continue
+            if start_char < position or start_char > end_char or end_char > len(self.text):
+                instrument.count('overlapping_edits_dropped')
+                continue
+            pieces.append(self.text[position:start_char])
+            pieces.append(new)
+            edits.append((start_char, end_char, len(new)))
+            position = end_char
+        pieces.append(self.text[position:])
+
+        offsets = OffsetMap(len(self.text))
+        offsets.apply(edits, len(self.text))
+        return ''.join(pieces), offsets
@@ -1,109 +1,193 @@
 import json
 import re
 
-import spacy
-
-special_pattern = r'\s+|\n+|/n|\t+|-|—'
-marks = r'\[\w{0,3}|\W{0,3}\]|\(|\)'
-
-
-def join_split_words(text):
+from .alignment import get_nlp
+from .memo import memoize
+from .offsets import journaled_sub, journaled_strip
+
+special_pattern = re.compile(r'\s+|\n+|/n|\t+|-|—')
+marks = re.compile(r'\[\w{0,3}|\W{0,3}\]|\(|\)')
+
+illegible_pattern = re.compile(r'\[\?\}')
+tag_pattern = re.compile(r'<.*?>')
+periods_pattern = re.compile(r'\.+')
+quotes_pattern = re.compile(r'\"')
+symbols_pattern = re.compile(r'[*+]')
+title_pattern = re.compile(r'\[T\].*\n+')
+date_pattern = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+hyphen_split_pattern = re.compile(r'(\w+)-\n(\w+)')
+underscore_split_pattern = re.compile(r'(\w+)_\n(\w+)')
+break_line_pattern = re.compile(r'/n')
+separate_pattern = re.compile(r'([.,?!;:])(\w)')
+join_marks_pattern = re.compile(r'(\w)\s([.,?!;:]+)')
+space_before_pattern = re.compile(r'\s+([.,?!;:])')
+extra_punctuation_pattern = re.compile(r'([.,?!;:])+')
+# Junta numa única regra remove_space_before_punctuation, remove_extra_punctuation e separate_punctuation
+punctuation_pattern = re.compile(r'(?:\s*([.,?!;:]))+(\w)?')
+punctuation_marks = '.,?!;:'
+whitespace_pattern = re.compile(r'\s+')
+
+
+def join_split_words(text, offsets=None):
     """
     Junta palavras separadas por um \n
     """
 
-    text = re.sub(r'(\w+)-\n(\w+)', r'\1\2', text)
-    text = re.sub(r'(\w+)_\n(\w+)', r'\1\2', text)
+    if '-\n' in text:
+        text = journaled_sub(hyphen_split_pattern, r'\1\2', text, offsets)
+    if '_\n' in text:
+        text = journaled_sub(underscore_split_pattern, r'\1\2', text, offsets)
     return text
 
 
-def fix_break_lines(text):
-    text = re.sub(r'/n', '\n', text)
+def fix_break_lines(text, offsets=None):
+    text = journaled_sub(break_line_pattern, '\n', text, offsets)
     return text
 
 
-def separate_punctuation(text):
-    text = re.sub(r'([.,?!;:])(\w)', r'\1 \2', text)
+def separate_punctuation(text, offsets=None):
+    text = journaled_sub(separate_pattern, r'\1 \2', text, offsets)
     return text
 
 
-def join_punctuation_marks(text):
-    text = re.sub(r'(\w)\s([.,?!;:]+)', r'\1\2', text)
+def join_punctuation_marks(text, offsets=None):
+    text = journaled_sub(join_marks_pattern, r'\1\2', text, offsets)
     return text
 
 
-def clean_text(text):
+def normalize_spaces(text, offsets=None):
+    """
+    Troca sequências de espaços em branco por um único espaço e remove os das pontas
+    """
+    if offsets is None:
+        return ' '.join(text.split())
+    text = journaled_sub(whitespace_pattern, ' ', text, offsets)
+    return journaled_strip(text, offsets)
+
+
+def clean_text(text, offsets=None):
     """
     Remove caracteres especiais e espaços em branco e as
     marcações de início e fim de parágrafo e afins.
     :param text:
+    :param offsets: OffsetMap onde as edições são registradas
     :return:
     """
-    text = re.sub(r'\[\?\}', '', text).strip()
-    text = re.sub(special_pattern, ' ', text)
-    text = re.sub(marks, '', text)
-    text = re.sub(r'<.*?>', '', text)
-    text = re.sub(r'\.+', '.', text)
-    text = re.sub(r'\"', '', text).strip()
-    text = re.sub(r'\[\?\}', '', text).strip()
-    text = re.sub(r'[*+]', '', text)
-    return ' '.join(text.split())
-
-
-def split_lines(text):
+    # Cada regra só roda se o texto contém os caracteres que ela precisa para casar
+    if '[?}' in text:
+        text = journaled_sub(illegible_pattern, '', text, offsets)
+    text = journaled_strip(text, offsets)
+    text = journaled_sub(special_pattern, ' ', text, offsets)
+    if '[' in text or ']' in text or '(' in text or ')' in text:
+        text = journaled_sub(marks, '', text, offsets)
+    if '<' in text and '>' in text:
+        text = journaled_sub(tag_pattern, '', text, offsets)
+    if '..' in text:
+        text = journaled_sub(periods_pattern, '.', text, offsets)
+    if '"' in text:
+        text = journaled_sub(quotes_pattern, '', text, offsets)
+    text = journaled_strip(text, offsets)
+    if '[?}' in text:
+        text = journaled_sub(illegible_pattern, '', text, offsets)
+    text = journaled_strip(text, offsets)
+    if '*' in text or '+' in text:
+        text = journaled_sub(symbols_pattern, '', text, offsets)
+    return normalize_spaces(text, offsets)
+
+
+@memoize
+def split_lines(text, offsets=None):
     """
     Separa o texto em parágrafos
     :param text:
+    :param offsets: OffsetMap onde as edições do corpo do texto são registradas
     :return:
     """
 
-    title = re.search(r'\[T\].*\n+', text)
+    title = title_pattern.search(text) if '[T]' in text else None
     if title:
         title = title.group(0)
-        text = text.replace(title, '')
+        if offsets is None:
+            text = text.replace(title, '')
+        else:
+            text = journaled_sub(re.compile(re.escape(title)), '', text, offsets)
         title = title.replace('[T]', '').replace('\n', '')
         title = ' '.join(title.split())
     else:
         title = ''
     title = clean_text(title)
-    return title, ' '.join(text.split()).strip().split('\n')
+    return title, normalize_spaces(text, offsets).split('\n')
 
 
-def remove_space_before_punctuation(text):
-    text = re.sub(r'\s+([.,?!;:])', r'\1', text)
+def remove_space_before_punctuation(text, offsets=None):
+    text = journaled_sub(space_before_pattern, r'\1', text, offsets)
     return text
 
 
-def remove_extra_punctuation(text):
-    text = re.sub(r'([.,?!;:])+', r'\1', text)
+def remove_extra_punctuation(text, offsets=None):
+    text = journaled_sub(extra_punctuation_pattern, r'\1', text, offsets)
     return text
 
 
-def fix_date(text):
-    text = re.sub(r'(\d{2})/(\d{2})/(\d{4})', r'\1 \2 \3', text)
+def _replace_punctuation(match):
+    punct, next_char = match.groups()
+    if next_char is None:
+        return punct
+    return punct + ' ' + next_char
+
+
+def normalize_punctuation(text, offsets=None):
+    """
+    Equivale a aplicar remove_space_before_punctuation, remove_extra_punctuation,
+    separate_punctuation e join_punctuation_marks em sequência, mas numa única passada.
+    join_punctuation_marks não tem efeito depois de remove_space_before_punctuation.
+    """
+    if any(punct in text for punct in punctuation_marks):
+        text = journaled_sub(punctuation_pattern, _replace_punctuation, text, offsets)
     return text
 
 
-def preprocess_text(text):
+def fix_date(text, offsets=None):
+    if '/' in text:
+        text = journaled_sub(date_pattern, r'\1 \2 \3', text, offsets)
+    return text
+
 
-    text = fix_date(text)
-    text = join_split_words(text)
-    text = remove_space_before_punctuation(text)
-    text = remove_extra_punctuation(text)
-    text = separate_punctuation(text)
+@memoize
+def preprocess_text(text, offsets=None):
+    """
+    Pré-processa o texto do aluno
+    :param text: texto bruto
+    :param offsets: OffsetMap(len(text)) que recebe as edições, permitindo projetar spans do
+        texto bruto em '\n'.join(lines)
+    :return: título e linhas do texto
+    """
 
-    text = join_punctuation_marks(text)
+    text = fix_date(text, offsets)
+    text = join_split_words(text, offsets)
+    text = normalize_punctuation(text, offsets)
 
-    title, lines = split_lines(text)
-    lines = [clean_text(line) for line in lines]
+    # normalize_spaces remove todas as quebras de linha, então sempre há uma única linha
+    title, lines = split_lines.__wrapped__(text, offsets)
+    lines = [clean_text(line, offsets) for line in lines]
     lines = list(filter(lambda x: x != '', lines))
 
     return title, lines
 
 
+def preprocess_texts(texts):
+    """
+    Pré-processa uma coleção de textos
+    :param texts: iterável de textos
+    :return: gerador de (título, linhas) na mesma ordem dos textos
+    """
+    for text in texts:
+        yield preprocess_text(text)
+
+
 def main():
     json_list = open("../annotations/Semana1/Anotações/anotador1.jsonl", "r", encoding="utf-8").readlines()
-    nlp = spacy.blank("pt")
+    nlp = get_nlp()
     print(preprocess_text("[?} O que é o que é? 12/12/2022"))
     print(preprocess_text(
         '[T] ele [?} ligou para um amigo\n — Álo — Eu achei uma coisa no meu quintal depois da chuva. — Como '
@@ -0,0 +1,219 @@
+"""
+Compact records for the converted documents.
+
+Spans are kept as a structure of arrays (array('i') offsets and small label codes) and token
+labels as an array('b') of label ids, instead of lists of tuples and strings. They still behave
+as the lists they replace (iteration, indexing, len, equality) and convert losslessly to and from
+the JSON schema of the datasets. They are only used inside Document, the functions that find
+spans and labels return plain lists.
+"""
+from array import array
+
+# Defined here rather than in labels so the converters can build records without importing numpy
+LABELS = ['O', 'I-COMMA', 'I-PERIOD']
+label2id = {label: i for i, label in enumerate(LABELS)}
+
+
+class SpanList:
+    """
+    List of (start, end, label) spans stored in three arrays. The code of a span is the index of
+    its label in the labels of the list, so every list has its own few labels.
+    """
+    __slots__ = ('starts', 'ends', 'codes', 'labels')
+
+    def __init__(self, spans=()):
+        """
+        :param spans: iterable of (start, end, label) tuples or [start, end, label] lists
+        """
+        self.starts = array('i')
+        self.ends = array('i')
+        self.codes = array('H')
+        self.labels = []
+        self.extend(spans)
+
+    def code(self, label):
+        try:
+            return self.labels.index(label)
+        except ValueError:
+            self.labels.append(label)
+            return len(self.labels) - 1
+
+    def append(self, span):
+        start, end, label = span
+        self.starts.append(start)
+        self.ends.append(end)
+        self.codes.append(self.code(label))
+
+    def extend(self, spans):
+        for span in spans:
+            self.append(span)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            spans = SpanList()
+            spans.starts, spans.ends, spans.codes = self.starts[index], self.ends[index], self.codes[index]
+            spans.labels = list(self.labels)
+            return spans
+        return self.starts[index], self.ends[index], self.labels[self.codes[index]]
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, map(self.labels.__getitem__, self.codes))
+
+    def __eq__(self, other):
+        if isinstance(other, SpanList):
+            return list(self) == list(other)
+        if isinstance(other, (list, tuple)):
+            return list(self) == [tuple(span) for span in other]
+        return NotImplemented
+
+    def __repr__(self):
+        return f'SpanList({list(self)!r})'
+
+    def __reduce__(self):
+        return SpanList, (list(self),)
+
+    def tolist(self):
+        """Spans as [start, end, label] lists, as in the json files"""
+        return [list(span) for span in self]
+
+
+class LabelSequence:
+    """
+    Labels of the tokens of a text, stored as an array('b') of ids of LABELS
+    """
+    __slots__ = ('ids',)
+
+    def __init__(self, labels=()):
+        """
+        :param labels: iterable of label names
+        """
+        self.ids = array('b', [label2id[label] for label in labels])
+
+    @classmethod
+    def from_ids(cls, ids):
+        """
+        :param ids: iterable of label ids, such as the int8 array returned by text2label_ids
+        """
+        labels = cls()
+        labels.ids = array('b', ids.astype('int8').tobytes()) if hasattr(ids, 'astype') else array('b', ids)
+        return labels
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LabelSequence.from_ids(self.ids[index])
+        return LABELS[self.ids[index]]
+
+    def __iter__(self):
+        return map(LABELS.__getitem__, self.ids)
+
+    def __eq__(self, other):
+        if isinstance(other, LabelSequence):
+            return self.ids == other.ids
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f'LabelSequence({list(self)!r})'
+
+    def __reduce__(self):
+        return LabelSequence.from_ids, (self.ids,)
+
+    def tolist(self):
+        """Label names, as in the json files"""
+        return list(self)
+
+
+class Document:
+    """
+    Converted document with a slot per field of the datasets. Behaves as the dict it replaces:
+    fields are read and written with record['field'], and the span and label fields are stored
+    as SpanList and LabelSequence whatever they are given as.
+    """
+    # Order of the fields in the json files
+    fields = ('text', 'title', 'text_id', 'ents', 'raw_text', 'raw_text_id', 'labels', 'error_labels',
+              'annotations')
+    span_fields = ('ents', 'error_labels', 'annotations')
+    __slots__ = fields + ('extra',)
+
+    def __init__(self, **fields):
+        self.extra = None
+        for name, value in fields.items():
+            self[name] = value
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(**record)
+
+    def __setitem__(self, name, value):
+        if name in self.span_fields:
+            if not isinstance(value, SpanList):
+                value = SpanList(value)
+        elif name == 'labels':
+            if not isinstance(value, LabelSequence):
+                value = LabelSequence(value)
+        elif name not in self.fields:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+            return
+        setattr(self, name, value)
+
+    def __getitem__(self, name):
+        if name in self.fields:
+            try:
+                return getattr(self, name)
+            except AttributeError:
+                raise KeyError(name) from None
+        if self.extra is None:
+            raise KeyError(name)
+        return self.extra[name]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        names = [name for name in self.fields if hasattr(self, name)]
+        return names + list(self.extra or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, (Document, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Document) else
+                                      Document.from_dict(other).to_dict())
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Document({self.to_dict()!r})'
+
+    def __reduce__(self):
+        return Document.from_dict, (self.to_dict(),)
+
+    def to_dict(self):
+        """Record in the schema of the json files"""
+        return {name: value.tolist() if isinstance(value, (SpanList, LabelSequence)) else value
+                for name, value in self.items()}
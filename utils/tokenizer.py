@@ -0,0 +1,256 @@
+import os
+import re
+from array import array
+from collections import namedtuple
+from itertools import accumulate
+from operator import add, sub
+
+from . import tokenizer_rules
+
+# Runs of whitespace and of other characters, spaCy splits the text on them before anything else.
+# A single space after a run of other characters is the trailing whitespace of its last token
+chunk_pattern = re.compile(r'\S+ ?|\s+')
+
+TokenOffsets = namedtuple('TokenOffsets', ['starts', 'ends', 'limits'])
+TokenOffsets.__doc__ = """
+Token offsets of a text as three arrays: start and end character of each token, and
+the end of the token including its trailing space, as spaCy's `token.text_with_ws`.
+"""
+
+
+def _offsets(tokens, spaces):
+    """
+    Build the TokenOffsets from the token strings of the text in order
+    :param tokens: strings of the tokens
+    :param spaces: whether each token is followed by a space
+    """
+    limits = array('l', accumulate(map(add, map(len, tokens), spaces)))
+    ends = array('l', map(sub, limits, spaces))
+    starts = array('l', [0])
+    starts.extend(limits[:-1])
+    return TokenOffsets(starts[:len(limits)], ends, limits)
+
+
+class RegexTokenizer:
+    """
+    Pure Python port of spaCy's tokenizer algorithm with the rules of the blank Portuguese
+    pipeline: whitespace split, special cases, prefixes, suffixes, URLs and infixes.
+    """
+
+    def __init__(self, max_cache_size=100000):
+        """
+        :param max_cache_size: number of whitespace separated chunks whose tokens are kept
+        """
+        self.prefix_search = re.compile('|'.join('^' + piece for piece in tokenizer_rules.prefixes())).search
+        self.suffix_search = re.compile('|'.join(piece + '$' for piece in tokenizer_rules.suffixes())).search
+        self.infix_finditer = re.compile('|'.join(tokenizer_rules.infixes())).finditer
+        self.url_match = re.compile('(?u)' + tokenizer_rules.url_pattern()).match
+        self.specials = tokenizer_rules.special_cases()
+        self.max_cache_size = max_cache_size
+        self.cache = {}
+
+        # Special cases made of affixes are also looked for across the tokens, as spaCy's special matcher.
+        # The ones split into a single token would be replaced by themselves, so only the pairs of
+        # tokens that start a longer phrase are kept
+        self.phrases = {}
+        for orth in self.specials:
+            if self.find_prefix(orth) or self.find_suffix(orth) or list(self.infix_finditer(orth)) or ' ' in orth:
+                phrase = tuple(self.split(orth, with_special_cases=False))
+                if len(phrase) > 1:
+                    self.phrases.setdefault(phrase[:2], []).append(phrase)
+
+    def find_prefix(self, string):
+        match = self.prefix_search(string)
+        return match.end() - match.start() if match else 0
+
+    def find_suffix(self, string):
+        match = self.suffix_search(string)
+        return match.end() - match.start() if match else 0
+
+    def split(self, string, with_special_cases=True):
+        """
+        Tokenize a run of whitespace or of other characters
+        :return: list with the strings of the tokens
+        """
+        if with_special_cases and string in self.specials:
+            return list(self.specials[string])
+        prefixes, suffixes = [], []
+        core = self._split_affixes(string, prefixes, suffixes, with_special_cases)
+        return prefixes + self._attach(core, with_special_cases) + suffixes[::-1]
+
+    def _split_chunk(self, chunk):
+        """
+        Tokenize a chunk of chunk_pattern and cache its tokens
+        :return: tuple with the strings of the tokens and bytes with their trailing spaces
+        """
+        if chunk[-1] == ' ' and not chunk[0].isspace():
+            tokens = tuple(self.split(chunk[:-1]))
+            spaces = bytes(len(tokens) - 1) + b'\x01'
+        else:
+            tokens = tuple(self.split(chunk))
+            spaces = bytes(len(tokens))
+        if len(self.cache) >= self.max_cache_size:
+            self.cache.clear()
+        self.cache[chunk] = tokens, spaces
+        return tokens, spaces
+
+    def _is_special(self, string, with_special_cases):
+        return with_special_cases and string in self.specials
+
+    def _split_affixes(self, string, prefixes, suffixes, with_special_cases):
+        last_size = 0
+        while string and len(string) != last_size:
+            if self._is_special(string, with_special_cases):
+                break
+            last_size = len(string)
+            pre_len = self.find_prefix(string)
+            if pre_len:
+                prefix, minus_pre = string[:pre_len], string[pre_len:]
+                if minus_pre and self._is_special(minus_pre, with_special_cases):
+                    prefixes.append(prefix)
+                    string = minus_pre
+                    break
+            suf_len = self.find_suffix(string[pre_len:])
+            if suf_len:
+                suffix, minus_suf = string[-suf_len:], string[:-suf_len]
+                if minus_suf and self._is_special(minus_suf, with_special_cases):
+                    suffixes.append(suffix)
+                    string = minus_suf
+                    break
+            if pre_len and suf_len and pre_len + suf_len <= len(string):
+                string = string[pre_len:-suf_len]
+                prefixes.append(prefix)
+                suffixes.append(suffix)
+            elif pre_len:
+                string = minus_pre
+                prefixes.append(prefix)
+            elif suf_len:
+                string = minus_suf
+                suffixes.append(suffix)
+        return string
+
+    def _attach(self, string, with_special_cases):
+        if not string:
+            return []
+        if self._is_special(string, with_special_cases):
+            return list(self.specials[string])
+        if self.url_match(string):
+            return [string]
+
+        tokens = []
+        start = 0
+        for match in self.infix_finditer(string):
+            infix_start, infix_end = match.span()
+            if infix_start == 0:
+                continue
+            if infix_start != start:
+                tokens.append(string[start:infix_start])
+            if infix_start != infix_end:
+                tokens.append(string[infix_start:infix_end])
+            start = infix_end
+        if string[start:]:
+            tokens.append(string[start:])
+        return tokens
+
+    def __call__(self, text):
+        """
+        Tokenize the text
+        :return: TokenOffsets of the tokens
+        """
+        tokens = []
+        spaces = bytearray()
+        cached = self.cache.get
+        for chunk in chunk_pattern.findall(text):
+            chunk_tokens, chunk_spaces = cached(chunk) or self._split_chunk(chunk)
+            tokens += chunk_tokens
+            spaces += chunk_spaces
+
+        candidates = [i for i, pair in enumerate(zip(tokens, tokens[1:])) if pair in self.phrases]
+        if candidates:
+            tokens, spaces = self._apply_special_cases(tokens, spaces, candidates)
+        return _offsets(tokens, spaces)
+
+    def _apply_special_cases(self, tokens, spaces, candidates):
+        """
+        Merge the sequences of tokens that spell a special case, as spaCy's special matcher
+        :param candidates: indexes of the tokens that start a pair found in self.phrases
+        """
+        matches = []
+        for i in candidates:
+            for phrase in self.phrases[tokens[i], tokens[i + 1]]:
+                if tuple(tokens[i:i + len(phrase)]) == phrase:
+                    matches.append((i, i + len(phrase)))
+        if not matches:
+            return tokens, spaces
+
+        # The longest and then leftmost matches win, and a match sharing its first or last token
+        # with one seen before is dropped
+        seen = set()
+        kept = []
+        for start, end in sorted(matches, key=lambda match: (match[0] - match[1], match[0])):
+            if start not in seen and end - 1 not in seen:
+                kept.append((start, end))
+            seen.update(range(start, end))
+
+        new_tokens, new_spaces = [], []
+        position = 0
+        for start, end in sorted(kept):
+            # The tokens are only replaced when their text, with the spaces between them, is the special case
+            span_text = ''.join(token + ' ' * space for token, space in zip(tokens[start:end], spaces[start:end]))
+            pieces = self.specials.get(span_text[:-1] if spaces[end - 1] else span_text)
+            if pieces is None:
+                continue
+            new_tokens.extend(tokens[position:start])
+            new_spaces.extend(spaces[position:start])
+            new_tokens.extend(pieces)
+            new_spaces.extend([0] * (len(pieces) - 1) + [spaces[end - 1]])
+            position = end
+        new_tokens.extend(tokens[position:])
+        new_spaces.extend(spaces[position:])
+        return new_tokens, new_spaces
+
+
+class SpacyTokenizer:
+    """
+    Reference backend, tokenizes with spaCy's blank Portuguese pipeline
+    """
+
+    def __call__(self, text):
+        from .alignment import get_nlp
+
+        doc = get_nlp().make_doc(text)
+        return TokenOffsets(array('l', [token.idx for token in doc]),
+                            array('l', [token.idx + len(token) for token in doc]),
+                            array('l', [token.idx + len(token.text_with_ws) for token in doc]))
+
+
+tokenizers = {'regex': RegexTokenizer, 'spacy': SpacyTokenizer}
+_instances = {}
+# Backend used when none is given, can be changed with the PUNCTUATION_TOKENIZER environment variable.
+# spaCy stays the default until the regex backend is clearly faster than it, see benchmarks.tokenizer_parity
+default_tokenizer = os.environ.get('PUNCTUATION_TOKENIZER', 'spacy')
+
+
+def get_tokenizer(name=None):
+    """
+    Shared instance of a tokenizer backend
+    :param name: one of `tokenizers`, None for the default backend
+    :return: callable that returns the TokenOffsets of a text
+    """
+    name = name or default_tokenizer
+    if name not in tokenizers:
+        raise ValueError(f"Tokenizer {name} must be one of {', '.join(tokenizers)}")
+    if name not in _instances:
+        _instances[name] = tokenizers[name]()
+    return _instances[name]
+
+
+def set_tokenizer(name):
+    """
+    Change the default tokenizer backend
+    :param name: one of `tokenizers`
+    """
+    global default_tokenizer
+    if name not in tokenizers:
+        raise ValueError(f"Tokenizer {name} must be one of {', '.join(tokenizers)}")
+    default_tokenizer = name
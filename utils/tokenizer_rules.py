@@ -0,0 +1,193 @@
+"""
+Tokenization rules of spaCy's blank Portuguese pipeline (spaCy 3.x, MIT License), written
+for the standard `re` module so the regex tokenizer doesn't need spaCy installed.
+The character classes spaCy lists by script are built from the Unicode properties instead,
+and kept in tokenizer_classes.py so they are not computed at every start. After a Python
+upgrade with a new Unicode version, write them again with
+
+    python -m utils.tokenizer_rules
+"""
+import os
+import sys
+import unicodedata
+from functools import lru_cache
+
+CLASSES_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokenizer_classes.py')
+
+
+def _escape(code):
+    return f'\\u{code:04x}' if code < 0x10000 else f'\\U{code:08x}'
+
+
+def _ranges(codes):
+    """
+    Character class body matching the given code points
+    :param codes: increasing code points
+    """
+    ranges = []
+    start = end = None
+    for code in codes:
+        if code != end:
+            if start is not None:
+                ranges.append(_escape(start) if start == end - 1 else f'{_escape(start)}-{_escape(end - 1)}')
+            start = code
+        end = code + 1
+    if start is not None:
+        ranges.append(_escape(start) if start == end - 1 else f'{_escape(start)}-{_escape(end - 1)}')
+    return ''.join(ranges)
+
+
+def compute_char_classes():
+    """
+    ALPHA, ALPHA_LOWER, ALPHA_UPPER and ICONS character classes, in a single pass over every code
+    point, astral planes included so emoji count as icons.
+    Letters of scripts without case count as both lower and upper case, as in spaCy.
+    """
+    classes = {'ALPHA': [], 'ALPHA_LOWER': [], 'ALPHA_UPPER': [], 'ICONS': []}
+    category = unicodedata.category
+    for code in range(sys.maxunicode + 1):
+        char = chr(code)
+        if char.isalpha():
+            classes['ALPHA'].append(code)
+            if not char.isupper():
+                classes['ALPHA_LOWER'].append(code)
+            if not char.islower():
+                classes['ALPHA_UPPER'].append(code)
+        elif category(char) == 'So':
+            classes['ICONS'].append(code)
+    return {name: _ranges(codes) for name, codes in classes.items()}
+
+
+@lru_cache(maxsize=None)
+def char_classes():
+    """
+    Character classes of compute_char_classes, read from tokenizer_classes.py when it was written
+    with the Unicode version of this Python and computed again otherwise
+    """
+    from . import tokenizer_classes
+
+    if tokenizer_classes.UNICODE_VERSION == unicodedata.unidata_version:
+        return tokenizer_classes.CLASSES
+    return compute_char_classes()
+
+
+def write_char_classes(path=CLASSES_MODULE):
+    """Write the character classes of this Python's Unicode version to tokenizer_classes.py"""
+    lines = ['"""',
+             'Character classes of the regex tokenizer, written by `python -m utils.tokenizer_rules`.',
+             '"""',
+             f'UNICODE_VERSION = {unicodedata.unidata_version!r}',
+             'CLASSES = {']
+    for name, body in compute_char_classes().items():
+        lines.append(f'    {name!r}: (')
+        # Cut between ranges, so no line splits an escape
+        pieces = body.replace('\\u', '\n\\u').replace('\\U', '\n\\U').split()
+        line = ''
+        for piece in pieces:
+            if len(line) + len(piece) > 100:
+                lines.append(f"        r'{line}'")
+                line = ''
+            line += piece
+        lines.append(f"        r'{line}'),")
+    lines.append('}')
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+LIST_PUNCT = ['…', '……', ',', ':', ';', r'\!', r'\?', '¿', '؟', '¡', r'\(', r'\)', r'\[', r'\]', r'\{', r'\}',
+              '<', '>', '_', '#', r'\*', '&', '。', '？', '！', '，', '、', '；', '：', '～', '·', '।', '،', '۔', '؛',
+              '٪']
+LIST_ELLIPSES = [r'\.\.+', '…']
+LIST_QUOTES = [r"\'", '"', '”', '“', '`', '‘', '´', '’', '‚', ',', '„', '»', '«', '「', '」', '『', '』', '（', '）',
+               '〔', '〕', '【', '】', '《', '》', '〈', '〉', '〈', '〉', '⟦', '⟧']
+LIST_CURRENCY = [r'\$', '£', '€', '¥', '฿', r'US\$', r'C\$', r'A\$', '₽', '﷼', '₴', '₠', '₡', '₢', '₣', '₤', '₥',
+                 '₦', '₧', '₨', '₩', '₪', '₫', '€', '₭', '₮', '₯', '₰', '₱', '₲', '₳', '₴', '₵', '₶', '₷', '₸',
+                 '₹', '₺', '₻', '₼', '₽', '₾', '₿']
+CONCAT_QUOTES = r'\'"”“`‘´’‚,„»«「」『』（）〔〕【】《》〈〉〈〉⟦⟧'
+PUNCT = '|'.join(LIST_PUNCT)
+HYPHENS = '-|–|—|--|---|——|~'
+CURRENCY = '|'.join(LIST_CURRENCY)
+UNITS = ('km|km²|km³|m|m²|m³|dm|dm²|dm³|cm|cm²|cm³|mm|mm²|mm³|ha|µm|nm|yd|in|ft|kg|g|mg|µg|t|lb|oz|m/s|km/h|'
+         'kmh|mph|hPa|Pa|mbar|mb|MB|kb|KB|gb|GB|tb|TB|T|G|M|K|%|км|км²|км³|м|м²|м³|дм|дм²|дм³|см|см²|см³|мм|'
+         'мм²|мм³|нм|кг|г|мг|м/с|км/ч|кПа|Па|мбар|Кб|КБ|кб|Мб|МБ|мб|Гб|ГБ|гб|Тб|ТБ|тбكم|كم²|كم³|م|م²|م³|سم|سم²|'
+         'سم³|مم|مم²|مم³|كم|غرام|جرام|جم|كغ|ملغ|كوب|اكواب')
+
+
+def prefixes():
+    classes = char_classes()
+    return ([r'\w{1,3}\$', '§', '%', '=', '—', '–', r'\+(?![0-9])'] + LIST_PUNCT + LIST_ELLIPSES + LIST_QUOTES
+            + LIST_CURRENCY + [f"[{classes['ICONS']}]"])
+
+
+def suffixes():
+    classes = char_classes()
+    return (LIST_PUNCT + LIST_ELLIPSES + LIST_QUOTES + [f"[{classes['ICONS']}]"]
+            + ["'s", "'S", '’s', '’S', '—', '–']
+            + [r'(?<=[0-9])\+',
+               r'(?<=°[FfCcKk])\.',
+               rf'(?<=[0-9])(?:{CURRENCY})',
+               rf'(?<=[0-9])(?:{UNITS})',
+               rf"(?<=[0-9{classes['ALPHA_LOWER']}%²\-\+{CONCAT_QUOTES}{PUNCT}])\.",
+               rf"(?<=[{classes['ALPHA_UPPER']}][{classes['ALPHA_UPPER']}])\."])
+
+
+def infixes():
+    classes = char_classes()
+    alpha, lower, upper = classes['ALPHA'], classes['ALPHA_LOWER'], classes['ALPHA_UPPER']
+    return ([r'(\w+-\w+(-\w+)*)'] + LIST_ELLIPSES + [f"[{classes['ICONS']}]"]
+            + [r'(?<=[0-9])[+\-\*^](?=[0-9-])',
+               rf'(?<=[{lower}{CONCAT_QUOTES}])\.(?=[{upper}{CONCAT_QUOTES}])',
+               rf'(?<=[{alpha}]),(?=[{alpha}])',
+               rf'(?<=[{alpha}])(?:{HYPHENS})(?=[{alpha}])',
+               rf'(?<=[{alpha}0-9])[:<>=/](?=[{alpha}])'])
+
+
+def url_pattern():
+    return (r'^(?:(?:[\w\+\-\.]{2,})://)?'
+            r'(?:\S+(?::\S*)?@)?'
+            r'(?:'
+            r'(?!(?:10|127)(?:\.\d{1,3}){3})'
+            r'(?!(?:169\.254|192\.168)(?:\.\d{1,3}){2})'
+            r'(?!172\.(?:1[6-9]|2\d|3[0-1])(?:\.\d{1,3}){2})'
+            r'(?:[1-9]\d?|1\d\d|2[01]\d|22[0-3])'
+            r'(?:\.(?:1?\d{1,2}|2[0-4]\d|25[0-5])){2}'
+            r'(?:\.(?:[1-9]\d?|1\d\d|2[0-4]\d|25[0-4]))'
+            r'|'
+            r'(?:(?:[A-Za-z0-9¡-￿][A-Za-z0-9¡-￿_-]{0,62})?[A-Za-z0-9¡-￿]\.)+'
+            rf"(?:[{char_classes()['ALPHA_LOWER']}]{{2,63}})"
+            r')'
+            r'(?::\d{2,5})?'
+            r'(?:[/?#]\S*)?$')
+
+
+EMOTICONS = r"""
+:) :-) :)) :-)) :))) :-))) (: (-: =) (= :] :-] [: [-: [= =] :o) (o: :} :-} 8) 8-) (-8 ;) ;-) (; (-; :( :-( :((
+:-(( :((( :-((( ): )-: =( >:( :') :'-) :'( :'-( :/ :-/ =/ =| :| :-| ]= =[ :1 :P :-P :p :-p :O :-O :o :-o :0 :-0
+:() >:o :* :-* :3 :-3 =3 :> :-> :X :-X :x :-x :D :-D ;D ;-D =D xD XD xDD XDD 8D 8-D ^_^ ^__^ ^___^ >.< >.> <.<
+._. ;_; -_- -__- v.v V.V v_v V_V o_o o_O O_o O_O 0_o o_0 0_0 o.O O.o O.O o.o 0.0 o.0 0.o @_@ <3 <33 <333 </3
+(^_^) (-_-) (._.) (>_<) (*_*) (¬_¬) ಠ_ಠ ಠ︵ಠ (ಠ_ಠ) ¯\(ツ)/¯ (╯°□°）╯︵┻━┻ ><(((*>
+""".split()
+
+ABBREVIATIONS = """
+Adm. Art. art. Av. av. Cia. dom. Dr. dr. e.g. E.g. E.G. e/ou ed. eng. etc. Fund. Gen. Gov. i.e. I.e. I.E. Inc.
+Jr. km/h Ltd. Mr. p.m. Ph.D. Rep. Rev. S/A Sen. Sr. sr. Sra. sra. vs. tel. pág. pag.
+""".split()
+
+
+def special_cases():
+    """
+    Strings that are always tokenized the same way, mapped to their tokens
+    """
+    cases = {orth: (orth,) for orth in [' ', '\t', '\\t', '\n', '\\n', '—', '\xa0', "'", '\\")', '<space>',
+                                        "''", 'C++', 'ä.', 'ö.', 'ü.']}
+    cases.update({f'{letter}.': (f'{letter}.',) for letter in 'abcdefghijklmnopqrstuvwxyz'})
+    cases.update({orth: (orth,) for orth in EMOTICONS + ABBREVIATIONS})
+    cases.update({f'°{unit}.': ('°', unit, '.') for unit in 'cfkCFK'})
+    # Every case with an apostrophe also holds for the typographic one
+    cases.update({orth.replace("'", '’'): tuple(piece.replace("'", '’') for piece in pieces)
+                  for orth, pieces in cases.items() if "'" in orth})
+    return cases
+
+
+if __name__ == '__main__':
+    write_char_classes()
@@ -1,13 +1,15 @@
 import re
 import string
 import json
-import numpy as np
-import spacy
-from nltk import wordpunct_tokenize
-from nltk.tokenize import word_tokenize
 
-nlp = spacy.blank('pt')
+from . import instrument
+from .alignment import get_nlp, TokenAligner
+
+# nltk and numpy are imported inside the functions that use them, so that importing
+# utils stays cheap for the workers that only preprocess or label texts
+
 pattern = re.compile(r'(?<=[a-z|A-z])[.,!?]')
+punctuation_table = str.maketrans('.,!?', '    ')
 
 
 def check_mergebility(annot, ents):
@@ -33,12 +35,17 @@ def check_mergebility(annot, ents):
 
 
 def drop_duplicates(annotation):
+    """
+    Keep the first annotation of each text_id
+    :param annotation: list of dicts with a text_id
+    :return: list without the repeated text_ids, in the same order
+    """
     new_annotation = []
-    texts_ids = []
+    texts_ids = set()
     for annot in annotation:
         if annot["text_id"] not in texts_ids:
             new_annotation.append(annot)
-            texts_ids.append(annot["text_id"])
+            texts_ids.add(annot["text_id"])
     return new_annotation
 
 
@@ -48,29 +55,63 @@ def remove_punctuation(text):
     :param text: text to remove punctuation from
     :return:  text without punctuation
     """
+    from nltk import wordpunct_tokenize
+
     text = [word.lower() for word in wordpunct_tokenize(text)
             if word not in string.punctuation]
     return text
 
 
-def find_token_span(text, token_alignment='expand'):
-    ents = []
-    matches = re.finditer(pattern, text)
-    for match in matches:
+def iter_token_spans(text, token_alignment='expand', tokens_delimiters=None):
+    """
+    Find the token before each period or comma of the text, in a single pass over the text.
+    Same result as calling get_gold_token for every match, but the punctuation is removed
+    and the text tokenized only once, and the delimiters are walked forward with the matches
+    instead of searched backwards from each one.
+    :param text: text to find the tokens in
+    :param token_alignment: alignment of the token
+    :param tokens_delimiters: delimiters of the tokens
+    :return: generator of (start_char, end_char, label) tuples
+    """
+    if tokens_delimiters is None:
+        tokens_delimiters = [' ', '\n', '\t']
+    delimiters = [delimiter for delimiter in tokens_delimiters if len(delimiter) == 1]
+    aligner = None
+    for match in pattern.finditer(text):
         span_start, span_end = match.span()
+        if aligner is None:
+            aligner = TokenAligner(text.translate(punctuation_table))
+            positions = [delimiter.start() for delimiter in re.finditer(
+                '|'.join(map(re.escape, delimiters)), aligner.text)] if delimiters else []
+            i = 0
+
+        new_span = aligner.char_span(span_start, span_end, alignment_mode=token_alignment)
+        if new_span is None or new_span[0] == new_span[1]:
+            # Last delimiter before span_start - 1, as in TokenAligner.backtrack
+            while i < len(positions) and positions[i] < span_start - 1:
+                i += 1
+            start_char = positions[i - 1] + 1 if i else 0
+            new_span = aligner.char_span(start_char, span_start, alignment_mode=token_alignment)
+            if new_span is None:
+                raise ValueError(f"Can't find token for {start_char}:{span_start}, the start end char exceded the text")
+            instrument.count('backtracks')
+
+        instrument.count('spans_aligned')
+
+        if match.group() == ',':
+            yield new_span[0], new_span[1], "I-COMMA"
+        else:
+            yield new_span[0], new_span[1], "I-PERIOD"
 
-        non_puncted_text = re.sub('[.,!?]', ' ', text)
-        start_char, end_char = get_gold_token(non_puncted_text, span_start, span_end,
-                                              tokens_delimiters=None, token_alignment=token_alignment)
-        if text[span_start:span_end] in ['.', '?', '!']:
-            ents.append((start_char, end_char, "I-PERIOD"))
-        elif text[span_start:span_end] in [',']:
-            ents.append((start_char, end_char, "I-COMMA"))
 
-    return ents
+def find_token_span(text, token_alignment='expand'):
+    """
+    :return: list with the (start_char, end_char, label) of the token before each period or comma
+    """
+    return list(iter_token_spans(text, token_alignment=token_alignment))
 
 
-def get_gold_token(text, start_char, end_char, tokens_delimiters=None, token_alignment='expand'):
+def get_gold_token(text, start_char, end_char, tokens_delimiters=None, token_alignment='expand', aligner=None):
     """
     Get the token that corresponds to the gold annotation
     :param text:  text to get the token from
@@ -78,72 +119,74 @@ def get_gold_token(text, start_char, end_char, tokens_delimiters=None, token_ali
     :param end_char:    end character of the gold annotation
     :param tokens_delimiters:  delimiters of the tokens
     :param token_alignment:  alignment of the token
+    :param aligner:  TokenAligner already built for the text, avoids tokenizing it again
     :return:  start and end character of the token
     """
-    print(start_char, end_char)
+    if instrument.debug_hook is not None:
+        instrument.debug_hook('get_gold_token', start_char, end_char)
     if tokens_delimiters is None:
         tokens_delimiters = [' ', '\n', '\t']
-    doc = nlp.make_doc(text)
-    new_span = doc.char_span(*(start_char, end_char), alignment_mode=token_alignment)
+    if aligner is None:
+        aligner = TokenAligner(text)
+    new_span = aligner.char_span(start_char, end_char, alignment_mode=token_alignment)
     assert start_char <= len(text), f"End char {start_char} is bigger than text length {len(text)}"
 
-    if new_span is None or new_span.start_char == new_span.end_char:
+    if new_span is None or new_span[0] == new_span[1]:
 
-        limit_chars = text[:start_char]
-        gold_token = []
         end_char = start_char
+        start_char = aligner.backtrack(start_char, tokens_delimiters)
 
-        for char in reversed(limit_chars):
-
-            if char in tokens_delimiters and start_char != end_char:
-                break
-            else:
-                if start_char > 0:
-                    start_char -= 1
-                else:
-                    break
-                gold_token.append(char)
-
-        try:
-            new_span = doc.char_span(*(start_char, end_char), alignment_mode=token_alignment)
-            start_char, end_char = new_span.start_char, new_span.end_char
-        except AttributeError:
+        new_span = aligner.char_span(start_char, end_char, alignment_mode=token_alignment)
+        if new_span is None:
             raise ValueError(f"Can't find token for {start_char}:{end_char}, the start end char exceded the text")
+        instrument.count('backtracks')
 
-    else:
-        start_char, end_char = new_span.start_char, new_span.end_char
+    instrument.count('spans_aligned')
+    start_char, end_char = new_span
 
     return start_char, end_char
 
 
 def text2labels(sentence):
-    tokens = wordpunct_tokenize(sentence.lower())
-
-    labels = []
-    for i, token in enumerate(tokens):
-        try:
-            if token not in string.punctuation:
-                labels.append('O')
-            elif token in ['.', '?', '!', ';']:
-                labels[-1] = 'I-PERIOD'
-            elif token == ',':
-                labels[-1] = 'I-COMMA'
-        except IndexError:
-            print(sentence)
-            print(tokens)
-            raise ValueError(f"Sentence can't start with punctuation {token}")
-    return labels
+    """
+    :return: list with the label of each token of the sentence
+    """
+    from .labels import LABELS, text2label_ids
+
+    try:
+        _, label_ids = text2label_ids(sentence)
+    except ValueError:
+        if instrument.debug_hook is not None:
+            instrument.debug_hook('text2labels', sentence)
+        raise
+    return [LABELS[label_id] for label_id in label_ids.tolist()]
 
 class NpEncoder(json.JSONEncoder):
     def default(self, obj):
+        import numpy as np
+
         if isinstance(obj, np.integer):
             return int(obj)
         if isinstance(obj, np.floating):
             return float(obj)
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        if hasattr(obj, 'to_dict'):
+            return obj.to_dict()
+        if hasattr(obj, 'tolist'):
+            return obj.tolist()
         return super(NpEncoder, self).default(obj)
+
+
+def __getattr__(name):
+    if name == 'nlp':
+        return get_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def main():
+    from nltk.tokenize import word_tokenize
+
     text = "Olá, Mundo! Irei compra-los a dinheiro!"
     print(word_tokenize(text))
 
@@ -0,0 +1,188 @@
+"""
+Sliding windows over the words of long essays, for models with a maximum sequence length.
+
+The words are the tokens labeled by text2labels, taken from their character offsets, and the
+tokenizer only tells how many model tokens each word takes, so a document is tokenized once.
+Windows end on word boundaries, hold at most max_tokens model tokens and share about `overlap`
+tokens with the next one. The predictions of the windows are stitched back by word position:
+each overlapping region is split in the middle, so every word takes the prediction of the window
+where it has the most context and repeated words never overwrite each other.
+
+    python -m utils.windows datasets/test/student.json --max-tokens 64 --overlap 8
+"""
+import argparse
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from .labels import word_offsets
+
+Window = namedtuple('Window', ['start', 'end', 'keep_start', 'keep_end'])
+Window.__doc__ = """
+Words [start, end) of the document seen by the model, of which the predictions of the words
+[keep_start, keep_end) are kept when stitching
+"""
+
+
+class WhitespaceTokenizer:
+    """
+    Local stand-in for a subword tokenizer, every word takes one token or, with chars_per_token,
+    one token for every chars_per_token characters
+    """
+
+    def __init__(self, chars_per_token=None):
+        self.chars_per_token = chars_per_token
+
+    def __call__(self, words):
+        """
+        :param words: list of words
+        :return: array with the number of tokens of each word
+        """
+        if self.chars_per_token is None:
+            return np.ones(len(words), dtype=np.int64)
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        return np.maximum(-(-lengths // self.chars_per_token), 1)
+
+
+class SubwordTokenizer:
+    """
+    Token counts from a Hugging Face fast tokenizer, which tokenizes all the words of the text in one call
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, words):
+        encoding = self.tokenizer(list(words), is_split_into_words=True, add_special_tokens=False)
+        word_ids = [word_id for word_id in encoding.word_ids() if word_id is not None]
+        return np.bincount(np.asarray(word_ids, dtype=np.int64), minlength=len(words))
+
+
+def make_windows(token_counts, max_tokens=510, overlap=20):
+    """
+    Split a sequence of words into windows of at most max_tokens tokens
+    :param token_counts: number of model tokens of each word
+    :param max_tokens: tokens per window, without the special tokens the model adds
+    :param overlap: tokens shared by consecutive windows, rounded down to whole words
+    :return: list of Window. A word longer than max_tokens gets a window of its own
+    """
+    if overlap >= max_tokens:
+        raise ValueError(f'Overlap {overlap} must be smaller than max_tokens {max_tokens}')
+    counts = np.asarray(token_counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    spans = []
+    start = 0
+    while start < len(counts):
+        end = max(int(np.searchsorted(ends, starts[start] + max_tokens, side='right')), start + 1)
+        spans.append((start, end))
+        if end >= len(counts):
+            break
+        # First word of the next window, so that at most `overlap` tokens are seen twice
+        start = max(int(np.searchsorted(starts, ends[end - 1] - overlap, side='left')), start + 1)
+
+    windows = []
+    keep_start = 0
+    for i, (start, end) in enumerate(spans):
+        keep_end = (spans[i + 1][0] + end) // 2 if i + 1 < len(spans) else end
+        windows.append(Window(start, end, keep_start, keep_end))
+        keep_start = keep_end
+    return windows
+
+
+def stitch(windows, predictions, length=None):
+    """
+    Join the predictions of the windows of a document by word position
+    :param windows: windows of the document, in order
+    :param predictions: label ids of the words of each window
+    :param length: number of words of the document, the end of the last window by default
+    :return: int8 array with the label id of each word
+    """
+    if length is None:
+        length = windows[-1].end if windows else 0
+    labels = np.zeros(length, dtype=np.int8)
+    for window, prediction in zip(windows, predictions):
+        if len(prediction) != window.end - window.start:
+            raise ValueError(f'Window {window.start}:{window.end} has {window.end - window.start} words '
+                             f'and {len(prediction)} predictions')
+        labels[window.keep_start:window.keep_end] = \
+            np.asarray(prediction)[window.keep_start - window.start:window.keep_end - window.start]
+    return labels
+
+
+class WindowedText:
+    """
+    Words of a text with their offsets, token counts and windows
+    """
+
+    def __init__(self, text, tokenizer=None, max_tokens=510, overlap=20, lower=True):
+        """
+        :param text: preprocessed text, as the lines of preprocess_text joined by new lines
+        :param tokenizer: callable from a list of words to the number of tokens of each one,
+            WhitespaceTokenizer by default
+        :param lower: give the words in lowercase to the model, as remove_punctuation does
+        """
+        self.text = text
+        self.offsets = word_offsets(text)
+        self.words = [text[start:end] for start, end in self.offsets.tolist()]
+        if lower:
+            self.words = [word.lower() for word in self.words]
+        self.token_counts = (tokenizer or WhitespaceTokenizer())(self.words)
+        self.windows = make_windows(self.token_counts, max_tokens=max_tokens, overlap=overlap)
+
+    @classmethod
+    def from_raw(cls, raw_text, **kwargs):
+        """Windows of a raw essay, preprocessed with preprocess_text first"""
+        from .preprocess import preprocess_text
+
+        _, lines = preprocess_text(raw_text)
+        return cls('\n'.join(lines), **kwargs)
+
+    def __len__(self):
+        return len(self.words)
+
+    def window_words(self, window):
+        return self.words[window.start:window.end]
+
+    def window_tokens(self, window):
+        return int(self.token_counts[window.start:window.end].sum())
+
+    def stitch(self, predictions):
+        """
+        :param predictions: label ids of the words of each window
+        :return: label ids of the words of the text, aligned with text2labels
+        """
+        return stitch(self.windows, predictions, len(self.words))
+
+
+def main():
+    from .labels import text2label_ids
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Dataset json with the texts')
+    parser.add_argument('--max-tokens', type=int, default=510)
+    parser.add_argument('--overlap', type=int, default=20)
+    parser.add_argument('--chars-per-token', type=int, help='Token counts of the stand-in tokenizer')
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8') as file:
+        records = json.load(file)
+    tokenizer = WhitespaceTokenizer(args.chars_per_token)
+    documents = windows = tokens = mismatches = 0
+    for record in records:
+        windowed = WindowedText(record['text'], tokenizer, max_tokens=args.max_tokens, overlap=args.overlap)
+        _, labels = text2label_ids(record['text'])
+        # Each window predicting the gold labels must give the gold labels back after stitching
+        predictions = [labels[window.start:window.end] for window in windowed.windows]
+        mismatches += not np.array_equal(windowed.stitch(predictions), labels)
+        documents += 1
+        windows += len(windowed.windows)
+        tokens += int(windowed.token_counts.sum())
+    print(json.dumps({'documents': documents, 'windows': windows, 'tokens': tokens,
+                      'windows_per_document': round(windows / documents, 3) if documents else None,
+                      'stitch_mismatches': mismatches}, indent=2))
+
+
+if __name__ == '__main__':
+    main()